@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, List
+from app.database import SessionLocal
+from app.log_config import setup_logger
+from app.locks import LockOcupado, lock_tarefa
+from app.configuracoes import (
+    hora_envio_faturamento,
+    hora_verificacao_reenvio,
+    hora_verificacao_cancelamentos,
+    hora_verificacao_devolucoes,
+    agendador_jitter,
+    agendador_janela_recuperacao,
+    agendador_workers,
+)
+from app.routers.faturamento.models import ExecucaoAgendada
+
+"""
+Módulo do Agendador
+
+Agendador asyncio, iniciado pelo lifespan da aplicação quando `agendador_ativo` é verdadeiro, que substitui
+o loop do `schedule` em `scriptSend.iniciar_agendamento` e os disparos externos pelo N8N.
+
+- Cada job roda uma vez por dia no horário configurado (`hora_*` em `configuracoes`), mais um atraso
+  aleatório de até `agendador_jitter` segundos.
+- Recuperação: na inicialização, a última execução prevista de cada job que não consta no histórico e
+  está dentro de `agendador_janela_recuperacao` horas é executada imediatamente, para o dia previsto.
+- Sobreposição: um job não é iniciado enquanto a execução anterior ainda está em andamento. Entre workers
+  e containers, um advisory lock e o histórico garantem uma única execução por job e dia.
+- Os jobs rodam em um pool de threads (`agendador_workers`), sem bloquear o loop de eventos.
+- Cada execução é gravada em `scanntech_agendamentos` (início, fim, duração, status e erro).
+"""
+
+EXECUTANDO = "executando"
+CONCLUIDO = "concluido"
+ERRO = "erro"
+PULADO = "pulado"
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+class JobAgendado:
+    """
+    Um job diário.
+
+    Args:
+        nome (str): Identifica o job no histórico.
+        hora (str): Horário de execução, no formato HH:MM.
+        funcao (Callable): Chamada como `funcao(data)`, com o dia previsto no formato dd/mm/aaaa.
+    """
+
+    def __init__(self, nome: str, hora: str, funcao: Callable[[str], object]):
+        self.nome = nome
+        self.hora = datetime.strptime(hora, "%H:%M").time()
+        self.funcao = funcao
+
+    def ultima_prevista(self, agora: datetime) -> datetime:
+        prevista = datetime.combine(agora.date(), self.hora)
+        return prevista if prevista <= agora else prevista - timedelta(days=1)
+
+    def proxima_prevista(self, agora: datetime) -> datetime:
+        return self.ultima_prevista(agora) + timedelta(days=1)
+
+
+def jobs_padrao() -> List[JobAgendado]:
+    """
+    Os jobs noturnos, nos horários definidos em `configuracoes`.
+    """
+    from app.routers.faturamento import scriptSend
+
+    def faturamento(data: str):
+        # O fechamento vem logo após o envio das notas do mesmo dia, calculado a partir das mesmas notas
+        scriptSend.tarefa_periodica_pipeline(
+            data_inicial=data, data_final=data, etapas=["faturamento", "fechamento"]
+        )
+
+    return [
+        JobAgendado("faturamento", hora_envio_faturamento, faturamento),
+        JobAgendado(
+            "reenvio",
+            hora_verificacao_reenvio,
+            lambda data: scriptSend.tarefa_periodica_processar_reenvio(),
+        ),
+        JobAgendado(
+            "cancelamentos",
+            hora_verificacao_cancelamentos,
+            lambda data: scriptSend.tarefa_periodica_verificacao_cancelamentos(),
+        ),
+        JobAgendado(
+            "devolucoes",
+            hora_verificacao_devolucoes,
+            lambda data: scriptSend.tarefa_periodica_verificacao_devolucoes(),
+        ),
+    ]
+
+
+class Agendador:
+    """
+    Executa os jobs diários no loop asyncio atual.
+
+    Args:
+        jobs (List[JobAgendado]): Os jobs. Padrão: `jobs_padrao()`.
+        jitter (float): Atraso aleatório máximo, em segundos, somado a cada execução.
+        janela_recuperacao (float): Horas dentro das quais uma execução perdida é recuperada.
+        workers (int): Número de jobs executados ao mesmo tempo.
+    """
+
+    def __init__(
+        self,
+        jobs: List[JobAgendado] = None,
+        jitter: float = agendador_jitter,
+        janela_recuperacao: float = agendador_janela_recuperacao,
+        workers: int = agendador_workers,
+    ):
+        self.jobs = jobs
+        self.jitter = jitter
+        self.janela_recuperacao = timedelta(hours=janela_recuperacao)
+        self.workers = workers
+        self._pool = None
+        self._tarefas = []
+        self._em_execucao = set()
+        self._proximas = {}
+
+    def _registrar(self, **campos) -> int:
+        db = SessionLocal()
+        try:
+            execucao = ExecucaoAgendada(**campos)
+            db.add(execucao)
+            db.commit()
+            return execucao.id
+        finally:
+            db.close()
+
+    def _finalizar(self, execucao_id: int, inicio: float, status: str, erro: str = None):
+        db = SessionLocal()
+        try:
+            execucao = db.get(ExecucaoAgendada, execucao_id)
+            execucao.status = status
+            execucao.erro = erro
+            execucao.finalizado_em = datetime.now()
+            execucao.duracao = round(time.perf_counter() - inicio, 3)
+            db.commit()
+        finally:
+            db.close()
+
+    def _ja_executado(self, job: JobAgendado, prevista: datetime) -> bool:
+        db = SessionLocal()
+        try:
+            return (
+                db.query(ExecucaoAgendada.id)
+                .filter(
+                    (ExecucaoAgendada.job == job.nome)
+                    & (ExecucaoAgendada.agendado_para == prevista)
+                    # Uma linha "executando" sem o lock é de um processo que caiu; a execução é refeita
+                    & ExecucaoAgendada.status.in_([CONCLUIDO, ERRO])
+                )
+                .first()
+                is not None
+            )
+        finally:
+            db.close()
+
+    def _rodar(self, job: JobAgendado, prevista: datetime, recuperacao: bool):
+        # Roda em uma thread do pool
+        try:
+            with lock_tarefa(f"agendador:{job.nome}", "*", [prevista.date()]):
+                # Com o lock, apenas um worker verifica e grava a execução do dia
+                if self._ja_executado(job, prevista):
+                    logger.info("Job %s de %s já executado por outro worker.", job.nome, prevista)
+                    return
+                inicio = time.perf_counter()
+                execucao_id = self._registrar(
+                    job=job.nome,
+                    agendado_para=prevista,
+                    iniciado_em=datetime.now(),
+                    status=EXECUTANDO,
+                    recuperacao=recuperacao,
+                )
+                logger.info("Executando o job %s de %s.", job.nome, prevista)
+                try:
+                    job.funcao(prevista.strftime("%d/%m/%Y"))
+                    self._finalizar(execucao_id, inicio, CONCLUIDO)
+                    logger.info("Job %s de %s concluído.", job.nome, prevista)
+                except Exception as e:
+                    logger.error(f"Erro no job {job.nome} de {prevista}: {e}")
+                    print(f"Erro no job {job.nome} de {prevista}: {e}")
+                    self._finalizar(execucao_id, inicio, ERRO, str(e))
+        except LockOcupado:
+            logger.info("Job %s de %s em execução em outro worker.", job.nome, prevista)
+
+    async def _disparar(self, job: JobAgendado, prevista: datetime, recuperacao: bool = False):
+        if job.nome in self._em_execucao:
+            logger.warning(
+                "Job %s de %s não iniciado: a execução anterior ainda está em andamento.",
+                job.nome,
+                prevista,
+            )
+            await asyncio.get_running_loop().run_in_executor(
+                self._pool,
+                lambda: self._registrar(
+                    job=job.nome,
+                    agendado_para=prevista,
+                    iniciado_em=datetime.now(),
+                    finalizado_em=datetime.now(),
+                    status=PULADO,
+                    erro="execução anterior em andamento",
+                    recuperacao=recuperacao,
+                ),
+            )
+            return
+        self._em_execucao.add(job.nome)
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._pool, self._rodar, job, prevista, recuperacao
+            )
+        except Exception as e:
+            logger.error(f"Erro ao executar o job {job.nome}: {e}")
+        finally:
+            self._em_execucao.discard(job.nome)
+
+    async def _loop_job(self, job: JobAgendado):
+        prevista = None
+        while True:
+            # A referência nunca volta para antes da última execução, mesmo que o sleep acorde adiantado
+            referencia = datetime.now() if prevista is None else max(datetime.now(), prevista)
+            prevista = job.proxima_prevista(referencia)
+            self._proximas[job.nome] = prevista
+            espera = (prevista - datetime.now()).total_seconds()
+            await asyncio.sleep(max(0.0, espera) + random.uniform(0, self.jitter))
+            # O job roda em paralelo; o loop já aguarda a próxima execução
+            asyncio.create_task(self._disparar(job, prevista))
+
+    async def _recuperar(self):
+        agora = datetime.now()
+        loop = asyncio.get_running_loop()
+        for job in self.jobs:
+            prevista = job.ultima_prevista(agora)
+            if agora - prevista > self.janela_recuperacao:
+                continue
+            try:
+                executado = await loop.run_in_executor(
+                    self._pool, self._ja_executado, job, prevista
+                )
+            except Exception as e:
+                logger.error(f"Erro ao consultar o histórico do job {job.nome}: {e}")
+                continue
+            if not executado:
+                logger.warning("Recuperando a execução perdida do job %s de %s.", job.nome, prevista)
+                asyncio.create_task(self._disparar(job, prevista, recuperacao=True))
+
+    def iniciar(self):
+        """
+        Inicia o agendador no loop asyncio em execução.
+        """
+        if self._tarefas:
+            return
+        if self.jobs is None:
+            self.jobs = jobs_padrao()
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="agendador"
+        )
+        self._tarefas = [asyncio.create_task(self._recuperar())] + [
+            asyncio.create_task(self._loop_job(job)) for job in self.jobs
+        ]
+        logger.info("Agendador iniciado com %s jobs.", len(self.jobs))
+
+    def parar(self):
+        for tarefa in self._tarefas:
+            tarefa.cancel()
+        self._tarefas = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    async def executar_para_sempre(self):
+        """
+        Inicia o agendador e bloqueia até ser cancelado (uso fora da API).
+        """
+        self.iniciar()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self.parar()
+
+    def estado(self) -> List[dict]:
+        """
+        Retorna, para cada job, o horário, a próxima execução prevista e se está em execução.
+        """
+        return [
+            {
+                "job": job.nome,
+                "hora": job.hora.strftime("%H:%M"),
+                "proxima": self._proximas.get(job.nome),
+                "em_execucao": job.nome in self._em_execucao,
+            }
+            for job in self.jobs or []
+        ]
+
+
+def historico(job: str = None, limite: int = 50) -> List[dict]:
+    """
+    Retorna as últimas execuções agendadas, da mais recente para a mais antiga.
+    """
+    db = SessionLocal()
+    try:
+        consulta = db.query(ExecucaoAgendada)
+        if job:
+            consulta = consulta.filter(ExecucaoAgendada.job == job)
+        return [
+            {
+                "job": execucao.job,
+                "agendado_para": execucao.agendado_para,
+                "iniciado_em": execucao.iniciado_em,
+                "finalizado_em": execucao.finalizado_em,
+                "duracao": execucao.duracao,
+                "status": execucao.status,
+                "erro": execucao.erro,
+                "recuperacao": execucao.recuperacao,
+            }
+            for execucao in consulta.order_by(ExecucaoAgendada.id.desc()).limit(limite)
+        ]
+    finally:
+        db.close()
+
+
+agendador = Agendador()
@@ -0,0 +1,255 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Hashable, Optional, Set, Tuple
+from app.database import SessionLocal
+from app.log_config import setup_logger
+from app.singleflight import singleflight
+from app.configuracoes import (
+    cache_respostas_ativo,
+    cache_respostas_max_entradas,
+    cache_respostas_ttl,
+    cache_respostas_swr,
+)
+
+"""
+Módulo do Cache de Respostas
+
+Guarda em memória as respostas das rotas de consulta (`/faturamento/`, `/fechamento` e `/solicitacoes`),
+para que os painéis que consultam essas rotas periodicamente sejam atendidos sem recalcular o período nem
+chamar a API da ScannTech a cada requisição.
+
+- As respostas são guardadas pela chave da chamada (ver `singleflight.chave_chamada`), com no máximo
+  `cache_respostas_max_entradas` entradas; as menos usadas são removidas primeiro (LRU).
+- Durante o TTL, a resposta é devolvida direto da memória. Depois dele, e por mais `cache_respostas_swr`
+  segundos, a resposta antiga ainda é devolvida enquanto uma thread de fundo a recalcula
+  (stale-while-revalidate); após esse prazo, a requisição espera o novo cálculo.
+- Os cálculos passam pelo single-flight, de forma que uma atualização em segundo plano e uma requisição
+  simultânea com a mesma chave compartilham a mesma consulta.
+- `invalidar` remove as respostas de um endpoint e/ou filial (ex.: após os envios) e `invalidar_alteracoes`
+  remove as que cobrem as (filial, data) alteradas (ver `app.mudancas`).
+"""
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+class _Entrada:
+    __slots__ = ("valor", "expira_em", "obsoleta_em")
+
+    def __init__(self, valor, expira_em: float, obsoleta_em: float):
+        self.valor = valor
+        self.expira_em = expira_em
+        self.obsoleta_em = obsoleta_em
+
+
+class CacheRespostas:
+    """
+    Cache LRU em memória com TTL e stale-while-revalidate.
+
+    Args:
+        max_entradas (int): Número máximo de respostas guardadas.
+        ttl (float): Segundos em que uma resposta é devolvida sem recalcular.
+        swr (float): Segundos após o TTL em que a resposta antiga é devolvida enquanto é atualizada.
+    """
+
+    def __init__(
+        self,
+        max_entradas: int = cache_respostas_max_entradas,
+        ttl: float = cache_respostas_ttl,
+        swr: float = cache_respostas_swr,
+    ):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.swr = swr
+        self._entradas = OrderedDict()
+        self._atualizando = set()
+        # Geração de cada chave em cálculo, incrementada quando a chave é invalidada: um cálculo iniciado
+        # antes da invalidação não é guardado. As demais chaves não são afetadas
+        self._geracoes = {}
+        # Chave -> número de cálculos em andamento
+        self._calculando = {}
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.obsoletos = 0
+        self.faltas = 0
+
+    def obter(self, chave: Hashable, funcao: Callable, *args, db=None, ttl: float = None, **kwargs):
+        """
+        Retorna a resposta guardada, ou a calcula com `funcao(*args, **kwargs)` e a guarda.
+
+        Args:
+            chave (Hashable): A chave da chamada (ver `chave_chamada`).
+            funcao (Callable): A função que calcula a resposta.
+            db (Session, opcional): Sessão passada como primeiro argumento da função. As atualizações em
+                segundo plano usam uma sessão própria, já que a da requisição é fechada ao fim dela.
+            ttl (float, opcional): TTL desta chave. Padrão: o TTL do cache.
+
+        Returns:
+            A resposta. Respostas None (erro no cálculo) não são guardadas.
+        """
+        if not cache_respostas_ativo:
+            return self._calcular(chave, funcao, args, kwargs, db)
+
+        agora = time.monotonic()
+        atualizar = False
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and agora < entrada.obsoleta_em:
+                self._entradas.move_to_end(chave)
+                if agora < entrada.expira_em:
+                    self.acertos += 1
+                    return entrada.valor
+                self.obsoletos += 1
+                if chave not in self._atualizando:
+                    self._atualizando.add(chave)
+                    atualizar = True
+            else:
+                entrada = None
+                self.faltas += 1
+                geracao = self._iniciar(chave)
+
+        if entrada is not None:
+            if atualizar:
+                threading.Thread(
+                    target=self._atualizar,
+                    args=(chave, funcao, args, kwargs, db is not None, ttl),
+                    name="cache-respostas",
+                    daemon=True,
+                ).start()
+            return entrada.valor
+
+        valor = None
+        try:
+            valor = self._calcular(chave, funcao, args, kwargs, db)
+        finally:
+            self._guardar(chave, valor, ttl, geracao)
+        return valor
+
+    @staticmethod
+    def _calcular(chave, funcao, args, kwargs, db):
+        if db is not None:
+            args = (db,) + tuple(args)
+        return singleflight.executar(chave, funcao, *args, **kwargs)
+
+    def _iniciar(self, chave) -> int:
+        # Chamado com o lock: registra o cálculo da chave e retorna a sua geração atual
+        self._calculando[chave] = self._calculando.get(chave, 0) + 1
+        return self._geracoes.get(chave, 0)
+
+    def _atualizar(self, chave, funcao, args, kwargs, com_sessao: bool, ttl: float):
+        with self._lock:
+            geracao = self._iniciar(chave)
+        db = SessionLocal() if com_sessao else None
+        valor = None
+        try:
+            valor = self._calcular(chave, funcao, args, kwargs, db)
+        except Exception as e:
+            # A resposta antiga continua sendo devolvida até o fim do prazo
+            logger.error(f"Erro ao atualizar a resposta {chave} em segundo plano: {e}")
+        finally:
+            self._guardar(chave, valor, ttl, geracao)
+            if db is not None:
+                db.close()
+            with self._lock:
+                self._atualizando.discard(chave)
+
+    def _guardar(self, chave, valor, ttl: float, geracao: int):
+        # Encerra o cálculo iniciado em `_iniciar` e guarda o valor se a chave não foi invalidada
+        ttl = self.ttl if ttl is None else ttl
+        agora = time.monotonic()
+        with self._lock:
+            invalidada = geracao != self._geracoes.get(chave, 0)
+            self._calculando[chave] -= 1
+            if not self._calculando[chave]:
+                del self._calculando[chave]
+                self._geracoes.pop(chave, None)
+            if valor is None or invalidada:
+                return
+            self._entradas[chave] = _Entrada(valor, agora + ttl, agora + ttl + self.swr)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def _remover(self, condicao: Callable[[Hashable], bool]) -> int:
+        with self._lock:
+            # Os cálculos em andamento das chaves invalidadas não são guardados
+            for chave in self._calculando:
+                if condicao(chave):
+                    self._geracoes[chave] = self._geracoes.get(chave, 0) + 1
+            chaves = [chave for chave in self._entradas if condicao(chave)]
+            for chave in chaves:
+                del self._entradas[chave]
+        return len(chaves)
+
+    def invalidar(self, endpoint: str = None, centro: str = None) -> int:
+        """
+        Remove as respostas de um endpoint e/ou de uma filial. As respostas sem filial (todas as filiais)
+        também são removidas ao invalidar uma filial.
+
+        Returns:
+            int: O número de respostas removidas.
+        """
+
+        def condicao(chave) -> bool:
+            if endpoint is not None and chave[0] != endpoint:
+                return False
+            return centro is None or dict(chave[1:]).get("centro") in (centro, None)
+
+        removidas = self._remover(condicao)
+        if removidas:
+            logger.info(
+                "Cache de respostas: %s respostas invalidadas (endpoint %s, filial %s).",
+                removidas,
+                endpoint,
+                centro,
+            )
+        return removidas
+
+    def invalidar_alteracoes(self, alteracoes: Optional[Set[Tuple[str, date]]]):
+        """
+        Remove as respostas de faturamento e fechamento cujo período e filial cobrem as (filial, data)
+        alteradas, ou todas elas se `alteracoes` for None (ver `app.mudancas`).
+        """
+
+        def condicao(chave) -> bool:
+            if chave[0] not in ("faturamento", "fechamento"):
+                return False
+            if alteracoes is None:
+                return True
+            parametros = dict(chave[1:])
+            try:
+                inicio = date.fromisoformat(parametros.get("start"))
+                fim = date.fromisoformat(parametros.get("end"))
+            except (TypeError, ValueError):
+                return True
+            return any(
+                inicio <= dia <= fim and parametros.get("centro") in (filial, None)
+                for filial, dia in alteracoes
+            )
+
+        self._remover(condicao)
+
+    def limpar(self):
+        self._remover(lambda chave: True)
+
+    def estado(self) -> dict:
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "ttl": self.ttl,
+                "swr": self.swr,
+                "acertos": self.acertos,
+                "obsoletos": self.obsoletos,
+                "faltas": self.faltas,
+                "atualizando": len(self._atualizando),
+            }
+
+
+cache_respostas = CacheRespostas()
@@ -1,6 +1,4 @@
 import base64
-import os
-import time
 from dotenv import load_dotenv
 from decouple import config
 
@@ -15,9 +13,16 @@ agrupar_outros_flag = True
 
 # tempo para manter arquivo de log e data
 tempo_manter_arquivo = 60  # dias
+# dias após os quais as pastas de data e os logs rotacionados são compactados
+tempo_compactar_arquivo = 7  # dias
+# intervalo entre as execuções da rotina de retenção
+intervalo_retencao = 6  # horas
 
 # url_base = "https://test-parceiro.scanntech.com/api-minoristas/api"
-url_base = "http://parceiro.scanntech.com/api-minoristas/api"
+# Pode ser sobrescrita pela variável SCANNTECH_URL_BASE (ex.: para apontar para o mock em bench/)
+url_base = config(
+    "SCANNTECH_URL_BASE", default="http://parceiro.scanntech.com/api-minoristas/api"
+)
 # idEmpresa = 74984 # Teste
 idEmpresa = 88975  # Produção
 idLocal = 1
@@ -26,8 +31,101 @@ hora_envio_faturamento = "21:00"
 hora_verificacao_reenvio = "21:05"
 hora_verificacao_cancelamentos = "21:10"
 hora_verificacao_devolucoes = "21:15"
+# Agendador interno (app/agendador.py). Desligado enquanto os agendamentos são feitos pelo N8N
+agendador_ativo = False
+agendador_jitter = 60  # segundos aleatórios somados a cada execução
+agendador_janela_recuperacao = 12  # horas: execuções perdidas dentro da janela rodam na inicialização
+agendador_workers = 2  # jobs agendados executados ao mesmo tempo
 filiais = ["0101", "0102", "0103", "0104", "0105", "0106", "0107", "0201"]
 
+# Cliente HTTP da ScannTech
+scanntech_timeout_conexao = 5  # segundos
+scanntech_timeout_leitura = 120  # segundos
+scanntech_tentativas = 4  # total de tentativas por chamada
+scanntech_backoff_base = 1.0  # segundos, dobra a cada tentativa
+scanntech_backoff_maximo = 30.0  # segundos
+scanntech_tamanho_pool = 10  # conexões mantidas por host
+scanntech_limite_falhas = 5  # falhas seguidas que abrem o circuito de uma família de endpoint
+scanntech_tempo_abertura = 60  # segundos com o circuito aberto antes da chamada de teste
+scanntech_taxa_requisicoes = 5  # requisições por segundo por família de endpoint
+scanntech_rajada = 10  # requisições permitidas em rajada
+
+# Divisão dos movimientos em lotes
+lote_max_notas = 500  # notas por lote
+lote_max_bytes = 2_000_000  # bytes por lote
+lote_envios_concorrentes = 4  # lotes enviados em paralelo por filial
+
+# Envia apenas as notas novas ou alteradas desde o último envio (modo delta)
+envio_delta = True
+
+# Outbox de envios para a ScannTech
+outbox_intervalo = 60  # segundos entre as drenagens dos envios pendentes
+outbox_lote_drenagem = 50  # envios reservados por drenagem
+outbox_max_tentativas = 8  # tentativas antes de marcar o envio como erro
+outbox_backoff_base = 60  # segundos, dobra a cada tentativa
+outbox_backoff_maximo = 3600  # segundos
+outbox_tempo_reserva = 600  # segundos até um envio "enviando" abandonado ser reenviado (mínimo; ver outbox.TEMPO_RESERVA)
+
+# Preparação dos movimientos ao longo do dia (scanntech_payloads_preparados), enviados prontos no horário
+preparacao_ativa = False
+preparacao_intervalo = 900  # segundos entre as preparações
+
+# Envio em microlotes ao longo do dia: as notas criadas desde o último microlote são enviadas a cada intervalo
+# (requer o modo delta, para que o envio noturno não reenvie as notas já enviadas)
+microlote_ativo = False
+microlote_intervalo = 600  # segundos entre os microlotes
+
+# Notificações de mudança em hanasync_faturamento_notas (LISTEN/NOTIFY), consumidas pela API
+mudancas_ativo = False
+mudancas_canal = "hanasync_faturamento"  # canal do NOTIFY (trigger ou fim da sincronização)
+mudancas_criar_trigger = True  # cria o trigger que notifica as (filial, data) alteradas
+mudancas_reconexao = 30  # segundos até reconectar o listener após uma falha
+mudancas_disparar_envios = False  # se verdadeiro, uma mudança antecipa a preparação e o microlote
+
+# Consulta as filiais com notas no período antes do envio do faturamento e do fechamento e pula as demais
+planejamento_ativo = True
+
+# Cache em disco das notas agregadas dos dias fechados (SQLite), usado pelas rotas de consulta
+cache_dias_ativo = True
+cache_dias_arquivo = "cache/faturamento_dias.sqlite3"
+cache_dias_max_bytes = 200_000_000  # tamanho máximo; os dias menos acessados são removidos primeiro
+
+# Cache em memória das respostas de /faturamento/, /fechamento e /solicitacoes
+cache_respostas_ativo = True
+cache_respostas_max_entradas = 256  # as respostas menos usadas são removidas primeiro
+cache_respostas_ttl = 60  # segundos em que a resposta é devolvida sem recalcular
+cache_respostas_ttl_solicitacoes = 300  # segundos; cada cálculo consulta a API da ScannTech
+cache_respostas_swr = 600  # segundos após o TTL em que a resposta antiga é devolvida enquanto é atualizada
+
+# ETag nas rotas /faturamento/ e /fechamento: um cliente com a versão atual recebe 304 sem recálculo
+etag_ativo = True
+
+# Número máximo de filiais processadas em paralelo pelas tarefas periódicas
+max_filiais_concorrentes = 4
+
+# Número máximo de reenvios (filial, dia, tipo) processados em paralelo a partir das solicitações da ScannTech
+reenvio_concorrentes = 4
+
+# Número máximo de jobs (envios e verificações disparados pela API) executados ao mesmo tempo
+jobs_concorrentes = 2
+jobs_heartbeat = 60  # segundos entre as atualizações do heartbeat dos jobs em andamento
+jobs_tempo_heartbeat = 600  # segundos sem heartbeat até um job pendente ou em execução ser marcado como interrompido
+
+# Fila de tarefas distribuída (scanntech_fila_tarefas), consumida por `python -m app.worker`
+fila_threads = 4  # tarefas executadas ao mesmo tempo por worker
+fila_intervalo = 5  # segundos de espera quando a fila está vazia
+fila_max_tentativas = 3  # tentativas antes de marcar a tarefa como erro
+fila_backoff = 300  # segundos até uma tarefa com erro voltar para a fila
+fila_tempo_reserva = 3600  # segundos até uma tarefa "executando" abandonada voltar para a fila
+fila_worker_na_api = False  # se verdadeiro, a própria API também consome a fila
+
+# Notificações no Telegram
+telegram_chat_id = -4209916479
+notificacao_debounce = 5  # segundos de espera para juntar as mensagens de uma execução
+notificacao_tentativas = 5  # tentativas por mensagem
+notificacao_backoff_base = 2.0  # segundos, dobra a cada tentativa
+notificacao_backoff_maximo = 60.0  # segundos
+
 
 def converte_base64(usuario, senha):
     """
@@ -52,29 +150,3 @@ headers = {
     "pdv-version": "1.0.0",
 }
 
-
-def limpar_arquivos_antigos(diretorio, dias):
-    """
-    Remove arquivos antigos de um diretório.
-
-    Args:
-        diretorio (str): O caminho para o diretório onde os arquivos serão verificados e removidos.
-        dias (int): O número de dias a partir dos quais os arquivos serão considerados antigos.
-
-    Returns:
-        None
-
-    Raises:
-        None
-    """
-    agora = time.time()
-    periodo = dias * 86400  # Convertendo dias para segundos
-
-    if os.path.exists(diretorio):
-        for arquivo in os.listdir(diretorio):
-            caminho_arquivo = os.path.join(diretorio, arquivo)
-            if os.path.isfile(caminho_arquivo):
-                idade_arquivo = agora - os.path.getmtime(caminho_arquivo)
-                if idade_arquivo > periodo:
-                    os.remove(caminho_arquivo)
-                    print(f"Arquivo removido: {caminho_arquivo}")
@@ -0,0 +1,112 @@
+import asyncio
+import itertools
+import threading
+from collections import deque
+from datetime import datetime
+from typing import List
+
+"""
+Módulo de Eventos
+
+Barramento de eventos em memória, usado para acompanhar em tempo real as tarefas de envio.
+
+As tarefas (que rodam em threads) publicam um evento a cada etapa concluída de uma filial, com a
+quantidade de registros e a duração da etapa:
+
+- iniciado / concluido / erro: início e fim da tarefa na filial (ver `executar_por_filial`).
+- pulado: filial sem notas no período, não executada (ver `planejador`).
+- consultado: itens de faturamento lidos do banco.
+- agregado: notas montadas a partir dos itens.
+- serializado: notas serializadas para envio (após o filtro do modo delta).
+- gravado: envios gravados no outbox.
+- enviado: envios aceitos pela API externa.
+
+Os assinantes (ex.: a rota SSE `/eventos`) recebem os eventos em uma `asyncio.Queue` do seu próprio loop.
+Um assinante lento não bloqueia quem publica: quando a sua fila está cheia, os eventos são descartados
+para ele. Os últimos eventos ficam guardados para que um cliente que reconecta possa recuperá-los.
+"""
+
+
+class BarramentoEventos:
+    """
+    Barramento de eventos publicado por threads e consumido por loops asyncio.
+
+    Args:
+        historico (int): Número de eventos recentes mantidos em memória.
+        tamanho_fila (int): Número máximo de eventos pendentes por assinante.
+    """
+
+    def __init__(self, historico: int = 500, tamanho_fila: int = 1000):
+        self.tamanho_fila = tamanho_fila
+        self._historico = deque(maxlen=historico)
+        self._assinantes = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publicar(self, etapa: str, **dados) -> dict:
+        """
+        Publica um evento.
+
+        Args:
+            etapa (str): A etapa concluída (ex.: "consultado").
+            **dados: Os dados do evento (ex.: filial, tarefa, quantidade, duracao).
+
+        Returns:
+            dict: O evento publicado, com id e momento.
+        """
+        with self._lock:
+            evento = {
+                "id": next(self._ids),
+                "etapa": etapa,
+                "momento": datetime.now().isoformat(),
+                **dados,
+            }
+            self._historico.append(evento)
+            assinantes = list(self._assinantes.items())
+        for fila, loop in assinantes:
+            try:
+                loop.call_soon_threadsafe(self._entregar, fila, evento)
+            except RuntimeError:
+                # O loop do assinante foi encerrado
+                self.cancelar(fila)
+        return evento
+
+    @staticmethod
+    def _entregar(fila: asyncio.Queue, evento: dict):
+        try:
+            fila.put_nowait(evento)
+        except asyncio.QueueFull:
+            pass
+
+    def assinar(self) -> asyncio.Queue:
+        """
+        Registra um assinante no loop asyncio atual.
+
+        Returns:
+            asyncio.Queue: A fila onde os novos eventos são entregues. Deve ser liberada com `cancelar`.
+        """
+        fila = asyncio.Queue(maxsize=self.tamanho_fila)
+        with self._lock:
+            self._assinantes[fila] = asyncio.get_running_loop()
+        return fila
+
+    def cancelar(self, fila: asyncio.Queue):
+        with self._lock:
+            self._assinantes.pop(fila, None)
+
+    def recentes(self, desde_id: int = 0) -> List[dict]:
+        """
+        Retorna os eventos guardados com id maior que `desde_id`.
+        """
+        with self._lock:
+            return [evento for evento in self._historico if evento["id"] > desde_id]
+
+
+barramento_eventos = BarramentoEventos()
+
+
+def publicar(etapa: str, **dados) -> dict:
+    """
+    Publica um evento no barramento da aplicação (ver `BarramentoEventos.publicar`).
+    """
+    return barramento_eventos.publicar(etapa, **dados)
@@ -0,0 +1,96 @@
+import hashlib
+import logging
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import List
+from sqlalchemy import text
+from app.database import engine
+from app.log_config import setup_logger
+
+"""
+Módulo de Locks
+
+Locks distribuídos sobre os advisory locks do Postgres, para que uma mesma tarefa não rode ao mesmo tempo
+para a mesma filial e data em mais de um worker do uvicorn ou container.
+
+Cada lock é identificado por (tarefa, filial, data) e convertido em uma chave de 64 bits. O lock é de
+sessão: fica preso a uma conexão dedicada, em autocommit, durante toda a execução, e é liberado ao final
+ou automaticamente pelo Postgres se o processo cair. Um período com vários dias obtém um lock por dia,
+de forma que períodos sobrepostos também se excluem.
+"""
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+class LockOcupado(Exception):
+    """
+    A tarefa já está em execução para a mesma filial e data em outro worker.
+    """
+
+
+def chave_lock(tarefa: str, filial: str, data: date) -> int:
+    """
+    Converte (tarefa, filial, data) em uma chave de advisory lock (inteiro de 64 bits com sinal).
+    """
+    resumo = hashlib.sha256(f"{tarefa}:{filial}:{data.isoformat()}".encode()).digest()
+    return int.from_bytes(resumo[:8], "big", signed=True)
+
+
+def dias_periodo(data_inicial: str = None, data_final: str = None) -> List[date]:
+    """
+    Retorna os dias de um período no formato dd/mm/aaaa. Datas não informadas equivalem à data atual.
+    """
+    hoje = datetime.now().date()
+    inicio = datetime.strptime(data_inicial, "%d/%m/%Y").date() if data_inicial else hoje
+    fim = datetime.strptime(data_final, "%d/%m/%Y").date() if data_final else hoje
+    return [inicio + timedelta(days=i) for i in range((fim - inicio).days + 1)]
+
+
+@contextmanager
+def lock_tarefa(tarefa: str, filial: str, dias: List[date]):
+    """
+    Obtém os locks de uma tarefa para uma filial e dias, sem esperar.
+
+    Args:
+        tarefa (str): Nome da tarefa (ex.: "faturamento").
+        filial (str): A filial.
+        dias (List[date]): Os dias processados pela tarefa.
+
+    Raises:
+        LockOcupado: Se algum dos dias já estiver com o lock em outro worker. Nenhum lock fica preso.
+
+    Exemplo de uso:
+    ```
+    with lock_tarefa("faturamento", "0101", dias_periodo("01/08/2024", "01/08/2024")):
+        ...
+    ```
+    """
+    chaves = sorted({chave_lock(tarefa, filial, dia) for dia in dias})
+    conexao = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    obtidas = []
+    try:
+        for chave in chaves:
+            obtido = conexao.execute(
+                text("SELECT pg_try_advisory_lock(:chave)"), {"chave": chave}
+            ).scalar()
+            if not obtido:
+                raise LockOcupado(
+                    f"{tarefa} já está em execução para a filial {filial} em outro worker"
+                )
+            obtidas.append(chave)
+        yield
+    finally:
+        try:
+            for chave in obtidas:
+                conexao.execute(
+                    text("SELECT pg_advisory_unlock(:chave)"), {"chave": chave}
+                )
+        except Exception as e:
+            # A conexão volta ao pool com os locks presos; descartá-la faz o Postgres liberá-los
+            logger.error(f"Erro ao liberar os locks de {tarefa}/{filial}: {e}")
+            conexao.invalidate()
+        conexao.close()
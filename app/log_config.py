@@ -1,7 +1,6 @@
 import os
 import logging
 from logging.handlers import TimedRotatingFileHandler
-from app.configuracoes import limpar_arquivos_antigos
 
 
 def setup_logger():
@@ -10,10 +9,7 @@ def setup_logger():
     if not os.path.exists(log_directory):
         os.makedirs(log_directory)
 
-    # Limpar arquivos antigos
-    limpar_arquivos_antigos(
-        log_directory, 60
-    )  # 30 dias, você pode ajustar conforme necessário
+    # A limpeza dos logs antigos é feita pela rotina agendada em app.retencao
 
     # Configuração do logger
     logger = logging.getLogger(__name__)
@@ -26,7 +22,7 @@ def setup_logger():
             filename=os.path.join(log_directory, "app.log"),
             when="midnight",
             interval=1,
-            backupCount=30,  # Manter logs dos últimos 30 dias
+            backupCount=0,  # Sem remoção: a retenção (app/retencao.py) compacta e remove os logs antigos
         )
         file_handler.suffix = "%Y-%m-%d"
         file_formatter = logging.Formatter(
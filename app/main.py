@@ -1,13 +1,110 @@
+import logging
 import threading
+from contextlib import asynccontextmanager
+from datetime import datetime
 from fastapi import FastAPI, Depends
 from app.routers.faturamento.scriptSend import iniciar_agendamento
 from .routers.login import login
 from .routers.faturamento import faturamento
 from .routers.envios import envios
 from .database import SessionLocal
+from .retencao import gerenciador_retencao
+from .migracoes import aplicar_migracoes
+from .routers.faturamento.outbox import drenador_outbox
+from .notificacoes import fila_notificacoes
+from .routers.faturamento.jobs import gerenciador_jobs
+from .routers.faturamento.fila import worker_fila
+from .routers.faturamento.preparacao import preparador_payloads
+from .routers.faturamento.microlote import enviador_microlotes
+from .routers.faturamento.cache_dias import cache_dias
+from .cache_respostas import cache_respostas
+from .serializacao import RespostaJSON
+from .mudancas import instalar_trigger, monitor_mudancas
+from .configuracoes import (
+    fila_worker_na_api,
+    agendador_ativo,
+    preparacao_ativa,
+    microlote_ativo,
+    cache_dias_ativo,
+    cache_respostas_ativo,
+    mudancas_ativo,
+    mudancas_criar_trigger,
+    mudancas_disparar_envios,
+)
+from .agendador import agendador
+from .log_config import setup_logger
 import ssl
 
-app = FastAPI()
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def antecipar_envios(alteracoes):
+    """
+    Antecipa a preparação das filiais alteradas hoje e o próximo microlote (ver `app.mudancas`).
+    """
+    hoje = datetime.now().date()
+    if alteracoes is not None:
+        filiais_alteradas = sorted({filial for filial, dia in alteracoes if dia == hoje})
+        if not filiais_alteradas:
+            return
+    else:
+        filiais_alteradas = None
+    if preparacao_ativa:
+        preparador_payloads.acordar(filiais_alteradas)
+    if microlote_ativo:
+        enviador_microlotes.acordar()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Inicia as rotinas de fundo da aplicação e as encerra no desligamento.
+    """
+    aplicar_migracoes()
+    gerenciador_jobs.marcar_interrompidos()
+    gerenciador_jobs.iniciar()
+    gerenciador_retencao.iniciar()
+    drenador_outbox.iniciar()
+    if fila_worker_na_api:
+        worker_fila.iniciar()
+    if preparacao_ativa:
+        preparador_payloads.iniciar()
+    if microlote_ativo:
+        enviador_microlotes.iniciar()
+    if mudancas_ativo:
+        if mudancas_criar_trigger:
+            try:
+                instalar_trigger()
+            except Exception as e:
+                # Sem permissão na tabela da sincronização, o listener ainda recebe o NOTIFY da própria sincronização
+                logger.error(f"Erro ao instalar os triggers de mudanças: {e}")
+        if cache_dias_ativo:
+            monitor_mudancas.ao_mudar(cache_dias.invalidar)
+        if cache_respostas_ativo:
+            monitor_mudancas.ao_mudar(cache_respostas.invalidar_alteracoes)
+        if mudancas_disparar_envios:
+            monitor_mudancas.ao_mudar(antecipar_envios)
+        monitor_mudancas.iniciar()
+    if agendador_ativo:
+        agendador.iniciar()
+    yield
+    monitor_mudancas.parar()
+    agendador.parar()
+    preparador_payloads.parar()
+    enviador_microlotes.parar()
+    worker_fila.parar(timeout=0)
+    gerenciador_jobs.parar()
+    fila_notificacoes.parar()
+    drenador_outbox.parar()
+    gerenciador_retencao.parar()
+
+
+# As respostas são serializadas com orjson (ver `app.serializacao`)
+app = FastAPI(lifespan=lifespan, default_response_class=RespostaJSON)
 
 
 # Dependency
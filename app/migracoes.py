@@ -0,0 +1,67 @@
+import logging
+from sqlalchemy import text
+from app.database import Base, engine
+from app.log_config import setup_logger
+from app.routers.faturamento import models
+
+"""
+Módulo de Migrações
+
+As tabelas `hanasync_*` são mantidas pela sincronização com o HANA e não são alteradas aqui. Este módulo
+apenas garante, de forma idempotente, as tabelas e colunas usadas pela própria API:
+
+- TABELAS: tabelas novas, criadas com `create_all` caso ainda não existam.
+- MIGRACOES: comandos SQL idempotentes (`IF NOT EXISTS`) executados na ordem, a cada inicialização.
+"""
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+TABELAS = [
+    models.NotaEnviada.__table__,
+    models.Job.__table__,
+    models.TarefaFila.__table__,
+    models.ExecucaoAgendada.__table__,
+    models.PayloadPreparado.__table__,
+    models.MarcaMicrolote.__table__,
+]
+
+MIGRACOES = [
+    # Outbox de envios (scanntech_envios)
+    "ALTER TABLE scanntech_envios ADD COLUMN IF NOT EXISTS status VARCHAR",
+    "ALTER TABLE scanntech_envios ADD COLUMN IF NOT EXISTS tipo VARCHAR",
+    "ALTER TABLE scanntech_envios ADD COLUMN IF NOT EXISTS filial VARCHAR",
+    "ALTER TABLE scanntech_envios ADD COLUMN IF NOT EXISTS url VARCHAR",
+    "ALTER TABLE scanntech_envios ADD COLUMN IF NOT EXISTS chave_idempotencia VARCHAR",
+    "ALTER TABLE scanntech_envios ADD COLUMN IF NOT EXISTS tentativas INTEGER DEFAULT 0",
+    "ALTER TABLE scanntech_envios ADD COLUMN IF NOT EXISTS proxima_tentativa TIMESTAMP",
+    "ALTER TABLE scanntech_envios ADD COLUMN IF NOT EXISTS ultimo_erro VARCHAR",
+    "ALTER TABLE scanntech_envios ADD COLUMN IF NOT EXISTS criado_em TIMESTAMP",
+    # Envios anteriores ao outbox não guardavam o conteúdo antes do envio e não podem ser reenviados
+    "UPDATE scanntech_envios SET status = CASE WHEN enviado THEN 'enviado' ELSE 'erro' END WHERE status IS NULL",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_scanntech_envios_chave_idempotencia ON scanntech_envios (chave_idempotencia)",
+    "CREATE INDEX IF NOT EXISTS ix_scanntech_envios_status ON scanntech_envios (status, proxima_tentativa)",
+    # Jobs: heartbeat do processo que executa cada job
+    "ALTER TABLE scanntech_jobs ADD COLUMN IF NOT EXISTS atualizado_em TIMESTAMP",
+    # Fila de tarefas: no máximo uma tarefa ativa por (tarefa, filial, data)
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_scanntech_fila_tarefas_ativa ON scanntech_fila_tarefas (tarefa, filial, data) "
+    "WHERE status IN ('pendente', 'executando')",
+]
+
+
+def aplicar_migracoes():
+    """
+    Cria as tabelas novas e aplica as migrações pendentes.
+
+    Returns:
+        None
+    """
+    Base.metadata.create_all(bind=engine, tables=TABELAS)
+    with engine.begin() as conexao:
+        for comando in MIGRACOES:
+            conexao.execute(text(comando))
+    logger.info("Migrações aplicadas")
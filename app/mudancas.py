@@ -0,0 +1,245 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Callable, List, Optional, Set, Tuple
+import psycopg2
+from sqlalchemy import text
+from app.database import engine
+from app.log_config import setup_logger
+from app.configuracoes import mudancas_canal, mudancas_reconexao
+
+"""
+Módulo de Mudanças
+
+Acompanha as alterações feitas pela sincronização com o HANA em `hanasync_faturamento_notas`, para que os
+consumidores deixem de recalcular às cegas.
+
+- Um trigger por comando (`instalar_trigger`) envia um NOTIFY no canal `mudancas_canal` com as (filial, data)
+  dos itens inseridos, alterados ou removidos, no formato "0101:2024-08-01,0102:2024-08-01". A própria
+  sincronização também pode notificar o canal ao terminar; uma carga vazia ou "*" significa "tudo".
+- `MonitorMudancas` escuta o canal no loop asyncio da aplicação, sem threads: a conexão dedicada é
+  registrada com `loop.add_reader` e as notificações são lidas quando o socket fica legível.
+- Cada notificação chama os callbacks registrados com `ao_mudar` com as (filial, data) alteradas (ex.:
+  invalidação de caches, antecipação da preparação e do microlote). O monitor não guarda as alterações:
+  cada consumidor reage a elas no próprio callback. Os callbacks podem bloquear (ex.: o cache em disco):
+  rodam fora do loop de eventos, em uma thread própria, um de cada vez e na ordem das notificações.
+- Enquanto o listener está desconectado, as notificações se perdem; por isso cada (re)conexão é tratada
+  como uma mudança em tudo.
+"""
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+# As transições (`novos`/`antigos`) só existem no trigger da operação correspondente; o plpgsql só
+# resolve a tabela do ramo executado
+FUNCAO_TRIGGER = """
+CREATE OR REPLACE FUNCTION scanntech_notificar_faturamento() RETURNS trigger AS $$
+DECLARE
+    carga text;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        SELECT string_agg(DISTINCT "CENTRO" || ':' || "DATA_CRIADA", ',') INTO carga FROM antigos;
+    ELSIF TG_OP = 'UPDATE' THEN
+        -- Uma linha movida para outra filial ou data altera também a (filial, data) de origem
+        SELECT string_agg(DISTINCT chave, ',') INTO carga FROM (
+            SELECT "CENTRO" || ':' || "DATA_CRIADA" AS chave FROM antigos
+            UNION
+            SELECT "CENTRO" || ':' || "DATA_CRIADA" FROM novos
+        ) alteradas;
+    ELSE
+        SELECT string_agg(DISTINCT "CENTRO" || ':' || "DATA_CRIADA", ',') INTO carga FROM novos;
+    END IF;
+    IF carga IS NOT NULL THEN
+        -- O NOTIFY aceita até 8000 bytes; acima disso, tudo é considerado alterado
+        IF octet_length(carga) > 7900 THEN
+            carga := '*';
+        END IF;
+        PERFORM pg_notify(TG_ARGV[0], carga);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+TRIGGERS = [
+    ("scanntech_notificar_insercao", "INSERT", "NEW TABLE AS novos"),
+    ("scanntech_notificar_alteracao", "UPDATE", "OLD TABLE AS antigos NEW TABLE AS novos"),
+    ("scanntech_notificar_remocao", "DELETE", "OLD TABLE AS antigos"),
+]
+
+
+def instalar_trigger(canal: str = mudancas_canal):
+    """
+    Cria, de forma idempotente, a função e os triggers que notificam as mudanças em `hanasync_faturamento_notas`.
+
+    Returns:
+        None
+    """
+    with engine.begin() as conexao:
+        conexao.execute(text(FUNCAO_TRIGGER))
+        for nome, operacao, transicao in TRIGGERS:
+            conexao.execute(text(f"DROP TRIGGER IF EXISTS {nome} ON hanasync_faturamento_notas"))
+            conexao.execute(
+                text(
+                    f"CREATE TRIGGER {nome} AFTER {operacao} ON hanasync_faturamento_notas "
+                    f"REFERENCING {transicao} FOR EACH STATEMENT "
+                    f"EXECUTE FUNCTION scanntech_notificar_faturamento('{canal}')"
+                )
+            )
+    logger.info("Triggers de mudanças instalados no canal %s", canal)
+
+
+def interpretar_carga(carga: str) -> Optional[Set[Tuple[str, date]]]:
+    """
+    Converte a carga de uma notificação em (filial, data).
+
+    Returns:
+        Set[Tuple[str, date]]: As (filial, data) alteradas, ou None se tudo deve ser considerado alterado.
+    """
+    carga = (carga or "").strip()
+    if not carga or carga == "*":
+        return None
+    alteracoes = set()
+    for item in carga.split(","):
+        filial, _, dia = item.strip().partition(":")
+        try:
+            alteracoes.add((filial, date.fromisoformat(dia)))
+        except ValueError:
+            logger.warning("Notificação de mudança inválida: %s", item)
+            return None
+    return alteracoes
+
+
+class MonitorMudancas:
+    """
+    Escuta o canal de mudanças e repassa as (filial, data) alteradas aos callbacks.
+
+    Args:
+        canal (str): O canal do LISTEN.
+        reconexao (float): Segundos até reconectar após uma falha.
+    """
+
+    def __init__(self, canal: str = mudancas_canal, reconexao: float = mudancas_reconexao):
+        self.canal = canal
+        self.reconexao = reconexao
+        self._callbacks: List[Callable] = []
+        # Uma única thread: os callbacks não bloqueiam o loop e as notificações são tratadas em ordem
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mudancas")
+        self._tarefa = None
+        self.conectado = False
+        self.notificacoes = 0
+        self.ultima_notificacao = None
+        self.ultimas_alteracoes = None
+
+    def ao_mudar(self, callback: Callable[[Optional[Set[Tuple[str, date]]]], None]):
+        """
+        Registra um callback chamado a cada mudança com as (filial, data) alteradas, ou None para "tudo".
+        """
+        self._callbacks.append(callback)
+        return callback
+
+    def propagar(self, alteracoes: Optional[Set[Tuple[str, date]]]):
+        """
+        Agenda a chamada dos callbacks com as (filial, data) alteradas (None para "tudo"), na thread do monitor.
+        """
+        self.ultimas_alteracoes = None if alteracoes is None else len(alteracoes)
+        self._executor.submit(self._chamar_callbacks, alteracoes)
+
+    def _chamar_callbacks(self, alteracoes: Optional[Set[Tuple[str, date]]]):
+        for callback in list(self._callbacks):
+            try:
+                callback(alteracoes)
+            except Exception as e:
+                logger.error(f"Erro no callback de mudanças {callback}: {e}")
+
+    def _receber(self, carga: str):
+        self.notificacoes += 1
+        self.ultima_notificacao = datetime.now()
+        self.propagar(interpretar_carga(carga))
+
+    def _conectar(self):
+        url = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        # O keepalive faz uma conexão morta ser detectada mesmo sem tráfego
+        conexao = psycopg2.connect(
+            url, keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3
+        )
+        conexao.set_session(autocommit=True)
+        with conexao.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.canal}"')
+        return conexao
+
+    async def _escutar(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                conexao = await loop.run_in_executor(None, self._conectar)
+            except Exception as e:
+                logger.error(f"Erro ao conectar o listener de mudanças: {e}")
+                await asyncio.sleep(self.reconexao)
+                continue
+
+            self.conectado = True
+            logger.info("Escutando as mudanças no canal %s", self.canal)
+            # As notificações enviadas enquanto o listener estava desconectado se perderam
+            self.propagar(None)
+            encerrada = loop.create_future()
+
+            def ler():
+                try:
+                    conexao.poll()
+                except Exception as e:
+                    if not encerrada.done():
+                        encerrada.set_exception(e)
+                    return
+                while conexao.notifies:
+                    self._receber(conexao.notifies.pop(0).payload)
+
+            descritor = conexao.fileno()
+            loop.add_reader(descritor, ler)
+            try:
+                await encerrada
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Conexão do listener de mudanças perdida: {e}")
+            finally:
+                loop.remove_reader(descritor)
+                self.conectado = False
+                try:
+                    conexao.close()
+                except Exception:
+                    pass
+            await asyncio.sleep(self.reconexao)
+
+    def iniciar(self):
+        """
+        Inicia o listener no loop asyncio em execução.
+        """
+        if self._tarefa is None or self._tarefa.done():
+            self._tarefa = asyncio.create_task(self._escutar())
+
+    def parar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            self._tarefa = None
+
+    def estado(self) -> dict:
+        """
+        Retorna o estado do listener e o tamanho da última notificação (None quando foi "tudo").
+        """
+        return {
+            "canal": self.canal,
+            "conectado": self.conectado,
+            "notificacoes": self.notificacoes,
+            "ultima_notificacao": self.ultima_notificacao,
+            "ultimas_alteracoes": self.ultimas_alteracoes,
+            "callbacks": len(self._callbacks),
+        }
+
+
+monitor_mudancas = MonitorMudancas()
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import os
+import queue
+import random
+import threading
+from typing import List
+from app.log_config import setup_logger
+from app.configuracoes import (
+    telegram_chat_id,
+    notificacao_debounce,
+    notificacao_tentativas,
+    notificacao_backoff_base,
+    notificacao_backoff_maximo,
+)
+
+"""
+Módulo de Notificações
+
+Fila de mensagens para o Telegram com um enviador de fundo. Quem notifica apenas enfileira a mensagem
+(`notificar`) e segue em frente; uma thread com o seu próprio loop asyncio:
+
+- espera `notificacao_debounce` segundos após a primeira mensagem, juntando as que chegarem nesse
+  intervalo em um único envio (as mensagens de uma execução saem juntas);
+- divide o texto no limite de tamanho do Telegram (`LIMITE_MENSAGEM`), preferindo quebrar nas linhas;
+- reenvia com backoff exponencial em caso de falha, respeitando o `retry_after` do Telegram.
+
+O `Bot` só é criado no primeiro envio, de forma que importar a aplicação não depende do token.
+"""
+
+LIMITE_MENSAGEM = 4096
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def dividir_mensagem(texto: str, limite: int = LIMITE_MENSAGEM) -> List[str]:
+    """
+    Divide um texto em partes de no máximo `limite` caracteres, quebrando nas linhas sempre que possível.
+
+    Args:
+        texto (str): O texto a dividir.
+        limite (int): O tamanho máximo de cada parte.
+
+    Returns:
+        List[str]: As partes, na ordem.
+    """
+    partes, atual = [], ""
+    for linha in texto.split("\n"):
+        # Uma linha maior que o limite é quebrada em pedaços
+        while len(linha) > limite:
+            if atual:
+                partes.append(atual)
+                atual = ""
+            partes.append(linha[:limite])
+            linha = linha[limite:]
+        candidato = f"{atual}\n{linha}" if atual else linha
+        if len(candidato) > limite:
+            partes.append(atual)
+            atual = linha
+        else:
+            atual = candidato
+    if atual.strip():
+        partes.append(atual)
+    return partes
+
+
+class FilaNotificacoes:
+    """
+    Fila de notificações do Telegram com envio em uma thread de fundo.
+
+    Args:
+        chat_id (int): O chat que recebe as mensagens.
+        debounce (float): Segundos de espera para juntar mensagens em um único envio.
+        tentativas (int): Número máximo de tentativas por mensagem.
+        backoff_base (float): Espera, em segundos, antes da segunda tentativa; dobra a cada tentativa.
+        backoff_maximo (float): Espera máxima entre tentativas.
+    """
+
+    def __init__(
+        self,
+        chat_id: int = telegram_chat_id,
+        debounce: float = notificacao_debounce,
+        tentativas: int = notificacao_tentativas,
+        backoff_base: float = notificacao_backoff_base,
+        backoff_maximo: float = notificacao_backoff_maximo,
+    ):
+        self.chat_id = chat_id
+        self.debounce = debounce
+        self.tentativas = max(1, tentativas)
+        self.backoff_base = backoff_base
+        self.backoff_maximo = backoff_maximo
+        self._fila = queue.Queue()
+        self._parar = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._bot = None
+
+    def notificar(self, mensagem: str):
+        """
+        Enfileira uma mensagem e retorna imediatamente. Inicia o enviador, se necessário.
+        """
+        if not mensagem:
+            return
+        self._fila.put(mensagem)
+        self.iniciar()
+
+    def iniciar(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._parar.clear()
+            self._thread = threading.Thread(
+                target=self._executar, name="notificacoes", daemon=True
+            )
+            self._thread.start()
+
+    def parar(self, timeout: float = 10):
+        """
+        Encerra o enviador, aguardando até `timeout` segundos para que as mensagens pendentes sejam enviadas.
+        """
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _executar(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._loop())
+        finally:
+            loop.close()
+
+    def _proximo_lote(self) -> List[str]:
+        try:
+            mensagens = [self._fila.get(timeout=1)]
+        except queue.Empty:
+            return []
+        # Junta as mensagens que chegarem durante o debounce
+        if not self._parar.is_set():
+            self._parar.wait(self.debounce)
+        while True:
+            try:
+                mensagens.append(self._fila.get_nowait())
+            except queue.Empty:
+                return mensagens
+
+    async def _loop(self):
+        while not (self._parar.is_set() and self._fila.empty()):
+            mensagens = await asyncio.to_thread(self._proximo_lote)
+            if not mensagens:
+                continue
+            for parte in dividir_mensagem("\n\n".join(mensagens)):
+                await self._enviar(parte)
+        if self._bot is not None:
+            await self._bot.shutdown()
+
+    async def _obter_bot(self):
+        if self._bot is None:
+            from telegram import Bot
+
+            bot = Bot(token=os.getenv("BOT_TOKEN_TELEGRAM"))
+            await bot.initialize()
+            self._bot = bot
+        return self._bot
+
+    async def _enviar(self, texto: str):
+        from telegram.error import BadRequest, Forbidden, InvalidToken, RetryAfter
+
+        for tentativa in range(1, self.tentativas + 1):
+            try:
+                bot = await self._obter_bot()
+                await bot.send_message(chat_id=self.chat_id, text=texto)
+                return
+            except (BadRequest, Forbidden, InvalidToken) as e:
+                # Erros que não se resolvem reenviando a mesma mensagem
+                logger.error(f"Notificação descartada pelo Telegram: {e}")
+                return
+            except Exception as e:
+                if tentativa == self.tentativas:
+                    logger.error(
+                        f"Falha ao enviar notificação após {tentativa} tentativas: {e}"
+                    )
+                    return
+                if isinstance(e, RetryAfter):
+                    espera = float(e.retry_after)
+                else:
+                    espera = random.uniform(
+                        0,
+                        min(self.backoff_maximo, self.backoff_base * 2 ** (tentativa - 1)),
+                    )
+                logger.warning(
+                    f"Falha ao enviar notificação (tentativa {tentativa}): {e}. Nova tentativa em {espera:.1f}s"
+                )
+                await asyncio.sleep(espera)
+
+
+fila_notificacoes = FilaNotificacoes()
+
+
+def notificar(mensagem: str):
+    """
+    Enfileira uma mensagem para o Telegram sem bloquear quem chama.
+
+    Args:
+        mensagem (str): O texto da mensagem. Mensagens grandes são divididas automaticamente.
+    """
+    fila_notificacoes.notificar(mensagem)
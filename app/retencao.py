@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import shutil
+import tarfile
+import gzip
+import threading
+import time
+from datetime import datetime
+from app.log_config import setup_logger
+from app.configuracoes import (
+    tempo_manter_arquivo,
+    tempo_compactar_arquivo,
+    intervalo_retencao,
+)
+
+"""
+Módulo de Retenção
+
+Este módulo substitui a antiga limpeza feita a cada chamada (`limpar_arquivos_antigos`) por uma rotina
+agendada, executada em uma thread de fundo, que:
+
+- Compacta as pastas diárias de `data/` (tar.gz) e os logs rotacionados de `logs/` (gzip) mais antigos
+  que `tempo_compactar_arquivo`.
+- Remove os arquivos compactados quando passam de `tempo_manter_arquivo`.
+- Mantém um manifesto (índice JSON) dos dias arquivados, de forma que a remoção não precise varrer
+  o diretório de arquivos compactados.
+
+As requisições não fazem nenhuma varredura no sistema de arquivos; apenas a rotina agendada o faz.
+"""
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+class GerenciadorRetencao:
+    """
+    Gerencia a retenção dos arquivos de data e de log.
+
+    Args:
+        diretorio_dados (str): Diretório com as pastas diárias de exportação.
+        diretorio_logs (str): Diretório com os logs rotacionados.
+        dias_compactar (int): Idade, em dias, a partir da qual os arquivos são compactados.
+        dias_manter (int): Idade, em dias, a partir da qual os arquivos compactados são removidos.
+        intervalo_horas (float): Intervalo entre as execuções da rotina.
+    """
+
+    def __init__(
+        self,
+        diretorio_dados: str = "data",
+        diretorio_logs: str = "logs",
+        dias_compactar: int = tempo_compactar_arquivo,
+        dias_manter: int = tempo_manter_arquivo,
+        intervalo_horas: float = intervalo_retencao,
+    ):
+        self.diretorio_dados = diretorio_dados
+        self.diretorio_logs = diretorio_logs
+        self.diretorio_arquivo = os.path.join(diretorio_dados, "arquivo")
+        self.caminho_manifesto = os.path.join(self.diretorio_arquivo, "manifesto.json")
+        self.dias_compactar = dias_compactar
+        self.dias_manter = dias_manter
+        self.intervalo_horas = intervalo_horas
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _carregar_manifesto(self) -> dict:
+        if not os.path.exists(self.caminho_manifesto):
+            return {"dados": {}, "logs": {}, "ultima_execucao": None}
+        try:
+            with open(self.caminho_manifesto, "r", encoding="utf-8") as arquivo:
+                return json.load(arquivo)
+        except (OSError, ValueError) as e:
+            logger.error(f"Manifesto de retenção inválido, recriando: {e}")
+            return {"dados": {}, "logs": {}, "ultima_execucao": None}
+
+    def _salvar_manifesto(self, manifesto: dict):
+        os.makedirs(self.diretorio_arquivo, exist_ok=True)
+        temporario = f"{self.caminho_manifesto}.tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump(manifesto, arquivo, indent=2, sort_keys=True)
+        os.replace(temporario, self.caminho_manifesto)
+
+    def _compactar_dados(self, manifesto: dict, agora: float):
+        """
+        Compacta as pastas diárias de `data/` mais antigas que `dias_compactar`.
+        """
+        if not os.path.exists(self.diretorio_dados):
+            return
+        limite = self.dias_compactar * 86400
+        for entrada in os.scandir(self.diretorio_dados):
+            if not entrada.is_dir() or entrada.path == self.diretorio_arquivo:
+                continue
+            modificado_em = entrada.stat().st_mtime
+            if agora - modificado_em <= limite:
+                continue
+            destino = os.path.join(self.diretorio_arquivo, f"{entrada.name}.tar.gz")
+            with tarfile.open(destino, "w:gz") as tar:
+                tar.add(entrada.path, arcname=entrada.name)
+            shutil.rmtree(entrada.path)
+            manifesto["dados"][entrada.name] = {
+                "arquivo": destino,
+                "modificado_em": modificado_em,
+                "compactado_em": agora,
+            }
+            logger.info(f"Pasta compactada: {entrada.path} -> {destino}")
+
+    def _compactar_logs(self, manifesto: dict, agora: float):
+        """
+        Compacta os logs rotacionados (`app.log.AAAA-MM-DD`) mais antigos que `dias_compactar`.
+        O log corrente e os arquivos já compactados são ignorados.
+        """
+        if not os.path.exists(self.diretorio_logs):
+            return
+        limite = self.dias_compactar * 86400
+        for entrada in os.scandir(self.diretorio_logs):
+            if (
+                not entrada.is_file()
+                or entrada.name.endswith(".gz")
+                or entrada.name == "app.log"
+            ):
+                continue
+            modificado_em = entrada.stat().st_mtime
+            if agora - modificado_em <= limite:
+                continue
+            destino = f"{entrada.path}.gz"
+            with open(entrada.path, "rb") as origem, gzip.open(destino, "wb") as saida:
+                shutil.copyfileobj(origem, saida)
+            os.remove(entrada.path)
+            manifesto["logs"][entrada.name] = {
+                "arquivo": destino,
+                "modificado_em": modificado_em,
+                "compactado_em": agora,
+            }
+            logger.info(f"Log compactado: {entrada.path} -> {destino}")
+
+    def _remover_expirados(self, manifesto: dict, agora: float):
+        """
+        Remove os arquivos compactados que passaram de `dias_manter`, usando apenas o manifesto.
+        """
+        limite = self.dias_manter * 86400
+        for secao in ("dados", "logs"):
+            for nome, registro in list(manifesto[secao].items()):
+                if agora - registro["modificado_em"] <= limite:
+                    continue
+                if os.path.exists(registro["arquivo"]):
+                    os.remove(registro["arquivo"])
+                del manifesto[secao][nome]
+                logger.info(f"Arquivo removido: {registro['arquivo']}")
+
+    def executar(self):
+        """
+        Executa uma passada completa da rotina de retenção.
+
+        Returns:
+            dict: O manifesto atualizado.
+        """
+        with self._lock:
+            agora = time.time()
+            manifesto = self._carregar_manifesto()
+            try:
+                self._compactar_dados(manifesto, agora)
+                self._compactar_logs(manifesto, agora)
+                self._remover_expirados(manifesto, agora)
+            except Exception as e:
+                logger.error(f"Erro na rotina de retenção: {e}")
+            manifesto["ultima_execucao"] = datetime.fromtimestamp(agora).isoformat()
+            self._salvar_manifesto(manifesto)
+            return manifesto
+
+    def _loop(self):
+        while not self._parar.is_set():
+            self.executar()
+            self._parar.wait(self.intervalo_horas * 3600)
+
+    def iniciar(self):
+        """
+        Inicia a thread de fundo que executa a rotina a cada `intervalo_horas`.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="retencao", daemon=True
+        )
+        self._thread.start()
+
+    def parar(self):
+        """
+        Sinaliza a thread de fundo para encerrar.
+        """
+        self._parar.set()
+
+
+gerenciador_retencao = GerenciadorRetencao()
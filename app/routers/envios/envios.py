@@ -1,16 +1,34 @@
+import asyncio
 from datetime import datetime
 import os
 from typing import Annotated, List
-from fastapi import APIRouter, FastAPI, Depends, HTTPException
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from app.log_config import setup_logger
 from app.routers.faturamento import scriptSend
+from app.routers.faturamento.jobs import gerenciador_jobs
+from app.routers.faturamento import fila, pipeline
+from app import agendador
+from app.scanntech import cliente_scanntech
+from app.eventos import barramento_eventos
+from app.mudancas import monitor_mudancas
+from app.cache_respostas import cache_respostas
+from app.serializacao import para_json
+from app.singleflight import chave_chamada, singleflight
 
 from ..faturamento import crud, models, schemas, utils
 from ...database import SessionLocal
 import logging
 import sys
 from logging.handlers import TimedRotatingFileHandler
-from ...configuracoes import agrupar_outros_flag, filiais
+from ...configuracoes import (
+    agrupar_outros_flag,
+    filiais,
+    envio_delta,
+    agendador_ativo,
+    mudancas_ativo,
+    cache_respostas_ativo,
+)
 
 router = APIRouter()
 
@@ -32,9 +50,9 @@ else:
 
 
 @router.get("/enviar/faturamento")
-async def enviar_faturamento():
+def enviar_faturamento():
     """
-    Função assíncrona responsável por enviar o faturamento.
+    Função responsável por enviar o faturamento.
 
     Returns:
         enviar (objeto): Objeto contendo informações sobre o envio do faturamento.
@@ -44,7 +62,10 @@ async def enviar_faturamento():
 
     """
     try:
-        enviar = scriptSend.tarefa_periodica_envio_faturamento()
+        enviar = singleflight.executar(
+            chave_chamada("enviar_faturamento"),
+            scriptSend.tarefa_periodica_envio_faturamento,
+        )
         logger.info("Faturamento enviado")
         return enviar
     except Exception as e:
@@ -53,18 +74,20 @@ async def enviar_faturamento():
 
 
 @router.get("/enviar/faturamento/")
-async def enviar_faturamento(
+def enviar_faturamento(
     start: str = datetime.now().strftime("%d/%m/%Y"),
     end: str = datetime.now().strftime("%d/%m/%Y"),
     centro: str = None,
+    delta: bool = envio_delta,
 ):
     """
-    Função assíncrona responsável por enviar o faturamento.
+    Função responsável por enviar o faturamento.
 
     Args:
         start (str): Data de início do período de envio. Padrão é a data atual.
         end (str): Data de fim do período de envio. Padrão é a data atual.
         centro (str): Centro/filial específico. Padrão: None.
+        delta (bool): Envia apenas as notas novas ou alteradas desde o último envio. Padrão: `envio_delta`.
 
     Returns:
         enviar (objeto): Objeto contendo informações sobre o envio do faturamento.
@@ -73,8 +96,16 @@ async def enviar_faturamento(
         HTTPException: Exceção lançada caso ocorra um erro ao enviar o faturamento.
     """
     try:
-        enviar = scriptSend.tarefa_periodica_envio_faturamento(
-            centro=centro, data_inicial=start, data_final=end
+        # Uma requisição repetida enquanto a primeira ainda envia recebe o mesmo resultado, sem reenviar
+        enviar = singleflight.executar(
+            chave_chamada(
+                "enviar_faturamento", centro=centro, start=start, end=end, delta=delta
+            ),
+            scriptSend.tarefa_periodica_envio_faturamento,
+            centro=centro,
+            data_inicial=start,
+            data_final=end,
+            delta=delta,
         )
         logger.info("Faturamento enviado")
         return enviar
@@ -84,7 +115,7 @@ async def enviar_faturamento(
 
 
 @router.get("/enviar/fechamento")
-async def enviar_fechamento():
+def enviar_fechamento():
     """
     Endpoint para enviar o fechamento.
 
@@ -107,7 +138,10 @@ async def enviar_fechamento():
 
     """
     try:
-        enviar = scriptSend.tarefa_periodica_envio_fechamento()
+        enviar = singleflight.executar(
+            chave_chamada("enviar_fechamento"),
+            scriptSend.tarefa_periodica_envio_fechamento,
+        )
         logger.info("Fechamento enviado")
         return enviar
     except Exception as e:
@@ -116,13 +150,13 @@ async def enviar_fechamento():
 
 
 @router.get("/enviar/fechamento/")
-async def enviar_fechamento(
+def enviar_fechamento(
     start: str = datetime.now().strftime("%d/%m/%Y"),
     end: str = datetime.now().strftime("%d/%m/%Y"),
     centro: str = None,
 ):
     """
-    Função assíncrona responsável por enviar o fechamento.
+    Função responsável por enviar o fechamento.
 
     Args:
         start (str): Data de início do período de envio. Padrão é a data atual.
@@ -135,8 +169,12 @@ async def enviar_fechamento(
         HTTPException: Exceção lançada caso ocorra um erro ao enviar o fechamento.
     """
     try:
-        enviar = scriptSend.tarefa_periodica_envio_fechamento(
-            centro=centro, data_inicial=start, data_final=end
+        enviar = singleflight.executar(
+            chave_chamada("enviar_fechamento", centro=centro, start=start, end=end),
+            scriptSend.tarefa_periodica_envio_fechamento,
+            centro=centro,
+            data_inicial=start,
+            data_final=end,
         )
         logger.info("Fechamento enviado")
         return enviar
@@ -148,7 +186,7 @@ async def enviar_fechamento(
 
 
 @router.get("/verificar/reenvio")
-async def verificar_reenvio(
+def verificar_reenvio(
     centro: str = None,
 ):
     """
@@ -163,7 +201,7 @@ async def verificar_reenvio(
         O resultado da verificação.
     """
     try:
-        verificar = await scriptSend.verificar_reenvio(centro=centro)
+        verificar = scriptSend.verificar_reenvio(centro=centro)
         logger.info("Reenvio verificado")
         return verificar
     except Exception as e:
@@ -171,8 +209,37 @@ async def verificar_reenvio(
         raise HTTPException(status_code=500, detail=f"Erro ao verificar reenvio: {e}")
 
 
+@router.get("/processar/reenvio")
+def processar_reenvio(
+    centro: str = None,
+):
+    """
+    Processa as solicitações de reenvio da ScannTech.
+
+    Busca as solicitações de todas as filiais (ou do centro informado), agrupa-as por filial, data e tipo e
+    reenvia os movimientos ou o fechamento de cada dia solicitado.
+
+    Raises:
+        HTTPException: Se ocorrer um erro ao processar os reenvios.
+
+    Returns:
+        O resultado de cada reenvio.
+    """
+    try:
+        reenvios = singleflight.executar(
+            chave_chamada("processar_reenvio", centro=centro),
+            scriptSend.tarefa_periodica_processar_reenvio,
+            centro=centro,
+        )
+        logger.info("Reenvios processados")
+        return reenvios
+    except Exception as e:
+        logger.error(f"Erro ao processar reenvios: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro ao processar reenvios: {e}")
+
+
 @router.get("/verificar/cancelamentos")
-async def verificar_cancelamentos(
+def verificar_cancelamentos(
     centro: str = None,
 ):
     """
@@ -187,7 +254,11 @@ async def verificar_cancelamentos(
         O resultado da verificação dos cancelamentos.
     """
     try:
-        verificar = scriptSend.tarefa_periodica_verificacao_cancelamentos(centro=centro)
+        verificar = singleflight.executar(
+            chave_chamada("verificar_cancelamentos", centro=centro),
+            scriptSend.tarefa_periodica_verificacao_cancelamentos,
+            centro=centro,
+        )
         logger.info("Cancelamentos verificados")
         return verificar
     except Exception as e:
@@ -198,7 +269,7 @@ async def verificar_cancelamentos(
 
 
 @router.get("/verificar/devolucoes")
-async def verificar_devolucoes(
+def verificar_devolucoes(
     centro: str = None,
 ):
     """
@@ -214,7 +285,11 @@ async def verificar_devolucoes(
         HTTPException: Caso ocorra algum erro durante a verificação das devoluções.
     """
     try:
-        verificar = scriptSend.tarefa_periodica_verificacao_devolucoes(centro=centro)
+        verificar = singleflight.executar(
+            chave_chamada("verificar_devolucoes", centro=centro),
+            scriptSend.tarefa_periodica_verificacao_devolucoes,
+            centro=centro,
+        )
         logger.info("Devoluções verificadas")
         return verificar
     except Exception as e:
@@ -222,3 +297,391 @@ async def verificar_devolucoes(
         raise HTTPException(
             status_code=500, detail=f"Erro ao verificar devoluções: {e}"
         )
+
+
+@router.get("/scanntech/estado")
+async def estado_scanntech():
+    """
+    Retorna o estado do cliente da ScannTech por família de endpoint (lotes, cierresDiarios, solicitudes).
+
+    Para cada família são retornados o estado do disjuntor (fechado, aberto ou semi-aberto), os tokens
+    disponíveis no limitador de taxa e as métricas de chamadas (total, erros e latências p50/p99).
+
+    Returns:
+        dict: O estado de cada família de endpoint.
+    """
+    return cliente_scanntech.estado()
+
+
+@router.get("/eventos")
+async def eventos(
+    request: Request,
+    filial: str = None,
+    tarefa: str = None,
+    last_event_id: Annotated[int, Header()] = 0,
+):
+    """
+    Transmite (Server-Sent Events) as etapas das tarefas de envio à medida que elas acontecem.
+
+    Cada evento traz a etapa (iniciado, consultado, agregado, serializado, gravado, enviado, concluido
+    ou erro), a filial, a quantidade de registros e a duração da etapa (ver `app.eventos`).
+
+    Args:
+        filial (str): Transmite apenas os eventos desta filial.
+        tarefa (str): Transmite apenas os eventos desta tarefa.
+        last_event_id (int): Cabeçalho `Last-Event-ID`, enviado pelo navegador ao reconectar; os eventos
+            posteriores a ele que ainda estão em memória são retransmitidos.
+
+    Returns:
+        StreamingResponse: O fluxo `text/event-stream`.
+    """
+
+    def filtrar(evento: dict) -> bool:
+        return (not filial or evento.get("filial") == filial) and (
+            not tarefa or evento.get("tarefa") == tarefa
+        )
+
+    def formatar(evento: dict) -> str:
+        return f"id: {evento['id']}\nevent: {evento['etapa']}\ndata: {para_json(evento).decode()}\n\n"
+
+    fila = barramento_eventos.assinar()
+
+    async def gerar():
+        try:
+            for evento in barramento_eventos.recentes(last_event_id) if last_event_id else []:
+                if filtrar(evento):
+                    yield formatar(evento)
+            while not await request.is_disconnected():
+                try:
+                    evento = await asyncio.wait_for(fila.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comentário SSE, mantém a conexão aberta em proxies
+                    yield ": keep-alive\n\n"
+                    continue
+                if evento["id"] > last_event_id and filtrar(evento):
+                    yield formatar(evento)
+        finally:
+            barramento_eventos.cancelar(fila)
+
+    return StreamingResponse(
+        gerar(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _filiais_job(centro: str = None) -> List[str]:
+    return filiais if not centro else [centro]
+
+
+@router.post(
+    "/enviar/faturamento",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=schemas.Job,
+)
+def criar_job_faturamento(
+    start: str = None,
+    end: str = None,
+    centro: str = None,
+    delta: bool = envio_delta,
+):
+    """
+    Cria um job de envio do faturamento e retorna imediatamente.
+
+    Args:
+        start (str): Data de início do período de envio (dd/mm/aaaa). Padrão é a data atual.
+        end (str): Data de fim do período de envio (dd/mm/aaaa). Padrão é a data atual.
+        centro (str): Centro/filial específico. Padrão: todas as filiais.
+        delta (bool): Envia apenas as notas novas ou alteradas desde o último envio.
+
+    Returns:
+        Job: O job criado; o andamento pode ser consultado em GET /jobs/{id}.
+    """
+    data_atual = datetime.now().strftime("%d/%m/%Y")
+    start, end = start or data_atual, end or data_atual
+    return gerenciador_jobs.submeter(
+        "enviar_faturamento",
+        scriptSend.tarefa_periodica_envio_faturamento,
+        filiais=_filiais_job(centro),
+        chave=chave_chamada(
+            "enviar_faturamento", centro=centro, start=start, end=end, delta=delta
+        ),
+        centro=centro,
+        data_inicial=start,
+        data_final=end,
+        delta=delta,
+    )
+
+
+@router.post(
+    "/enviar/fechamento",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=schemas.Job,
+)
+def criar_job_fechamento(start: str = None, end: str = None, centro: str = None):
+    """
+    Cria um job de envio do fechamento diário e retorna imediatamente.
+
+    Args:
+        start (str): Data de início do período de envio (dd/mm/aaaa). Padrão é a data atual.
+        end (str): Data de fim do período de envio (dd/mm/aaaa). Padrão é a data atual.
+        centro (str): Centro/filial específico. Padrão: todas as filiais.
+
+    Returns:
+        Job: O job criado; o andamento pode ser consultado em GET /jobs/{id}.
+    """
+    data_atual = datetime.now().strftime("%d/%m/%Y")
+    start, end = start or data_atual, end or data_atual
+    return gerenciador_jobs.submeter(
+        "enviar_fechamento",
+        scriptSend.tarefa_periodica_envio_fechamento,
+        filiais=_filiais_job(centro),
+        chave=chave_chamada("enviar_fechamento", centro=centro, start=start, end=end),
+        centro=centro,
+        data_inicial=start,
+        data_final=end,
+    )
+
+
+@router.post(
+    "/verificar/cancelamentos",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=schemas.Job,
+)
+def criar_job_cancelamentos(centro: str = None):
+    """
+    Cria um job de verificação de cancelamentos e retorna imediatamente.
+
+    Returns:
+        Job: O job criado; o andamento pode ser consultado em GET /jobs/{id}.
+    """
+    return gerenciador_jobs.submeter(
+        "verificar_cancelamentos",
+        scriptSend.tarefa_periodica_verificacao_cancelamentos,
+        filiais=_filiais_job(centro),
+        chave=chave_chamada("verificar_cancelamentos", centro=centro),
+        centro=centro,
+    )
+
+
+@router.post(
+    "/verificar/devolucoes",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=schemas.Job,
+)
+def criar_job_devolucoes(centro: str = None):
+    """
+    Cria um job de verificação de devoluções e retorna imediatamente.
+
+    Returns:
+        Job: O job criado; o andamento pode ser consultado em GET /jobs/{id}.
+    """
+    return gerenciador_jobs.submeter(
+        "verificar_devolucoes",
+        scriptSend.tarefa_periodica_verificacao_devolucoes,
+        filiais=_filiais_job(centro),
+        chave=chave_chamada("verificar_devolucoes", centro=centro),
+        centro=centro,
+    )
+
+
+@router.post(
+    "/processar/reenvio",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=schemas.Job,
+)
+def criar_job_reenvio(centro: str = None):
+    """
+    Cria um job de processamento das solicitações de reenvio e retorna imediatamente.
+
+    Returns:
+        Job: O job criado; o andamento pode ser consultado em GET /jobs/{id}.
+    """
+    return gerenciador_jobs.submeter(
+        "processar_reenvio",
+        scriptSend.tarefa_periodica_processar_reenvio,
+        chave=chave_chamada("processar_reenvio", centro=centro),
+        centro=centro,
+    )
+
+
+@router.post(
+    "/enviar/pipeline",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=schemas.Job,
+)
+def criar_job_pipeline(
+    start: str = None,
+    end: str = None,
+    centro: str = None,
+    etapas: Annotated[List[str], Query()] = None,
+    delta: bool = envio_delta,
+):
+    """
+    Cria um job do pipeline noturno, que calcula as notas uma única vez por filial e dia e as reaproveita no
+    faturamento, no fechamento e nos cancelamentos, e retorna imediatamente.
+
+    Args:
+        start (str): Data de início do período (dd/mm/aaaa). Padrão é a data atual.
+        end (str): Data de fim do período (dd/mm/aaaa). Padrão é a data atual.
+        centro (str): Centro/filial específico. Padrão: todas as filiais.
+        etapas (List[str]): As etapas executadas (faturamento, fechamento, cancelamentos, devolucoes). Padrão: todas.
+        delta (bool): Envia apenas as notas novas ou alteradas desde o último envio.
+
+    Returns:
+        Job: O job criado; o andamento pode ser consultado em GET /jobs/{id}.
+
+    Raises:
+        HTTPException: 400 se alguma etapa for desconhecida.
+    """
+    etapas = etapas or pipeline.ETAPAS
+    desconhecidas = set(etapas) - set(pipeline.ETAPAS)
+    if desconhecidas:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Etapas desconhecidas: {', '.join(sorted(desconhecidas))}",
+        )
+    data_atual = datetime.now().strftime("%d/%m/%Y")
+    start, end = start or data_atual, end or data_atual
+    return gerenciador_jobs.submeter(
+        "enviar_pipeline",
+        scriptSend.tarefa_periodica_pipeline,
+        filiais=_filiais_job(centro),
+        chave=chave_chamada(
+            "enviar_pipeline",
+            centro=centro,
+            start=start,
+            end=end,
+            etapas=tuple(sorted(etapas)),
+            delta=delta,
+        ),
+        centro=centro,
+        data_inicial=start,
+        data_final=end,
+        etapas=etapas,
+        delta=delta,
+    )
+
+
+@router.get("/jobs", response_model=List[schemas.Job])
+def listar_jobs(tipo: str = None, limite: int = 50):
+    """
+    Retorna o histórico de jobs, do mais recente para o mais antigo (sem o resultado).
+
+    Args:
+        tipo (str): Filtra pelo tipo do job (ex.: "enviar_faturamento").
+        limite (int): Número máximo de jobs retornados.
+    """
+    return gerenciador_jobs.listar(limite=limite, tipo=tipo)
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.Job)
+def obter_job(job_id: str):
+    """
+    Retorna o status, o progresso por filial (status, duração e erro) e o resultado de um job.
+
+    Raises:
+        HTTPException: 404 se o job não existir.
+    """
+    job = gerenciador_jobs.obter(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+
+@router.post("/fila/tarefas", status_code=status.HTTP_202_ACCEPTED)
+def enfileirar_tarefas(
+    tarefas: str = "faturamento,fechamento",
+    start: str = None,
+    end: str = None,
+    centro: str = None,
+):
+    """
+    Enfileira uma tarefa por (tarefa, filial, dia) na fila consumida pelos workers (`python -m app.worker`).
+
+    Args:
+        tarefas (str): Tarefas separadas por vírgula (faturamento, fechamento, cancelamentos, devolucoes).
+        start (str): Data inicial (dd/mm/aaaa). Padrão é a data atual.
+        end (str): Data final (dd/mm/aaaa). Padrão é a data atual.
+        centro (str): Centro/filial específico. Padrão: todas as filiais.
+
+    Returns:
+        dict: O número de tarefas enfileiradas (as já ativas são ignoradas).
+
+    Raises:
+        HTTPException: 400 se alguma tarefa for desconhecida.
+    """
+    db = SessionLocal()
+    try:
+        quantidade = fila.enfileirar_tarefas(
+            db, tarefas.split(","), _filiais_job(centro), start, end
+        )
+        return {"enfileiradas": quantidade}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        db.close()
+
+
+@router.get("/fila/tarefas")
+def resumo_fila():
+    """
+    Retorna a quantidade de tarefas na fila por tarefa e status.
+    """
+    db = SessionLocal()
+    try:
+        return fila.resumo_fila(db)
+    finally:
+        db.close()
+
+
+@router.get("/agendador")
+def estado_agendador(job: str = None, limite: int = 20):
+    """
+    Retorna o estado do agendador interno e o histórico das execuções agendadas.
+
+    Args:
+        job (str): Filtra o histórico por job (faturamento, reenvio, cancelamentos ou devolucoes).
+        limite (int): Número máximo de execuções retornadas.
+
+    Returns:
+        dict: Se o agendador está ativo, os jobs (horário, próxima execução, em execução) e o histórico.
+    """
+    return {
+        "ativo": agendador_ativo,
+        "jobs": agendador.agendador.estado(),
+        "historico": agendador.historico(job=job, limite=limite),
+    }
+
+
+@router.get("/mudancas")
+def estado_mudancas():
+    """
+    Retorna o estado do listener de mudanças em hanasync_faturamento_notas.
+
+    Returns:
+        dict: Se o listener está ativo e conectado, o número de notificações recebidas e a quantidade de
+        (filial, data) da última notificação.
+    """
+    return {"ativo": mudancas_ativo, **monitor_mudancas.estado()}
+
+
+@router.get("/cache")
+def estado_cache():
+    """
+    Retorna o estado do cache em memória das respostas das rotas de consulta.
+
+    Returns:
+        dict: Se o cache está ativo, o número de respostas guardadas e os acertos, respostas obsoletas
+        devolvidas e faltas desde o início da aplicação.
+    """
+    return {"ativo": cache_respostas_ativo, **cache_respostas.estado()}
+
+
+@router.delete("/cache")
+def limpar_cache():
+    """
+    Remove todas as respostas guardadas no cache em memória.
+    """
+    cache_respostas.limpar()
+    return {"message": "Cache de respostas limpo"}
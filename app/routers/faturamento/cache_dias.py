@@ -0,0 +1,300 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import defaultdict
+from datetime import date, datetime
+from typing import List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from app.log_config import setup_logger
+from app.serializacao import de_json, para_json
+from app.locks import dias_periodo
+from app.configuracoes import cache_dias_ativo, cache_dias_arquivo, cache_dias_max_bytes
+from . import crud
+from .models import ItemFaturamento
+from .schemas import Fechamento, ModelScannTech
+
+"""
+Módulo do Cache de Dias Fechados
+
+Guarda em disco (SQLite, `cache_dias_arquivo`) as notas agregadas de cada (dia, filial, agrupar_outros) já
+encerrado, para que as consultas de períodos passados em `/faturamento/` e `/fechamento` não recalculem
+do Postgres notas que quase nunca mudam.
+
+- Cada dia é validado pela sua impressão (`crud.impressoes_por_dia`: quantidade de itens, cancelados, data
+  e hora mais recentes e soma do TOTAL_BRUTO), obtida para todo o período com uma única consulta agrupada.
+  Uma impressão diferente descarta o dia guardado.
+- Um período é montado com os dias guardados e válidos; os demais dias, e sempre o dia atual, são calculados
+  com uma única consulta e os dias fechados entre eles são guardados.
+- O conteúdo é o JSON das notas comprimido com zlib. Quando o arquivo passa de `cache_dias_max_bytes`, os
+  dias acessados há mais tempo são removidos (LRU).
+- Com o listener de mudanças (`app.mudancas`), as (filial, data) alteradas são removidas na hora.
+
+Uma consulta sem filial (todas as filiais) é guardada separadamente, com a filial "*".
+"""
+
+TODAS = "*"
+SEM_ITENS = "0:0:None:None:0"
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+class CacheDias:
+    """
+    Cache em disco das notas agregadas por (filial, dia, agrupar_outros).
+
+    Args:
+        arquivo (str): O arquivo SQLite.
+        max_bytes (int): Tamanho máximo do conteúdo guardado.
+    """
+
+    def __init__(self, arquivo: str = cache_dias_arquivo, max_bytes: int = cache_dias_max_bytes):
+        self.arquivo = arquivo
+        self.max_bytes = max_bytes
+        self.acertos = 0
+        self.faltas = 0
+        self._lock = threading.Lock()
+        self._criado = False
+
+    def _conectar(self) -> sqlite3.Connection:
+        if not self._criado:
+            with self._lock:
+                if not self._criado:
+                    os.makedirs(os.path.dirname(self.arquivo) or ".", exist_ok=True)
+                    conexao = sqlite3.connect(self.arquivo, timeout=30)
+                    conexao.execute("PRAGMA journal_mode=WAL")
+                    conexao.execute(
+                        "CREATE TABLE IF NOT EXISTS dias ("
+                        "filial TEXT, dia TEXT, agrupar_outros INTEGER, impressao TEXT, "
+                        "conteudo BLOB, tamanho INTEGER, acessado_em REAL, "
+                        "PRIMARY KEY (filial, dia, agrupar_outros))"
+                    )
+                    conexao.execute("CREATE INDEX IF NOT EXISTS ix_dias_acesso ON dias (acessado_em)")
+                    conexao.commit()
+                    conexao.close()
+                    self._criado = True
+        return sqlite3.connect(self.arquivo, timeout=30)
+
+    def obter(
+        self, filial: str, dia: date, agrupar_outros: bool, impressao: str
+    ) -> Optional[List[ModelScannTech]]:
+        """
+        Retorna as notas guardadas do dia, ou None se não houver ou se a impressão mudou.
+        """
+        chave = (filial or TODAS, dia.isoformat(), int(agrupar_outros))
+        conexao = self._conectar()
+        try:
+            linha = conexao.execute(
+                "SELECT impressao, conteudo FROM dias WHERE filial = ? AND dia = ? AND agrupar_outros = ?",
+                chave,
+            ).fetchone()
+            if linha is None or linha[0] != impressao:
+                self.faltas += 1
+                return None
+            conexao.execute(
+                "UPDATE dias SET acessado_em = ? WHERE filial = ? AND dia = ? AND agrupar_outros = ?",
+                (time.time(), *chave),
+            )
+            conexao.commit()
+        finally:
+            conexao.close()
+        self.acertos += 1
+        return de_json(zlib.decompress(linha[1]), List[ModelScannTech])
+
+    def gravar(
+        self,
+        filial: str,
+        dia: date,
+        agrupar_outros: bool,
+        impressao: str,
+        notas: List[ModelScannTech],
+    ):
+        """
+        Guarda as notas do dia e remove os dias menos acessados se o limite de tamanho for ultrapassado.
+        """
+        conteudo = zlib.compress(para_json(notas, List[ModelScannTech]))
+        conexao = self._conectar()
+        try:
+            conexao.execute(
+                "INSERT OR REPLACE INTO dias VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    filial or TODAS,
+                    dia.isoformat(),
+                    int(agrupar_outros),
+                    impressao,
+                    conteudo,
+                    len(conteudo),
+                    time.time(),
+                ),
+            )
+            conexao.commit()
+            self._despejar(conexao)
+        finally:
+            conexao.close()
+
+    def _despejar(self, conexao: sqlite3.Connection):
+        total = conexao.execute("SELECT COALESCE(SUM(tamanho), 0) FROM dias").fetchone()[0]
+        while total > self.max_bytes:
+            antigos = conexao.execute(
+                "SELECT rowid, tamanho FROM dias ORDER BY acessado_em LIMIT 50"
+            ).fetchall()
+            if not antigos:
+                break
+            conexao.executemany("DELETE FROM dias WHERE rowid = ?", [(r,) for r, _ in antigos])
+            conexao.commit()
+            total -= sum(tamanho for _, tamanho in antigos)
+            logger.info("Cache de dias: %s dias removidos por limite de tamanho.", len(antigos))
+
+    def invalidar(self, alteracoes: Optional[Set[Tuple[str, date]]]):
+        """
+        Remove os dias alterados de cada filial e das consultas sem filial. Recebe as alterações do listener
+        de mudanças (ver `app.mudancas`); "tudo" (None) é ignorado, já que cada dia é validado pela impressão.
+        """
+        if not alteracoes:
+            return
+        chaves = [
+            (filial, dia.isoformat())
+            for filial_alterada, dia in alteracoes
+            for filial in (filial_alterada, TODAS)
+        ]
+        conexao = self._conectar()
+        try:
+            conexao.executemany("DELETE FROM dias WHERE filial = ? AND dia = ?", chaves)
+            conexao.commit()
+        finally:
+            conexao.close()
+
+    def estado(self) -> dict:
+        conexao = self._conectar()
+        try:
+            dias, tamanho = conexao.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM dias"
+            ).fetchone()
+        finally:
+            conexao.close()
+        return {
+            "dias": dias,
+            "bytes": tamanho,
+            "max_bytes": self.max_bytes,
+            "acertos": self.acertos,
+            "faltas": self.faltas,
+        }
+
+
+cache_dias = CacheDias()
+
+
+def _montar_periodo(
+    db: Session,
+    data_inicial: str,
+    data_final: str,
+    agrupar_outros: bool,
+    filial: str,
+) -> List[ModelScannTech]:
+    dias = dias_periodo(data_inicial, data_final)
+    hoje = datetime.now().date()
+    fechados = [dia for dia in dias if dia < hoje]
+
+    por_dia = {}
+    impressoes = {}
+    if fechados:
+        impressoes = crud.impressoes_por_dia(db, fechados[0], fechados[-1], filial)
+        for dia in fechados:
+            notas = cache_dias.obter(filial, dia, agrupar_outros, impressoes.get(dia, SEM_ITENS))
+            if notas is not None:
+                por_dia[dia] = notas
+
+    faltantes = [dia for dia in dias if dia not in por_dia]
+    if faltantes:
+        # Uma única consulta para todos os dias que não estavam guardados, separados depois por dia
+        itens = (
+            db.query(ItemFaturamento)
+            .filter(
+                crud.filtro_itens_faturamento(faltantes[0], faltantes[-1], True, filial)
+                & ItemFaturamento.DATA_CRIADA.in_(faltantes)
+            )
+            .order_by(ItemFaturamento.DATA_CRIADA.desc())
+            .all()
+        )
+        itens_por_dia = defaultdict(list)
+        for item in itens:
+            itens_por_dia[item.DATA_CRIADA].append(item)
+        for dia in faltantes:
+            itens_dia = itens_por_dia.get(dia)
+            por_dia[dia] = (
+                crud.aggregate_by_numero_nota(db, itens_dia, agrupar_outros=agrupar_outros)
+                if itens_dia
+                else []
+            )
+            if dia < hoje:
+                cache_dias.gravar(
+                    filial, dia, agrupar_outros, impressoes.get(dia, SEM_ITENS), por_dia[dia]
+                )
+
+    logger.info(
+        "Cache de dias (%s a %s, filial %s): %s dias guardados, %s calculados.",
+        data_inicial,
+        data_final,
+        filial,
+        len(dias) - len(faltantes),
+        len(faltantes),
+    )
+    resposta = [nota for dia in sorted(dias, reverse=True) for nota in por_dia[dia]]
+    crud.generate_csv_and_xlsx(resposta, dias[0], filial)
+    return resposta
+
+
+def get_faturamento_per_date(
+    db: Session,
+    data_inicial: str,
+    data_final: str,
+    agrupar_outros: bool = True,
+    filial: str = None,
+) -> List[ModelScannTech]:
+    """
+    Equivale a `crud.get_faturamento_per_date` (sem as notas canceladas), com os dias fechados vindos do cache.
+
+    Args:
+        db (Session): Objeto de sessão do banco de dados.
+        data_inicial (str): Data inicial no formato "dd/mm/yyyy".
+        data_final (str): Data final no formato "dd/mm/yyyy".
+        agrupar_outros (bool, optional): flag para anonimizar os produtos que não são bridgestone. Defaults to True.
+        filial (str, optional): Filtra o faturamento por filial. O padrão é None.
+
+    Returns:
+        List[ModelScannTech]: As notas do período, da mais recente para a mais antiga. Se o cache falhar, o
+        período é calculado como em `crud.get_faturamento_per_date`.
+    """
+    if cache_dias_ativo:
+        try:
+            return _montar_periodo(db, data_inicial, data_final, agrupar_outros, filial)
+        except Exception as e:
+            logger.error(f"Erro no cache de dias; calculando o período: {e}")
+            db.rollback()
+    return crud.get_faturamento_per_date(
+        db, data_inicial, data_final, agrupar_outros=agrupar_outros, filial=filial
+    )
+
+
+def get_fechamento_per_date(
+    db: Session,
+    data_inicial: str,
+    data_final: str,
+    agrupar_outros: bool = True,
+    filial: str = None,
+) -> Fechamento:
+    """
+    Equivale a `crud.get_fechamento_per_date`, calculado a partir das notas de `get_faturamento_per_date`.
+    """
+    faturamentos = get_faturamento_per_date(
+        db, data_inicial, data_final, agrupar_outros=agrupar_outros, filial=filial
+    )
+    if faturamentos is None:
+        return None
+    return crud.calcular_fechamento(faturamentos)
@@ -1,6 +1,7 @@
 from copy import deepcopy
 from decimal import Decimal
-from typing import List
+from typing import Dict, List, Tuple
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from . import models, schemas
 from ..clientes import schemas as clientes_schemas
@@ -8,10 +9,11 @@ from ..clientes import models as clientes_models
 from collections import defaultdict
 from datetime import datetime, date
 import os
+import time
 import pandas as pd
+from app.eventos import publicar
 from app.configuracoes import (
     agrupar_outros_flag,
-    limpar_arquivos_antigos,
 )
 
 
@@ -73,6 +75,163 @@ def get_faturamento(
         return None
 
 
+def filtro_itens_faturamento(
+    data_inicial: date,
+    data_final: date,
+    filtrar_canceladas: bool = True,
+    filial: str = None,
+):
+    """
+    Retorna o filtro dos itens de faturamento de venda de um intervalo de datas, compartilhado pelas consultas
+    de itens (`consultar_itens_faturamento`) e pela impressão do faturamento (`impressao_faturamento`).
+    """
+    return (
+        models.ItemFaturamento.NUMERO_NOTA.isnot(None)
+        & models.ItemFaturamento.RESULTADO_FATURAMENTO.isnot(None)
+        & models.ItemFaturamento.COMISSAO_TIPO.like("VENDA")
+        # & models.ItemFaturamento.TIPO_ORDEM.not_like("ZVSR")
+        & (
+            models.ItemFaturamento.CFOP.not_like("5117AA")
+            | models.ItemFaturamento.CFOP.not_like("6117AA")
+        )
+        # & models.ItemFaturamento.CENTRO.not_like("02%")
+        & models.ItemFaturamento.CENTRO.not_like("03%")
+        # & models.ItemFaturamento.CENTRO.not_like("0105")
+        & (models.ItemFaturamento.CENTRO.like(filial) if filial else True)
+        & (
+            models.ItemFaturamento.CANCELADA.is_(None)
+            if filtrar_canceladas
+            else True
+        )
+        & models.ItemFaturamento.DATA_CRIADA.between(data_inicial, data_final)
+    )
+
+
+def consultar_itens_faturamento(
+    db: Session,
+    data_inicial: date,
+    data_final: date,
+    filtrar_canceladas: bool = True,
+    filial: str = None,
+) -> List[models.ItemFaturamento]:
+    """
+    Retorna os itens de faturamento de venda de um intervalo de datas, do mais recente para o mais antigo.
+    Args:
+        db (Session): Objeto de sessão do banco de dados.
+        data_inicial (date): Data inicial.
+        data_final (date): Data final.
+        filtrar_canceladas (bool, optional): Indica se deve filtrar os itens cancelados. O padrão é True.
+        filial (str, optional): Filtra os itens por filial. O padrão é None.
+    Returns:
+        List[models.ItemFaturamento]: Os itens encontrados.
+    """
+    return (
+        db.query(models.ItemFaturamento)
+        .filter(
+            filtro_itens_faturamento(data_inicial, data_final, filtrar_canceladas, filial)
+        )
+        .order_by(models.ItemFaturamento.DATA_CRIADA.desc())
+        .all()
+    )
+
+
+def impressao_faturamento(
+    db: Session,
+    data_inicial: date,
+    data_final: date,
+    filial: str = None,
+) -> str:
+    """
+    Retorna uma impressão barata dos itens de faturamento de um intervalo de datas, incluindo os cancelados:
+    a quantidade de itens e de itens cancelados, a data e a hora do item mais recente e a soma do TOTAL_BRUTO.
+    Uma impressão igual indica que as notas do período não mudaram desde o último cálculo, sem consultar
+    nem agregar os itens.
+    Args:
+        db (Session): Objeto de sessão do banco de dados.
+        data_inicial (date): Data inicial.
+        data_final (date): Data final.
+        filial (str, optional): Filtra os itens por filial. O padrão é None.
+    Returns:
+        str: A impressão.
+    """
+    quantidade, canceladas, ultima_data, ultima_hora, total = (
+        db.query(*_colunas_impressao())
+        .filter(filtro_itens_faturamento(data_inicial, data_final, False, filial))
+        .one()
+    )
+    return f"{quantidade}:{canceladas}:{ultima_data}:{ultima_hora}:{round(total or 0, 2)}"
+
+
+def _colunas_impressao():
+    return (
+        func.count(models.ItemFaturamento.ID),
+        func.count(models.ItemFaturamento.CANCELADA),
+        func.max(models.ItemFaturamento.DATA_CRIADA),
+        func.max(models.ItemFaturamento.HORA_CRIADA),
+        func.sum(models.ItemFaturamento.TOTAL_BRUTO),
+    )
+
+
+def impressoes_por_dia(
+    db: Session,
+    data_inicial: date,
+    data_final: date,
+    filial: str = None,
+) -> Dict[date, str]:
+    """
+    Retorna a impressão (ver `impressao_faturamento`) de cada dia de um intervalo, com uma única consulta
+    agrupada.
+    Args:
+        db (Session): Objeto de sessão do banco de dados.
+        data_inicial (date): Data inicial.
+        data_final (date): Data final.
+        filial (str, optional): Filtra os itens por filial. O padrão é None.
+    Returns:
+        Dict[date, str]: A impressão de cada dia com itens. Dias sem itens não aparecem.
+    """
+    linhas = (
+        db.query(models.ItemFaturamento.DATA_CRIADA, *_colunas_impressao())
+        .filter(filtro_itens_faturamento(data_inicial, data_final, False, filial))
+        .group_by(models.ItemFaturamento.DATA_CRIADA)
+    )
+    return {
+        dia: f"{quantidade}:{canceladas}:{ultima_data}:{ultima_hora}:{round(total or 0, 2)}"
+        for dia, quantidade, canceladas, ultima_data, ultima_hora, total in linhas
+    }
+
+
+def contar_notas_por_filial(
+    db: Session,
+    data_inicial: date,
+    data_final: date,
+    filiais: List[str] = None,
+) -> Dict[Tuple[str, date], int]:
+    """
+    Conta, com uma única consulta agrupada, as notas não canceladas de cada filial e dia de um intervalo.
+    Args:
+        db (Session): Objeto de sessão do banco de dados.
+        data_inicial (date): Data inicial.
+        data_final (date): Data final.
+        filiais (List[str], optional): Restringe a contagem a estas filiais. O padrão é None (todas).
+    Returns:
+        Dict[Tuple[str, date], int]: A quantidade de notas por (filial, dia). Filiais e dias sem notas não
+        aparecem.
+    """
+    consulta = db.query(
+        models.ItemFaturamento.CENTRO,
+        models.ItemFaturamento.DATA_CRIADA,
+        func.count(func.distinct(models.ItemFaturamento.NUMERO_NOTA)),
+    ).filter(filtro_itens_faturamento(data_inicial, data_final, True))
+    if filiais:
+        consulta = consulta.filter(models.ItemFaturamento.CENTRO.in_(filiais))
+    return {
+        (centro, dia): quantidade
+        for centro, dia, quantidade in consulta.group_by(
+            models.ItemFaturamento.CENTRO, models.ItemFaturamento.DATA_CRIADA
+        )
+    }
+
+
 # Filtro por range de datas
 def get_faturamento_per_date(
     db: Session,
@@ -102,41 +261,96 @@ def get_faturamento_per_date(
 
     try:
         print(filial)
-        faturamentos = (
-            db.query(models.ItemFaturamento)
-            .filter(
-                models.ItemFaturamento.NUMERO_NOTA.isnot(None)
-                & models.ItemFaturamento.RESULTADO_FATURAMENTO.isnot(None)
-                & models.ItemFaturamento.COMISSAO_TIPO.like("VENDA")
-                # & models.ItemFaturamento.TIPO_ORDEM.not_like("ZVSR")
-                & (
-                    models.ItemFaturamento.CFOP.not_like("5117AA")
-                    | models.ItemFaturamento.CFOP.not_like("6117AA")
-                )
-                # & models.ItemFaturamento.CENTRO.not_like("02%")
-                & models.ItemFaturamento.CENTRO.not_like("03%")
-                # & models.ItemFaturamento.CENTRO.not_like("0105")
-                & (models.ItemFaturamento.CENTRO.like(filial) if filial else True)
-                & (
-                    models.ItemFaturamento.CANCELADA.is_(None)
-                    if filtrar_canceladas
-                    else True
-                )
-                & models.ItemFaturamento.DATA_CRIADA.between(data_inicial, data_final)
-            )
-            .order_by(models.ItemFaturamento.DATA_CRIADA.desc())
-            .all()
+        inicio = time.perf_counter()
+        faturamentos = consultar_itens_faturamento(
+            db, data_inicial, data_final, filtrar_canceladas, filial
+        )
+        periodo = {"data_inicial": data_inicial, "data_final": data_final}
+        publicar(
+            "consultado",
+            filial=filial,
+            quantidade=len(faturamentos),
+            duracao=round(time.perf_counter() - inicio, 3),
+            **periodo,
         )
+        inicio = time.perf_counter()
         resposta = aggregate_by_numero_nota(
             db, faturamentos, agrupar_outros=agrupar_outros
         )
-        generate_csv_and_xlsx(resposta, data_inicial)
+        publicar(
+            "agregado",
+            filial=filial,
+            quantidade=len(resposta),
+            duracao=round(time.perf_counter() - inicio, 3),
+            **periodo,
+        )
+        generate_csv_and_xlsx(resposta, data_inicial, filial)
         return resposta
     except Exception as e:
         print(e)
         return None
 
 
+def get_faturamento_com_canceladas(
+    db: Session,
+    data_inicial: str,
+    data_final: str,
+    agrupar_outros: bool = True,
+    filial: str = None,
+) -> Tuple[List[schemas.ModelScannTech], List[schemas.ModelScannTech]]:
+    """
+    Retorna, com uma única consulta, o faturamento com e sem os itens cancelados de um intervalo de datas.
+    Equivale a chamar `get_faturamento_per_date` com `filtrar_canceladas=False` e com `filtrar_canceladas=True`:
+    as notas sem itens cancelados são agregadas uma única vez e aparecem nas duas listas; apenas as notas com
+    algum item cancelado são agregadas de novo, sem esses itens.
+    Args:
+        db (Session): Objeto de sessão do banco de dados.
+        data_inicial (str): Data inicial no formato "dd/mm/yyyy".
+        data_final (str): Data final no formato "dd/mm/yyyy".
+        agrupar_outros (bool, optional): flag para anonimizar os produtos que não são bridgestone. Defaults to True.
+        filial (str, optional): Filtra o faturamento por filial. O padrão é None.
+    Returns:
+        Tuple[List[schemas.ModelScannTech], List[schemas.ModelScannTech]]: Todas as notas, incluindo as
+        canceladas, e as notas sem os itens cancelados, da mais recente para a mais antiga.
+    """
+    data_inicial = datetime.strptime(data_inicial, "%d/%m/%Y").date()
+    data_final = datetime.strptime(data_final, "%d/%m/%Y").date()
+    periodo = {"data_inicial": data_inicial, "data_final": data_final}
+
+    inicio = time.perf_counter()
+    itens = consultar_itens_faturamento(
+        db, data_inicial, data_final, filtrar_canceladas=False, filial=filial
+    )
+    publicar(
+        "consultado",
+        filial=filial,
+        quantidade=len(itens),
+        duracao=round(time.perf_counter() - inicio, 3),
+        **periodo,
+    )
+    inicio = time.perf_counter()
+    todas = aggregate_by_numero_nota(db, itens, agrupar_outros=agrupar_outros)
+    com_cancelados = {str(item.NUMERO_NOTA) for item in itens if item.CANCELADA is not None}
+    validas = [nota for nota in todas if str(nota.numero) not in com_cancelados]
+    restantes = [
+        item
+        for item in itens
+        if str(item.NUMERO_NOTA) in com_cancelados and item.CANCELADA is None
+    ]
+    if restantes:
+        validas += aggregate_by_numero_nota(db, restantes, agrupar_outros=agrupar_outros)
+        validas.sort(key=lambda nota: nota.fecha, reverse=True)
+    publicar(
+        "agregado",
+        filial=filial,
+        quantidade=len(validas),
+        duracao=round(time.perf_counter() - inicio, 3),
+        **periodo,
+    )
+    generate_csv_and_xlsx(validas, data_inicial, filial)
+    return todas, validas
+
+
 def get_fechamento_per_date(
     db: Session,
     data_inicial: str = None,
@@ -168,33 +382,47 @@ def get_fechamento_per_date(
             agrupar_outros=agrupar_outros_flag,
             filial=filial,
         )
+        return calcular_fechamento(faturamentos)
+    except Exception as e:
+        print(e)
+        return None
 
-        if not faturamentos:
-            return schemas.Fechamento(
-                fechaVentas=datetime.now().date(),
-                montoVentaLiquida=0.0,
-                montoCancelaciones=0.0,
-                cantidadMovimientos=0,
-                cantidadCancelaciones=0,
-            )
 
-        fechamento_data = faturamentos[0].fecha.split("T")[0]
-        total_vendas = sum([f.total for f in faturamentos])
-        qtd_vendas = len(faturamentos)
-        qtd_cancelamentos = len([f for f in faturamentos if f.cancelacion])
+def calcular_fechamento(
+    faturamentos: List[schemas.ModelScannTech],
+) -> schemas.Fechamento:
+    """
+    Calcula o fechamento de vendas a partir das notas já agregadas.
+
+    Args:
+        faturamentos (List[schemas.ModelScannTech]): As notas do período, sem as canceladas.
 
-        fechamento: schemas.Fechamento = schemas.Fechamento(
-            fechaVentas=fechamento_data,
-            montoVentaLiquida=round(total_vendas, 2),
+    Returns:
+        Fechamento: O objeto Fechamento contendo as informações do fechamento de vendas.
+    """
+    if not faturamentos:
+        return schemas.Fechamento(
+            fechaVentas=datetime.now().date(),
+            montoVentaLiquida=0.0,
             montoCancelaciones=0.0,
-            cantidadMovimientos=qtd_vendas,
-            cantidadCancelaciones=qtd_cancelamentos,
+            cantidadMovimientos=0,
+            cantidadCancelaciones=0,
         )
 
-        return fechamento
-    except Exception as e:
-        print(e)
-        return None
+    fechamento_data = faturamentos[0].fecha.split("T")[0]
+    total_vendas = sum([f.total for f in faturamentos])
+    qtd_vendas = len(faturamentos)
+    qtd_cancelamentos = len([f for f in faturamentos if f.cancelacion])
+
+    fechamento: schemas.Fechamento = schemas.Fechamento(
+        fechaVentas=fechamento_data,
+        montoVentaLiquida=round(total_vendas, 2),
+        montoCancelaciones=0.0,
+        cantidadMovimientos=qtd_vendas,
+        cantidadCancelaciones=qtd_cancelamentos,
+    )
+
+    return fechamento
 
 
 def get_barcode_by_codigoMaterial(db: Session, lista_codigo_material: List[str]):
@@ -251,7 +479,7 @@ def set_idCliente(v, values: clientes_schemas.Cliente):
 
 
 def generate_csv_and_xlsx(
-    faturamentos: List[schemas.ModelScannTech], data: date = None
+    faturamentos: List[schemas.ModelScannTech], data: date = None, filial: str = None
 ):
     data_list = []
     # Transform the data into a list of dictionaries
@@ -289,10 +517,7 @@ def generate_csv_and_xlsx(
     if not os.path.exists("data"):
         os.makedirs("data")
 
-    # Limpar arquivos antigos
-    limpar_arquivos_antigos(
-        "data", 60
-    )  # 60 dias, você pode ajustar conforme necessário
+    # A limpeza das pastas antigas é feita pela rotina agendada em app.retencao
 
     # Generate the filename based on the current date
     current_date = data or datetime.now().strftime("%Y-%m-%d")
@@ -302,11 +527,14 @@ def generate_csv_and_xlsx(
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
 
+    # One file per filial, so that filiais processed in parallel don't write to the same file
+    file_suffix = f"{current_date}_{filial}" if filial else f"{current_date}"
+
     # Generate the filename for the CSV file
-    csv_filename = f"{folder_path}/faturamentos_{current_date}.csv"
+    csv_filename = f"{folder_path}/faturamentos_{file_suffix}.csv"
 
     # Generate the filename for the Excel file
-    xlsx_filename = f"{folder_path}/faturamentos_{current_date}.xlsx"
+    xlsx_filename = f"{folder_path}/faturamentos_{file_suffix}.xlsx"
 
     # Write the CSV file
     df.to_csv(csv_filename, index=False)
@@ -0,0 +1,112 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+from app.database import SessionLocal
+from app.log_config import setup_logger
+from app.eventos import publicar
+from app.locks import LockOcupado, dias_periodo, lock_tarefa
+from app.configuracoes import max_filiais_concorrentes
+from .schemas import ResultadoFilial
+
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def executar_por_filial(
+    tarefa: Callable,
+    filiais: List[str],
+    max_workers: int = max_filiais_concorrentes,
+    progresso: Callable[[ResultadoFilial], None] = None,
+    lock: str = None,
+    **kwargs,
+) -> List[ResultadoFilial]:
+    """
+    Executa uma tarefa para cada filial em paralelo, com concorrência limitada.
+
+    Parâmetros:
+    - tarefa (Callable): Função chamada como `tarefa(db, filial=filial, **kwargs)`.
+    - filiais (List[str]): As filiais a serem processadas.
+    - max_workers (int): Número máximo de filiais processadas ao mesmo tempo.
+    - progresso (Callable, opcional): Chamada com o resultado de cada filial assim que ela termina.
+    - lock (str, opcional): Nome da tarefa para o lock distribuído (ver `app.locks`). Se informado, cada
+      filial só é processada se nenhum outro worker estiver executando a mesma tarefa para ela nos mesmos
+      dias (`data_inicial` a `data_final`, ou a data atual); caso contrário, o seu resultado é um erro.
+    - **kwargs: Argumentos adicionais repassados para a tarefa.
+
+    Retorna:
+    - List[ResultadoFilial]: Um resultado por filial, na mesma ordem de `filiais`.
+
+    Descrição:
+    Cada filial é executada em uma thread do pool com a sua própria sessão do banco de dados, aberta e
+    fechada dentro da thread. Um erro em uma filial é registrado no seu resultado e não interrompe as demais,
+    de forma que o tempo total fica próximo ao da filial mais lenta.
+    """
+
+    def executar_filial(filial: str) -> ResultadoFilial:
+        inicio = time.perf_counter()
+        publicar("iniciado", tarefa=tarefa.__name__, filial=filial)
+        db = SessionLocal()
+        try:
+            if lock:
+                dias = dias_periodo(kwargs.get("data_inicial"), kwargs.get("data_final"))
+                with lock_tarefa(lock, filial, dias):
+                    resultado = tarefa(db, filial=filial, **kwargs)
+            else:
+                resultado = tarefa(db, filial=filial, **kwargs)
+            return ResultadoFilial(
+                filial=filial,
+                sucesso=True,
+                resultado=resultado,
+                duracao=round(time.perf_counter() - inicio, 3),
+            )
+        except LockOcupado as e:
+            logger.warning(str(e))
+            print(e)
+            return ResultadoFilial(
+                filial=filial,
+                sucesso=False,
+                erro=str(e),
+                duracao=round(time.perf_counter() - inicio, 3),
+            )
+        except Exception as e:
+            logger.error(f"Erro ao executar {tarefa.__name__} na filial {filial}: {e}")
+            print(f"Erro ao executar {tarefa.__name__} na filial {filial}: {e}")
+            db.rollback()
+            return ResultadoFilial(
+                filial=filial,
+                sucesso=False,
+                erro=str(e),
+                duracao=round(time.perf_counter() - inicio, 3),
+            )
+        finally:
+            db.close()
+
+    def executar(filial: str) -> ResultadoFilial:
+        resultado = executar_filial(filial)
+        publicar(
+            "concluido" if resultado.sucesso else "erro",
+            tarefa=tarefa.__name__,
+            filial=filial,
+            duracao=resultado.duracao,
+            erro=resultado.erro,
+        )
+        if progresso:
+            try:
+                progresso(resultado)
+            except Exception as e:
+                logger.error(f"Erro ao registrar o progresso da filial {filial}: {e}")
+        return resultado
+
+    if not filiais:
+        return []
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(filiais))),
+        thread_name_prefix="filial",
+    ) as pool:
+        return list(pool.map(executar, filiais))
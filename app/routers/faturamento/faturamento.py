@@ -1,17 +1,22 @@
 from datetime import datetime
+import hashlib
 import os
 from typing import Annotated, List
-from fastapi import APIRouter, FastAPI, Depends, HTTPException
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Response
 from app.log_config import setup_logger
 from app.routers.login.schemas import User
 from ...dependencies import get_current_user, oauth2_scheme
 from sqlalchemy.orm import Session
-from . import crud, models, schemas, utils
+from . import cache_dias, crud, models, schemas, utils
 from ...database import SessionLocal
 import logging
 import sys
 from logging.handlers import TimedRotatingFileHandler
-from ...configuracoes import agrupar_outros_flag
+from ...configuracoes import agrupar_outros_flag, cache_respostas_ttl_solicitacoes, etag_ativo
+from ...cache_respostas import cache_respostas
+from ...locks import dias_periodo
+from ...singleflight import chave_chamada
+from ...serializacao import RespostaJSON, serializada
 
 router = APIRouter()
 
@@ -32,6 +37,55 @@ else:
     logger = logging.getLogger(__name__)
 
 
+def etag_periodo(db: Session, endpoint: str, start: str, end: str, centro: str = None) -> str:
+    """
+    Calcula o ETag de um período a partir da impressão dos seus itens (`crud.impressao_faturamento`: uma
+    única consulta agregada com a quantidade de itens, os cancelados, a data e hora mais recentes e a soma
+    do TOTAL_BRUTO), sem agregar nem serializar as notas.
+
+    Retorno:
+    - str: O ETag (fraco), ou None se desativado ou se a impressão não puder ser calculada.
+    """
+    if not etag_ativo:
+        return None
+    try:
+        dias = dias_periodo(start, end)
+        impressao = crud.impressao_faturamento(db, dias[0], dias[-1], centro)
+    except Exception as e:
+        logger.warning(f"Erro ao calcular o ETag de {endpoint} ({start} a {end}): {e}")
+        db.rollback()
+        return None
+    resumo = hashlib.sha1(
+        f"{endpoint}:{dias[0]}:{dias[-1]}:{centro}:{agrupar_outros_flag}:{impressao}".encode()
+    ).hexdigest()
+    return f'W/"{resumo[:32]}"'
+
+
+def nao_modificado(if_none_match: str, etag: str) -> bool:
+    """
+    Indica se o cliente já tem a versão atual (comparação fraca do If-None-Match com o ETag).
+    """
+    if not etag or not if_none_match:
+        return False
+    etiquetas = {etiqueta.strip().removeprefix("W/") for etiqueta in if_none_match.split(",")}
+    return "*" in etiquetas or etag.removeprefix("W/") in etiquetas
+
+
+def cabecalhos_etag(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+
+
+def resposta_nao_modificada(etag: str) -> Response:
+    return Response(status_code=304, headers=cabecalhos_etag(etag))
+
+
+# O cache de respostas guarda o JSON pronto, serializado uma única vez por cálculo
+faturamento_serializado = serializada(
+    cache_dias.get_faturamento_per_date, List[schemas.ModelScannTech]
+)
+fechamento_serializado = serializada(cache_dias.get_fechamento_per_date, schemas.Fechamento)
+
+
 @router.get("/faturamento", response_model=List[schemas.ModelScannTech])
 async def read_faturamento(
     # token: Annotated[str, Depends(oauth2_scheme)],
@@ -66,13 +120,14 @@ async def read_faturamento(
 
 
 @router.get("/faturamento/", response_model=List[schemas.ModelScannTech])
-async def read_faturamento_per_date(
+def read_faturamento_per_date(
     # token: Annotated[str, Depends(oauth2_scheme)],
     # current_user: Annotated[User, Depends(get_current_user)],
     start: str,
     end: str,
     centro: str = None,
     db: Session = Depends(get_db),
+    if_none_match: Annotated[str, Header()] = None,
 ):
     """
     Obtém o faturamento por data.
@@ -82,22 +137,36 @@ async def read_faturamento_per_date(
     - end (str): Data de término no formato "YYYY-MM-DD".
     - centro (str, opcional): Filial do centro. Padrão é None.
     - db (Session): Sessão do banco de dados.
+    - if_none_match (str, opcional): O ETag da versão que o cliente já tem.
 
     Retorno:
-    - List[schemas.ModelScannTech]: Lista de objetos ModelScannTech contendo o faturamento.
+    - List[schemas.ModelScannTech]: Lista de objetos ModelScannTech contendo o faturamento, com o ETag do
+      período. Se o período não mudou desde o ETag do cliente, retorna 304 sem calcular as notas.
 
     Exceções:
     - HTTPException: Retorna um erro 404 se o faturamento não for encontrado.
     """
     logger.debug(f"Executing read_faturamento_per_date with start={start}, end={end}")
-    faturamento = crud.get_faturamento_per_date(
-        db, start, end, agrupar_outros=agrupar_outros_flag, filial=centro
+    etag = etag_periodo(db, "faturamento", start, end, centro)
+    if nao_modificado(if_none_match, etag):
+        return resposta_nao_modificada(etag)
+    # A resposta vem do cache em memória (pela versão do período, para que o corpo sempre corresponda ao
+    # ETag); requisições idênticas e simultâneas compartilham a mesma consulta e os dias fechados vêm do
+    # cache em disco
+    faturamento = cache_respostas.obter(
+        chave_chamada("faturamento", start=start, end=end, centro=centro, versao=etag),
+        faturamento_serializado,
+        start,
+        end,
+        db=db,
+        agrupar_outros=agrupar_outros_flag,
+        filial=centro,
     )
     if faturamento is None:
         logger.error(f"Faturamento not found for date range {start} to {end}")
         raise HTTPException(status_code=404, detail="Faturamento not found")
-    logger.info(f"Faturamento for date range {start} to {end}: {faturamento}")
-    return faturamento
+    logger.info(f"Faturamento for date range {start} to {end}: {len(faturamento)} bytes")
+    return RespostaJSON(faturamento, headers=cabecalhos_etag(etag))
 
 
 # @router.get("/faturamento/enviar/")
@@ -119,11 +188,12 @@ async def read_faturamento_per_date(
 
 
 @router.get("/fechamento", response_model=schemas.Fechamento)
-async def read_fechamento(
+def read_fechamento(
     db: Session = Depends(get_db),
     start: str = datetime.now().strftime("%d/%m/%Y"),
     end: str = datetime.now().strftime("%d/%m/%Y"),
     centro: str = None,
+    if_none_match: Annotated[str, Header()] = None,
 ):
     """
     Obtém o fechamento de faturamento com base nas datas de início e fim e no centro especificado.
@@ -133,21 +203,32 @@ async def read_fechamento(
     - start (str): Data de início no formato "%d/%m/%Y". Padrão: data atual.
     - end (str): Data de fim no formato "%d/%m/%Y". Padrão: data atual.
     - centro (str): Centro/filial específico. Padrão: None.
+    - if_none_match (str, opcional): O ETag da versão que o cliente já tem.
 
     Retorno:
-    - Fechamento (schemas.Fechamento): Objeto que representa o fechamento de faturamento.
+    - Fechamento (schemas.Fechamento): Objeto que representa o fechamento de faturamento, com o ETag do
+      período. Se o período não mudou desde o ETag do cliente, retorna 304 sem calcular o fechamento.
 
     Exceções:
     - HTTPException: Retorna um erro 404 se o fechamento não for encontrado.
     """
-    fechamento = crud.get_fechamento_per_date(
-        db, start, end, agrupar_outros=agrupar_outros_flag, filial=centro
+    etag = etag_periodo(db, "fechamento", start, end, centro)
+    if nao_modificado(if_none_match, etag):
+        return resposta_nao_modificada(etag)
+    fechamento = cache_respostas.obter(
+        chave_chamada("fechamento", start=start, end=end, centro=centro, versao=etag),
+        fechamento_serializado,
+        start,
+        end,
+        db=db,
+        agrupar_outros=agrupar_outros_flag,
+        filial=centro,
     )
     if not fechamento:
         logger.error("Fechamento not found")
         raise HTTPException(status_code=404, detail="Fechamento not found")
-    logger.info(f"Fechamento: {fechamento}")
-    return fechamento
+    logger.info(f"Fechamento: {fechamento.decode()}")
+    return RespostaJSON(fechamento, headers=cabecalhos_etag(etag))
 
 
 # @router.get("/fechamento/enviar/")
@@ -183,7 +264,7 @@ async def read_fechamento(
 
 
 @router.get("/solicitacoes", response_model=List[schemas.Solicitacoes])
-async def read_solicitacoes(
+def read_solicitacoes(
     centro: str = None,
 ):
     """
@@ -196,9 +277,20 @@ async def read_solicitacoes(
     - List[schemas.Solicitacoes]: Uma lista de objetos de solicitações de reenvio de faturamento.
 
     Exceções:
-    - Nenhuma exceção é lançada explicitamente neste método.
+    - HTTPException: Retorna um erro 502 se a API da ScannTech falhar e não houver resposta guardada.
     """
-    solicitacoes = utils.get_solicitacoes_reenvio(filial=centro)
+    try:
+        # Uma falha da API não é guardada no cache; dentro do prazo, a resposta anterior continua valendo
+        solicitacoes = cache_respostas.obter(
+            chave_chamada("solicitacoes", centro=centro),
+            utils.get_solicitacoes_reenvio,
+            ttl=cache_respostas_ttl_solicitacoes,
+            filial=centro,
+            levantar_erros=True,
+        )
+    except Exception as e:
+        logger.error(f"Erro ao obter as solicitações de reenvio: {e}")
+        raise HTTPException(status_code=502, detail="Erro ao obter as solicitações de reenvio")
     if not solicitacoes:
         logger.error("Solicitacoes not found")
         return []
@@ -0,0 +1,277 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.log_config import setup_logger
+from app.locks import LockOcupado, dias_periodo, lock_tarefa
+from app.configuracoes import (
+    filiais,
+    fila_threads,
+    fila_intervalo,
+    fila_max_tentativas,
+    fila_backoff,
+    fila_tempo_reserva,
+)
+from .models import TarefaFila
+from .utils import (
+    enviar_faturamento_para_api_externa,
+    enviar_fechamento_diario,
+    verificar_cancelamentos_enviar,
+    verificar_devolucoes,
+)
+
+"""
+Módulo da Fila de Tarefas
+
+Fila de trabalho no Postgres (`scanntech_fila_tarefas`) para dividir uma execução noturna ou um backfill
+entre vários containers, sem broker externo. Cada linha é uma tarefa de uma filial em um dia; um índice
+único parcial impede que a mesma (tarefa, filial, data) seja enfileirada duas vezes enquanto estiver ativa.
+
+Os workers (`python -m app.worker`, ou a própria API com `fila_worker_na_api`) reservam uma tarefa por vez
+com `SELECT ... FOR UPDATE SKIP LOCKED`, de forma que cada tarefa é executada por um único worker. A reserva
+vale por `fila_tempo_reserva`; se o worker morrer, a tarefa volta a ficar disponível. Uma tarefa com erro
+volta para a fila após `fila_backoff`, até `fila_max_tentativas`.
+
+Status: pendente, executando, concluida ou erro.
+"""
+
+PENDENTE = "pendente"
+EXECUTANDO = "executando"
+CONCLUIDA = "concluida"
+ERRO = "erro"
+
+# Tarefa -> função chamada como `funcao(db, filial, data)`, com a data no formato dd/mm/aaaa
+TAREFAS = {
+    "faturamento": lambda db, filial, data: enviar_faturamento_para_api_externa(
+        db, data_inicial=data, data_final=data, filial=filial
+    ),
+    "fechamento": lambda db, filial, data: enviar_fechamento_diario(
+        db, data_inicial=data, data_final=data, filial=filial
+    ),
+    # As verificações de cancelamentos e devoluções consideram o período da própria função; a data
+    # identifica apenas a execução
+    "cancelamentos": lambda db, filial, data: verificar_cancelamentos_enviar(db, filial=filial),
+    "devolucoes": lambda db, filial, data: verificar_devolucoes(db, filial=filial),
+}
+
+# Tarefas que enviam sempre o fechamento da data atual: enfileiradas uma única vez, na data atual, qualquer
+# que seja o período
+TAREFAS_DATA_ATUAL = {"cancelamentos", "devolucoes"}
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def enfileirar_tarefas(
+    db: Session,
+    tarefas: List[str],
+    filiais: List[str] = filiais,
+    data_inicial: str = None,
+    data_final: str = None,
+) -> int:
+    """
+    Enfileira uma tarefa por (tarefa, filial, dia) do período. As tarefas de `TAREFAS_DATA_ATUAL` são
+    enfileiradas apenas na data atual, já que cada execução envia o fechamento do dia.
+
+    Parâmetros:
+    - db (Session): Sessão do banco de dados.
+    - tarefas (List[str]): As tarefas (chaves de `TAREFAS`).
+    - filiais (List[str]): As filiais.
+    - data_inicial (str, opcional): Data inicial no formato dd/mm/aaaa. Padrão: data atual.
+    - data_final (str, opcional): Data final no formato dd/mm/aaaa. Padrão: data atual.
+
+    Retorna:
+    - int: O número de tarefas enfileiradas. As que já estão pendentes ou em execução são ignoradas.
+    """
+    desconhecidas = set(tarefas) - set(TAREFAS)
+    if desconhecidas:
+        raise ValueError(f"Tarefas desconhecidas: {', '.join(sorted(desconhecidas))}")
+    agora = datetime.now()
+    dias = dias_periodo(data_inicial, data_final)
+    if len(dias) > 1 and TAREFAS_DATA_ATUAL & set(tarefas):
+        logger.warning(
+            "%s enfileiradas apenas na data atual: a verificação não depende do período.",
+            ", ".join(sorted(TAREFAS_DATA_ATUAL & set(tarefas))),
+        )
+    linhas = [
+        {
+            "tarefa": tarefa,
+            "filial": filial,
+            "data": dia,
+            "status": PENDENTE,
+            "tentativas": 0,
+            "disponivel_em": agora,
+            "criado_em": agora,
+        }
+        # Dia a dia, de forma que os workers dividem o período
+        for tarefa in tarefas
+        for dia in ([agora.date()] if tarefa in TAREFAS_DATA_ATUAL else dias)
+        for filial in filiais
+    ]
+    if not linhas:
+        return 0
+    resultado = db.execute(
+        insert(TarefaFila)
+        .values(linhas)
+        .on_conflict_do_nothing(
+            index_elements=["tarefa", "filial", "data"],
+            index_where=text("status IN ('pendente', 'executando')"),
+        )
+    )
+    db.commit()
+    logger.info("%s de %s tarefas enfileiradas.", resultado.rowcount, len(linhas))
+    return resultado.rowcount
+
+
+def resumo_fila(db: Session) -> Dict[str, Dict[str, int]]:
+    """
+    Retorna a quantidade de tarefas por tarefa e status.
+    """
+    resumo = {}
+    for tarefa, status, quantidade in (
+        db.query(TarefaFila.tarefa, TarefaFila.status, func.count(TarefaFila.id))
+        .group_by(TarefaFila.tarefa, TarefaFila.status)
+        .all()
+    ):
+        resumo.setdefault(tarefa, {})[status] = quantidade
+    return resumo
+
+
+def reservar_tarefa(db: Session, worker: str) -> TarefaFila:
+    """
+    Reserva a próxima tarefa disponível, incluindo as que ficaram "executando" com a reserva expirada.
+
+    Retorna:
+    - TarefaFila: A tarefa reservada, ou None se a fila estiver vazia.
+    """
+    agora = datetime.now()
+    tarefa = (
+        db.query(TarefaFila)
+        .filter(
+            TarefaFila.status.in_([PENDENTE, EXECUTANDO])
+            & (TarefaFila.disponivel_em <= agora)
+        )
+        .order_by(TarefaFila.data, TarefaFila.disponivel_em)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if tarefa is None:
+        db.rollback()
+        return None
+    tarefa.status = EXECUTANDO
+    tarefa.tentativas = (tarefa.tentativas or 0) + 1
+    tarefa.reservado_por = worker
+    tarefa.iniciado_em = agora
+    tarefa.disponivel_em = agora + timedelta(seconds=fila_tempo_reserva)
+    db.commit()
+    return tarefa
+
+
+def executar_proxima(worker: str) -> bool:
+    """
+    Reserva e executa uma tarefa da fila.
+
+    Retorna:
+    - bool: Verdadeiro se uma tarefa foi executada (com sucesso ou não); falso se a fila estava vazia.
+    """
+    db = SessionLocal()
+    try:
+        tarefa = reservar_tarefa(db, worker)
+        if tarefa is None:
+            return False
+        nome, filial, dia = tarefa.tarefa, tarefa.filial, tarefa.data
+        data = dia.strftime("%d/%m/%Y")
+        inicio = time.perf_counter()
+        try:
+            # O lock também exclui as execuções disparadas pela API para a mesma filial e dia
+            with lock_tarefa(nome, filial, [dia]):
+                TAREFAS[nome](db, filial, data)
+            tarefa.status = CONCLUIDA
+            tarefa.erro = None
+            logger.info("Tarefa %s da filial %s em %s concluída por %s.", nome, filial, data, worker)
+        except LockOcupado as e:
+            # Outra execução está em andamento: tenta de novo depois, sem contar como tentativa
+            db.rollback()
+            tarefa.status = PENDENTE
+            tarefa.tentativas -= 1
+            tarefa.erro = str(e)
+            tarefa.disponivel_em = datetime.now() + timedelta(seconds=fila_intervalo)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Erro na tarefa {nome} da filial {filial} em {data}: {e}")
+            print(f"Erro na tarefa {nome} da filial {filial} em {data}: {e}")
+            tarefa.erro = str(e)
+            if tarefa.tentativas >= fila_max_tentativas:
+                tarefa.status = ERRO
+            else:
+                tarefa.status = PENDENTE
+                tarefa.disponivel_em = datetime.now() + timedelta(seconds=fila_backoff)
+        tarefa.duracao = round(time.perf_counter() - inicio, 3)
+        if tarefa.status in (CONCLUIDA, ERRO):
+            tarefa.finalizado_em = datetime.now()
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao consumir a fila de tarefas: {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+class WorkerFila:
+    """
+    Consome a fila de tarefas com `threads` threads, cada uma executando uma tarefa por vez.
+
+    Args:
+        threads (int): Número de tarefas executadas ao mesmo tempo.
+        intervalo (float): Segundos de espera quando a fila está vazia.
+    """
+
+    def __init__(self, threads: int = fila_threads, intervalo: float = fila_intervalo):
+        self.threads = threads
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._threads = []
+
+    def _loop(self, worker: str):
+        while not self._parar.is_set():
+            if not executar_proxima(worker):
+                self._parar.wait(self.intervalo)
+
+    def iniciar(self):
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        self._parar.clear()
+        prefixo = f"{socket.gethostname()}:{os.getpid()}"
+        self._threads = [
+            threading.Thread(
+                target=self._loop, args=(f"{prefixo}:{i}",), name=f"fila-{i}", daemon=True
+            )
+            for i in range(self.threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info("Worker da fila iniciado (%s, %s threads).", prefixo, self.threads)
+
+    def parar(self, timeout: float = None):
+        """
+        Sinaliza as threads para parar após a tarefa atual e aguarda até `timeout` segundos.
+        """
+        self._parar.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+worker_fila = WorkerFila()
@@ -0,0 +1,326 @@
+import json
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Hashable, List
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func
+from app.database import SessionLocal
+from app.log_config import setup_logger
+from app.configuracoes import jobs_concorrentes, jobs_heartbeat, jobs_tempo_heartbeat
+from . import models, schemas
+
+"""
+Módulo de Jobs
+
+Executa as tarefas de `scriptSend` disparadas pela API fora do loop de eventos. A rota cria o job e
+responde imediatamente (202) com o seu id; o job roda em um pool de threads limitado a
+`jobs_concorrentes` e o seu andamento fica gravado em `scanntech_jobs`:
+
+- status: pendente, executando, concluido, erro ou interrompido (o processo terminou durante a execução).
+- atualizado_em: o heartbeat do job, renovado a cada `jobs_heartbeat` segundos pelo processo que o executa
+  e a cada progresso. Um job pendente ou em execução sem heartbeat há mais de `jobs_tempo_heartbeat`
+  segundos é marcado como interrompido, qualquer que seja o host ou container em que ele rodava.
+- progresso: o status, a duração e o erro de cada filial, atualizados à medida que as filiais terminam. As
+  filiais puladas por não terem notas no período ficam com o status sem_movimento (ver `planejador`).
+- resultado: o retorno da tarefa, em JSON.
+"""
+
+PENDENTE = "pendente"
+EXECUTANDO = "executando"
+CONCLUIDO = "concluido"
+ERRO = "erro"
+INTERROMPIDO = "interrompido"
+SEM_MOVIMENTO = "sem_movimento"
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def _para_schema(job: models.Job) -> schemas.Job:
+    return schemas.Job(
+        id=job.id,
+        tipo=job.tipo,
+        status=job.status,
+        parametros=json.loads(job.parametros or "{}"),
+        progresso=json.loads(job.progresso or "{}"),
+        resultado=json.loads(job.resultado) if job.resultado else None,
+        erro=job.erro,
+        criado_em=job.criado_em,
+        iniciado_em=job.iniciado_em,
+        finalizado_em=job.finalizado_em,
+    )
+
+
+class GerenciadorJobs:
+    """
+    Cria, executa e consulta os jobs.
+
+    Args:
+        max_workers (int): Número máximo de jobs executados ao mesmo tempo. Os demais aguardam como pendentes.
+        intervalo_heartbeat (float): Segundos entre as renovações do heartbeat dos jobs deste processo.
+        tempo_heartbeat (float): Segundos sem heartbeat até um job ser marcado como interrompido.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = jobs_concorrentes,
+        intervalo_heartbeat: float = jobs_heartbeat,
+        tempo_heartbeat: float = jobs_tempo_heartbeat,
+    ):
+        self.max_workers = max_workers
+        self.intervalo_heartbeat = intervalo_heartbeat
+        self.tempo_heartbeat = tempo_heartbeat
+        self._pool = None
+        self._lock = threading.Lock()
+        # Chave (ver `singleflight.chave_chamada`) -> id do job pendente ou em execução
+        self._ativos = {}
+        # Ids dos jobs pendentes ou em execução neste processo, cujo heartbeat é renovado
+        self._locais = set()
+        self._lock_ativos = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="job"
+                )
+            return self._pool
+
+    def submeter(
+        self,
+        tipo: str,
+        tarefa: Callable,
+        filiais: List[str] = None,
+        chave: Hashable = None,
+        **parametros,
+    ) -> schemas.Job:
+        """
+        Grava um job pendente e agenda a sua execução.
+
+        Parâmetros:
+        - tipo (str): Identifica a tarefa (ex.: "enviar_faturamento").
+        - tarefa (Callable): A função executada como `tarefa(**parametros)`.
+        - filiais (List[str], opcional): As filiais processadas pela tarefa. Se informadas, a tarefa recebe
+          também o argumento `progresso`, chamado com o `ResultadoFilial` de cada filial concluída.
+        - chave (Hashable, opcional): Identifica jobs equivalentes. Enquanto um job com a mesma chave estiver
+          pendente ou em execução, ele é retornado em vez de um novo ser criado.
+        - **parametros: Os argumentos da tarefa, gravados no job.
+
+        Retorna:
+        - schemas.Job: O job criado, ou o job equivalente já em andamento.
+        """
+        with self._lock_ativos:
+            if chave is not None and chave in self._ativos:
+                existente = self._ativos[chave]
+                logger.info("Job %s (%s) já em andamento; reaproveitado.", existente, tipo)
+                return self.obter(existente)
+            return self._criar(tipo, tarefa, filiais, chave, parametros)
+
+    def _criar(self, tipo, tarefa, filiais, chave, parametros) -> schemas.Job:
+        db = SessionLocal()
+        try:
+            job = models.Job(
+                id=uuid.uuid4().hex,
+                tipo=tipo,
+                status=PENDENTE,
+                parametros=json.dumps(jsonable_encoder(parametros)),
+                progresso=json.dumps(
+                    {filial: {"status": PENDENTE} for filial in filiais or []}
+                ),
+                criado_em=datetime.now(),
+                atualizado_em=datetime.now(),
+            )
+            db.add(job)
+            db.commit()
+            criado = _para_schema(job)
+        finally:
+            db.close()
+
+        if chave is not None:
+            self._ativos[chave] = criado.id
+        self._locais.add(criado.id)
+        self._executor().submit(
+            self._executar, criado.id, tarefa, filiais, chave, parametros
+        )
+        logger.info("Job %s (%s) criado.", criado.id, tipo)
+        return criado
+
+    def _atualizar(self, job_id: str, **campos):
+        db = SessionLocal()
+        try:
+            job = db.get(models.Job, job_id)
+            for campo, valor in campos.items():
+                setattr(job, campo, valor)
+            job.atualizado_em = datetime.now()
+            db.commit()
+        finally:
+            db.close()
+
+    def _registrar_progresso(self, job_id: str, resultado: schemas.ResultadoFilial):
+        # As filiais de um job terminam em threads diferentes; o lock evita que uma atualização sobrescreva a outra
+        with self._lock:
+            db = SessionLocal()
+            try:
+                job = db.get(models.Job, job_id)
+                progresso = json.loads(job.progresso or "{}")
+                progresso[resultado.filial] = {
+                    "status": (
+                        SEM_MOVIMENTO
+                        if resultado.sem_movimento
+                        else CONCLUIDO if resultado.sucesso else ERRO
+                    ),
+                    "duracao": resultado.duracao,
+                    "erro": resultado.erro,
+                }
+                job.progresso = json.dumps(progresso)
+                job.atualizado_em = datetime.now()
+                db.commit()
+            except Exception as e:
+                logger.error(f"Erro ao registrar o progresso do job {job_id}: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+    def _executar(
+        self,
+        job_id: str,
+        tarefa: Callable,
+        filiais: List[str],
+        chave: Hashable,
+        parametros: dict,
+    ):
+        self._atualizar(job_id, status=EXECUTANDO, iniciado_em=datetime.now())
+        if filiais:
+            parametros = dict(
+                parametros,
+                progresso=lambda resultado: self._registrar_progresso(job_id, resultado),
+            )
+        try:
+            resultado = tarefa(**parametros)
+            self._atualizar(
+                job_id,
+                status=CONCLUIDO,
+                resultado=json.dumps(jsonable_encoder(resultado)),
+                finalizado_em=datetime.now(),
+            )
+            logger.info("Job %s concluído.", job_id)
+        except Exception as e:
+            logger.error(f"Erro ao executar o job {job_id}: {e}")
+            print(f"Erro ao executar o job {job_id}: {e}")
+            self._atualizar(
+                job_id, status=ERRO, erro=str(e), finalizado_em=datetime.now()
+            )
+        finally:
+            with self._lock_ativos:
+                self._locais.discard(job_id)
+                if chave is not None:
+                    self._ativos.pop(chave, None)
+
+    def obter(self, job_id: str) -> schemas.Job:
+        """
+        Retorna o job, ou None se ele não existir.
+        """
+        db = SessionLocal()
+        try:
+            job = db.get(models.Job, job_id)
+            return _para_schema(job) if job else None
+        finally:
+            db.close()
+
+    def listar(self, limite: int = 50, tipo: str = None) -> List[schemas.Job]:
+        """
+        Retorna o histórico de jobs, do mais recente para o mais antigo, sem o resultado.
+        """
+        db = SessionLocal()
+        try:
+            consulta = db.query(models.Job)
+            if tipo:
+                consulta = consulta.filter(models.Job.tipo == tipo)
+            jobs = consulta.order_by(models.Job.criado_em.desc()).limit(limite).all()
+            return [
+                _para_schema(job).model_copy(update={"resultado": None}) for job in jobs
+            ]
+        finally:
+            db.close()
+
+    def marcar_interrompidos(self):
+        """
+        Marca como interrompidos os jobs pendentes ou em execução sem heartbeat há mais de `tempo_heartbeat`
+        segundos: o processo que os executava terminou, em qualquer host ou container. Os jobs anteriores ao
+        heartbeat usam a data de criação.
+        """
+        db = SessionLocal()
+        try:
+            agora = datetime.now()
+            quantidade = (
+                db.query(models.Job)
+                .filter(
+                    models.Job.status.in_([PENDENTE, EXECUTANDO])
+                    & (
+                        func.coalesce(models.Job.atualizado_em, models.Job.criado_em)
+                        < agora - timedelta(seconds=self.tempo_heartbeat)
+                    )
+                )
+                .update(
+                    {"status": INTERROMPIDO, "finalizado_em": agora},
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            if quantidade:
+                logger.warning("%s jobs marcados como interrompidos.", quantidade)
+        finally:
+            db.close()
+
+    def renovar_heartbeat(self):
+        """
+        Renova o heartbeat dos jobs pendentes ou em execução neste processo.
+        """
+        with self._lock_ativos:
+            locais = list(self._locais)
+        if not locais:
+            return
+        db = SessionLocal()
+        try:
+            db.query(models.Job).filter(models.Job.id.in_(locais)).update(
+                {"atualizado_em": datetime.now()}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo_heartbeat):
+            try:
+                self.renovar_heartbeat()
+                self.marcar_interrompidos()
+            except Exception as e:
+                logger.error(f"Erro ao renovar o heartbeat dos jobs: {e}")
+
+    def iniciar(self):
+        """
+        Inicia a thread que renova o heartbeat dos jobs deste processo e marca os jobs abandonados.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name="jobs-heartbeat", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+gerenciador_jobs = GerenciadorJobs()
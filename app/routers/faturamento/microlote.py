@@ -0,0 +1,166 @@
+import logging
+import threading
+from datetime import datetime
+from typing import List
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.log_config import setup_logger
+from app.configuracoes import agrupar_outros_flag, filiais, microlote_intervalo
+from .crud import aggregate_by_numero_nota, filtro_itens_faturamento
+from .executor import executar_por_filial
+from .models import ItemFaturamento, MarcaMicrolote
+from .utils import enviar_faturamento_para_api_externa
+
+"""
+Módulo de Microlotes
+
+Envia os movimientos ao longo do dia em lotes pequenos, em vez de concentrar o volume do dia no envio
+noturno. A cada `microlote_intervalo` segundos (ver `EnviadorMicrolotes`), para cada filial:
+
+1. Lê a marca d'água da filial (`scanntech_microlotes`): a (DATA_CRIADA, HORA_CRIADA) do item mais recente
+   já enviado. Sem marca, começa no início do dia atual.
+2. Busca as notas com algum item criado a partir da marca e agrega apenas essas notas, com todos os seus itens.
+3. Envia as notas pelo fluxo normal (`utils.enviar_faturamento_para_api_externa`, modo delta e outbox).
+4. Avança a marca depois que os lotes foram gravados no outbox, que garante o envio.
+
+O segundo da marca é sempre incluído de novo no microlote seguinte, para não perder itens sincronizados
+depois com o mesmo horário; o modo delta descarta as notas que não mudaram. No fim do dia, o envio noturno
+(também em modo delta) envia apenas as notas alteradas desde o microlote e o fechamento consolida o dia.
+"""
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def enviar_microlote(db: Session, filial: str = None) -> int:
+    """
+    Envia as notas da filial criadas desde a marca d'água e avança a marca.
+
+    Parâmetros:
+    - db (Session): Sessão do banco de dados.
+    - filial (str): A filial.
+
+    Retorna:
+    - int: O número de notas do microlote (antes do descarte do modo delta).
+    """
+    hoje = datetime.now().date()
+    marca = db.get(MarcaMicrolote, filial)
+    data_marca = marca.data if marca else hoje
+    hora_marca = marca.hora if marca else "000000"
+
+    filtro = filtro_itens_faturamento(data_marca, hoje, True, filial)
+    novos = (
+        db.query(
+            ItemFaturamento.NUMERO_NOTA,
+            ItemFaturamento.DATA_CRIADA,
+            ItemFaturamento.HORA_CRIADA,
+        )
+        .filter(
+            filtro
+            & (
+                (ItemFaturamento.DATA_CRIADA > data_marca)
+                | (ItemFaturamento.HORA_CRIADA >= hora_marca)
+            )
+        )
+        .all()
+    )
+    if not novos:
+        return 0
+
+    # As notas são agregadas com todos os seus itens, inclusive os criados antes da marca
+    numeros = {numero for numero, _, _ in novos}
+    itens = (
+        db.query(ItemFaturamento)
+        .filter(filtro & ItemFaturamento.NUMERO_NOTA.in_(numeros))
+        .order_by(ItemFaturamento.DATA_CRIADA.desc())
+        .all()
+    )
+    notas = aggregate_by_numero_nota(db, itens, agrupar_outros=agrupar_outros_flag)
+    enviadas = enviar_faturamento_para_api_externa(
+        db,
+        data_inicial=data_marca.strftime("%d/%m/%Y"),
+        data_final=hoje.strftime("%d/%m/%Y"),
+        filial=filial,
+        delta=True,
+        faturamentos=notas,
+    )
+    if enviadas is None:
+        raise RuntimeError(f"Erro ao gravar o microlote da filial {filial}; a marca não foi avançada")
+
+    data_nova, hora_nova = max((data, hora or "000000") for _, data, hora in novos)
+    valores = {
+        "data": data_nova,
+        "hora": hora_nova,
+        "quantidade": len(notas),
+        "atualizado_em": datetime.now(),
+    }
+    db.execute(
+        insert(MarcaMicrolote)
+        .values(filial=filial, **valores)
+        .on_conflict_do_update(index_elements=["filial"], set_=valores)
+    )
+    db.commit()
+    logger.info(
+        "Microlote da filial %s: %s notas; marca em %s %s.",
+        filial,
+        len(notas),
+        data_nova,
+        hora_nova,
+    )
+    return len(notas)
+
+
+class EnviadorMicrolotes:
+    """
+    Thread de fundo que envia um microlote de cada filial a cada `intervalo` segundos.
+    """
+
+    def __init__(self, intervalo: float = microlote_intervalo, filiais: List[str] = filiais):
+        self.intervalo = intervalo
+        self.filiais = filiais
+        self._parar = threading.Event()
+        self._acordar = threading.Event()
+        self._thread = None
+
+    def executar(self):
+        """
+        Envia um microlote de todas as filiais. Uma filial com o faturamento em envio em outro worker é pulada.
+        """
+        resultados = executar_por_filial(enviar_microlote, self.filiais, lock="faturamento")
+        for resultado in resultados:
+            if not resultado.sucesso:
+                logger.error(
+                    f"Erro no microlote da filial {resultado.filial}: {resultado.erro}"
+                )
+        return resultados
+
+    def acordar(self):
+        """
+        Antecipa o próximo microlote (ex.: após uma mudança nos itens, ver `app.mudancas`).
+        """
+        self._acordar.set()
+
+    def _loop(self):
+        while True:
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            if self._parar.is_set():
+                break
+            self.executar()
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name="microlote", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._acordar.set()
+
+
+enviador_microlotes = EnviadorMicrolotes()
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Date, Integer, String, DateTime, Float, Boolean
+from datetime import datetime
+from sqlalchemy import Column, Date, Integer, String, DateTime, Float, Boolean, Index
 from ...database import Base
 
 
@@ -171,3 +172,115 @@ class Envios(Base):
     data_envio = Column(Date)
     lista_notas = Column(String)
     devolucao_cancelamento = Column(Boolean, default=False)
+    # Campos do outbox (ver outbox.py)
+    status = Column(String, default="pendente", index=True)
+    tipo = Column(String)
+    filial = Column(String)
+    url = Column(String)
+    chave_idempotencia = Column(String, unique=True)
+    tentativas = Column(Integer, default=0)
+    proxima_tentativa = Column(DateTime)
+    ultimo_erro = Column(String)
+    criado_em = Column(DateTime, default=datetime.now)
+
+
+class NotaEnviada(Base):
+    __tablename__ = "scanntech_notas_enviadas"
+    __table_args__ = (
+        Index("ix_scanntech_notas_enviadas_filial_data", "filial", "data", "numero"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    envio_id = Column(Integer, index=True)
+    filial = Column(String)
+    data = Column(Date)
+    numero = Column(String)
+    hash = Column(String)
+
+
+class Job(Base):
+    __tablename__ = "scanntech_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    tipo = Column(String)
+    status = Column(String, index=True)
+    parametros = Column(String)  # JSON
+    progresso = Column(String)  # JSON, por filial
+    resultado = Column(String)  # JSON
+    erro = Column(String)
+    criado_em = Column(DateTime, default=datetime.now, index=True)
+    iniciado_em = Column(DateTime)
+    finalizado_em = Column(DateTime)
+    atualizado_em = Column(DateTime)  # heartbeat do processo que executa o job
+
+
+class TarefaFila(Base):
+    __tablename__ = "scanntech_fila_tarefas"
+    __table_args__ = (
+        Index("ix_scanntech_fila_tarefas_status", "status", "disponivel_em"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    tarefa = Column(String)
+    filial = Column(String)
+    data = Column(Date)
+    status = Column(String)
+    tentativas = Column(Integer, default=0)
+    disponivel_em = Column(DateTime, default=datetime.now)
+    reservado_por = Column(String)
+    iniciado_em = Column(DateTime)
+    finalizado_em = Column(DateTime)
+    duracao = Column(Float)
+    erro = Column(String)
+    criado_em = Column(DateTime, default=datetime.now)
+
+
+class ExecucaoAgendada(Base):
+    __tablename__ = "scanntech_agendamentos"
+    __table_args__ = (
+        Index("ix_scanntech_agendamentos_job", "job", "agendado_para"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    job = Column(String)
+    agendado_para = Column(DateTime)
+    iniciado_em = Column(DateTime)
+    finalizado_em = Column(DateTime)
+    duracao = Column(Float)
+    status = Column(String)
+    erro = Column(String)
+    recuperacao = Column(Boolean, default=False)
+
+
+class PayloadPreparado(Base):
+    __tablename__ = "scanntech_payloads_preparados"
+    __table_args__ = (
+        Index(
+            "ix_scanntech_payloads_preparados_filial_data",
+            "filial",
+            "data",
+            "agrupar_outros",
+            unique=True,
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    filial = Column(String)
+    data = Column(Date)
+    agrupar_outros = Column(Boolean)
+    impressao = Column(String)  # ver `crud.impressao_faturamento`
+    notas = Column(String)  # JSON: [numero, data, hash, conteúdo] de cada nota
+    quantidade = Column(Integer)
+    bytes = Column(Integer)
+    duracao = Column(Float)
+    preparado_em = Column(DateTime, default=datetime.now)
+
+
+class MarcaMicrolote(Base):
+    __tablename__ = "scanntech_microlotes"
+
+    filial = Column(String, primary_key=True)
+    data = Column(Date)  # DATA_CRIADA do item mais recente já enviado
+    hora = Column(String)  # HORA_CRIADA (HHMMSS) do item mais recente já enviado
+    quantidade = Column(Integer)  # notas do último microlote
+    atualizado_em = Column(DateTime, default=datetime.now)
@@ -0,0 +1,370 @@
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import List, Set, Tuple
+import requests
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.log_config import setup_logger
+from app.scanntech import cliente_scanntech, CircuitoAberto
+from app.configuracoes import (
+    lote_envios_concorrentes,
+    outbox_intervalo,
+    outbox_lote_drenagem,
+    outbox_max_tentativas,
+    outbox_backoff_base,
+    outbox_backoff_maximo,
+    outbox_tempo_reserva,
+    scanntech_tentativas,
+    scanntech_timeout_conexao,
+    scanntech_timeout_leitura,
+    scanntech_backoff_base,
+    scanntech_backoff_maximo,
+)
+from .models import Envios, NotaEnviada
+
+"""
+Módulo de Outbox
+
+A tabela `scanntech_envios` funciona como um outbox: o conteúdo serializado de cada envio é gravado com
+status `pendente` antes de qualquer chamada à API. O envio em si é feito logo em seguida por quem enfileirou
+(`processar`) e, em caso de falha, pelo drenador de fundo (`DrenadorOutbox`), que reenvia o mesmo conteúdo
+com backoff exponencial. Uma falha custa apenas um reenvio, nunca um novo cálculo.
+
+Status:
+- pendente: aguardando um novo envio após `proxima_tentativa`.
+- enviando: reservado por um processo (desde a gravação, para quem enfileirou); é reenviado pelo drenador se
+  a reserva expirar.
+- enviado: aceito pela API.
+- erro: recusado pela API (4xx) ou sem sucesso após `outbox_max_tentativas`.
+"""
+
+PENDENTE = "pendente"
+ENVIANDO = "enviando"
+ENVIADO = "enviado"
+ERRO = "erro"
+
+# Pior caso de um POST pelo cliente da ScannTech: todas as tentativas esgotando os timeouts, com o backoff
+# entre elas, mais uma margem para a espera do limite de taxa. A reserva cobre ao menos esse tempo e é
+# renovada antes de cada rodada de envios paralelos (ver `processar`), para não expirar no meio de um envio
+TEMPO_RESERVA = max(
+    outbox_tempo_reserva,
+    scanntech_tentativas * (scanntech_timeout_conexao + scanntech_timeout_leitura)
+    + sum(
+        min(scanntech_backoff_maximo, scanntech_backoff_base * 2**i)
+        for i in range(scanntech_tentativas - 1)
+    )
+    + 60,
+)
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def enfileirar(
+    db: Session,
+    tipo: str,
+    filial: str,
+    url: str,
+    conteudo,
+    lista_notas: List[str] = None,
+    devolucao_cancelamento: bool = None,
+) -> Envios:
+    """
+    Grava um envio no outbox, já reservado (`enviando`) para quem o enfileirou e vai enviá-lo em seguida com
+    `processar`. Se esse processo cair antes do envio, a reserva expira e o drenador o envia. O commit fica a
+    cargo de quem chama.
+
+    Parâmetros:
+    - db (Session): Sessão do banco de dados.
+    - tipo (str): O tipo do envio ("movimientos", "cierresDiarios", "cancelamentos" ou "devolucoes").
+    - filial (str): A filial do envio.
+    - url (str): A URL da API externa.
+    - conteudo (str | bytes): O corpo JSON já serializado.
+    - lista_notas (List[str], opcional): As notas incluídas no envio.
+    - devolucao_cancelamento (bool, opcional): Indica se o envio é um fechamento de devolução/cancelamento.
+
+    Retorna:
+    - Envios: O registro criado, com uma chave de idempotência própria.
+    """
+    # Gravado já reservado: entre o commit e o envio, nenhum drenador (deste ou de outro processo) pode
+    # reservá-lo e enviá-lo em paralelo
+    envio = Envios(
+        status=ENVIANDO,
+        tipo=tipo,
+        filial=filial,
+        url=url,
+        conteudo=conteudo.decode() if isinstance(conteudo, bytes) else conteudo,
+        lista_notas=lista_notas,
+        chave_idempotencia=uuid.uuid4().hex,
+        tentativas=1,
+        proxima_tentativa=datetime.now() + timedelta(seconds=TEMPO_RESERVA),
+        enviado=False,
+    )
+    if devolucao_cancelamento is not None:
+        envio.devolucao_cancelamento = devolucao_cancelamento
+    db.add(envio)
+    return envio
+
+
+def registrar_notas(
+    db: Session, envio: Envios, filial: str, notas: List[Tuple[str, date, str]]
+):
+    """
+    Registra as notas incluídas em um envio, com o hash do conteúdo de cada uma, para o modo delta.
+    O envio precisa ter sido gravado (flush) para que o seu id exista. O commit fica a cargo de quem chama.
+
+    Parâmetros:
+    - db (Session): Sessão do banco de dados.
+    - envio (Envios): O envio que contém as notas.
+    - filial (str): A filial das notas.
+    - notas (List[Tuple[str, date, str]]): Triplas (número, data da nota, hash do conteúdo).
+    """
+    db.add_all(
+        NotaEnviada(envio_id=envio.id, filial=filial, data=data, numero=numero, hash=hash)
+        for numero, data, hash in notas
+    )
+
+
+def get_notas_enviadas(
+    db: Session, filial: str, data_inicial: date, data_final: date
+) -> Set[Tuple[str, str]]:
+    """
+    Retorna as notas já enviadas (ou pendentes de envio no outbox) de uma filial em um período.
+
+    Parâmetros:
+    - db (Session): Sessão do banco de dados.
+    - filial (str): A filial.
+    - data_inicial (date): Data inicial das notas.
+    - data_final (date): Data final das notas.
+
+    Retorna:
+    - Set[Tuple[str, str]]: Pares (número da nota, hash do conteúdo). Envios com erro não são considerados,
+      para que as suas notas sejam enviadas novamente.
+    """
+    registros = (
+        db.query(NotaEnviada.numero, NotaEnviada.hash)
+        .join(Envios, Envios.id == NotaEnviada.envio_id)
+        .filter(
+            (NotaEnviada.filial == filial)
+            & NotaEnviada.data.between(data_inicial, data_final)
+            & Envios.status.in_([PENDENTE, ENVIANDO, ENVIADO])
+        )
+        .all()
+    )
+    return {(numero, hash) for numero, hash in registros}
+
+
+def postar(url: str, conteudo: str, chave_idempotencia: str):
+    """
+    Envia o conteúdo de um registro do outbox para a API externa.
+
+    Parâmetros:
+    - url (str): A URL da API externa.
+    - conteudo (str): O corpo JSON.
+    - chave_idempotencia (str): Enviada no cabeçalho `Idempotency-Key`, igual em todas as tentativas do mesmo registro.
+
+    Retorna:
+    - requests.Response | requests.exceptions.RequestException: A resposta bem-sucedida ou o erro ocorrido,
+      para que o erro de um envio não interrompa os demais envios em paralelo.
+    """
+    try:
+        resposta = cliente_scanntech.post(
+            url,
+            data=conteudo.encode(),
+            headers={"Idempotency-Key": chave_idempotencia},
+        )
+        resposta.raise_for_status()
+        return resposta
+    except requests.exceptions.RequestException as err:
+        return err
+
+
+def _espera(tentativas: int) -> timedelta:
+    return timedelta(
+        seconds=min(outbox_backoff_maximo, outbox_backoff_base * 2 ** (tentativas - 1))
+    )
+
+
+def _aplicar_resultado(envio: Envios, resposta):
+    agora = datetime.now()
+    if isinstance(resposta, requests.Response):
+        try:
+            envio.id_lote = resposta.json().get("idLote")
+        except ValueError:
+            envio.id_lote = None
+        envio.status = ENVIADO
+        envio.enviado = True
+        envio.data_envio = agora
+        envio.ultimo_erro = None
+        logger.info(
+            "Envio %s (%s, filial %s) aceito. Status code: %s. %s",
+            envio.id,
+            envio.tipo,
+            envio.filial,
+            resposta.status_code,
+            resposta.text,
+        )
+        return
+
+    if isinstance(resposta, CircuitoAberto):
+        # A chamada não chegou a ser feita: não conta como tentativa
+        envio.tentativas -= 1
+        envio.status = PENDENTE
+        envio.ultimo_erro = str(resposta)
+        envio.proxima_tentativa = agora + _espera(max(1, envio.tentativas))
+        logger.warning("Envio %s adiado: %s", envio.id, resposta)
+        return
+
+    recusado = False
+    if isinstance(resposta, requests.exceptions.HTTPError):
+        status_code = resposta.response.status_code
+        envio.ultimo_erro = f"{status_code}: {resposta.response.text}"
+        # 4xx (exceto 408 e 429) não se resolve reenviando o mesmo conteúdo
+        recusado = 400 <= status_code < 500 and status_code not in (408, 429)
+    else:
+        envio.ultimo_erro = str(resposta)
+
+    if recusado or envio.tentativas >= outbox_max_tentativas:
+        envio.status = ERRO
+        envio.proxima_tentativa = None
+    else:
+        envio.status = PENDENTE
+        envio.proxima_tentativa = agora + _espera(envio.tentativas)
+    logger.error(
+        "Falha no envio %s (%s, filial %s), tentativa %s: %s. Status: %s",
+        envio.id,
+        envio.tipo,
+        envio.filial,
+        envio.tentativas,
+        envio.ultimo_erro,
+        envio.status,
+    )
+    print(f"Falha no envio {envio.id} ({envio.tipo}, filial {envio.filial}): {envio.ultimo_erro}")
+
+
+def _reservar(db: Session, envios: List[Envios]):
+    reserva = datetime.now() + timedelta(seconds=TEMPO_RESERVA)
+    for envio in envios:
+        envio.status = ENVIANDO
+        envio.tentativas = (envio.tentativas or 0) + 1
+        envio.proxima_tentativa = reserva
+    db.commit()
+
+
+def processar(db: Session, envios: List[Envios]) -> List[Envios]:
+    """
+    Envia imediatamente os registros informados, em rodadas de até `lote_envios_concorrentes` envios
+    paralelos, e grava o resultado de cada rodada. Antes de cada rodada, a reserva dos registros restantes é
+    renovada, de forma que ela não expira enquanto eles esperam a sua vez.
+
+    Parâmetros:
+    - db (Session): A sessão na qual os registros foram criados ou reservados.
+    - envios (List[Envios]): Os registros a enviar.
+
+    Retorna:
+    - List[Envios]: Os mesmos registros, atualizados. Os que falharam ficam pendentes para o drenador.
+    """
+    if not envios:
+        return envios
+    if any(envio.status != ENVIANDO for envio in envios):
+        _reservar(db, [envio for envio in envios if envio.status != ENVIANDO])
+
+    with ThreadPoolExecutor(
+        max_workers=min(lote_envios_concorrentes, len(envios)),
+        thread_name_prefix="outbox",
+    ) as pool:
+        for inicio in range(0, len(envios), lote_envios_concorrentes):
+            if inicio:
+                reserva = datetime.now() + timedelta(seconds=TEMPO_RESERVA)
+                for envio in envios[inicio:]:
+                    envio.proxima_tentativa = reserva
+                db.commit()
+            rodada = envios[inicio : inicio + lote_envios_concorrentes]
+            # Os atributos são lidos aqui, na thread da sessão; as threads do pool fazem apenas o HTTP
+            requisicoes = [
+                (envio.url, envio.conteudo, envio.chave_idempotencia) for envio in rodada
+            ]
+            respostas = list(pool.map(lambda requisicao: postar(*requisicao), requisicoes))
+            for envio, resposta in zip(rodada, respostas):
+                _aplicar_resultado(envio, resposta)
+            db.commit()
+    return envios
+
+
+def reservar_pendentes(db: Session, limite: int = outbox_lote_drenagem) -> List[Envios]:
+    """
+    Reserva os envios prontos para (re)envio, incluindo os que ficaram "enviando" com a reserva expirada.
+    Usa `FOR UPDATE SKIP LOCKED`, de forma que vários processos podem drenar o outbox ao mesmo tempo.
+    """
+    agora = datetime.now()
+    envios = (
+        db.query(Envios)
+        .filter(
+            Envios.status.in_([PENDENTE, ENVIANDO])
+            & (Envios.proxima_tentativa <= agora)
+            & Envios.url.isnot(None)
+        )
+        .order_by(Envios.proxima_tentativa)
+        .limit(limite)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    _reservar(db, envios)
+    return envios
+
+
+def drenar() -> int:
+    """
+    Executa uma drenagem do outbox.
+
+    Retorna:
+    - int: O número de envios processados.
+    """
+    db = SessionLocal()
+    try:
+        envios = reservar_pendentes(db)
+        processar(db, envios)
+        return len(envios)
+    except Exception as e:
+        logger.error(f"Erro ao drenar o outbox: {e}")
+        db.rollback()
+        return 0
+    finally:
+        db.close()
+
+
+class DrenadorOutbox:
+    """
+    Thread de fundo que drena o outbox a cada `intervalo` segundos.
+    """
+
+    def __init__(self, intervalo: float = outbox_intervalo):
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _loop(self):
+        while not self._parar.is_set():
+            # Enquanto houver envios prontos, continua drenando sem esperar o intervalo
+            while drenar() and not self._parar.is_set():
+                pass
+            self._parar.wait(self.intervalo)
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name="outbox", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+
+
+drenador_outbox = DrenadorOutbox()
@@ -0,0 +1,193 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List
+from sqlalchemy.orm import Session
+from app.log_config import setup_logger
+from app.locks import dias_periodo, lock_tarefa
+from app.configuracoes import agrupar_outros_flag, envio_delta, preparacao_ativa
+from .crud import get_faturamento_com_canceladas
+from .preparacao import notas_preparadas
+from .schemas import ResultadoEtapa
+from .utils import (
+    enviar_faturamento_para_api_externa,
+    enviar_fechamento_diario,
+    verificar_cancelamentos_enviar,
+    verificar_devolucoes,
+)
+
+"""
+Módulo do Pipeline Noturno
+
+Executa as etapas noturnas de uma filial a partir de um único cálculo por dia. Separadas, as tarefas de
+faturamento, fechamento e cancelamentos consultam e agregam as mesmas notas três vezes; aqui, para cada
+(filial, dia), os itens são consultados uma vez e agregados uma vez (`crud.get_faturamento_com_canceladas`):
+
+- faturamento: envia as notas sem os itens cancelados.
+- fechamento: calcula os totais a partir das mesmas notas (`crud.calcular_fechamento`).
+- cancelamentos: usa todas as notas, incluindo as canceladas. A verificação considera sempre a data atual
+  (e o dia anterior no dia 1), por isso roda uma única vez por execução, depois dos dias, independente do
+  período; o cálculo compartilhado só é aproveitado quando o período inclui hoje.
+- devolucoes: também considera sempre a data atual e roda uma única vez por execução; lê os itens de
+  devolução, que não fazem parte das notas de venda, com a sua própria consulta.
+
+Com `preparacao_ativa`, as notas já preparadas ao longo do dia (ver `preparacao`) substituem o cálculo
+quando os cancelamentos não fazem parte da execução.
+
+Cada etapa obtém o mesmo lock da tarefa avulsa equivalente (ver `app.locks`), no dia processado ou, para os
+cancelamentos e as devoluções, na data atual, de forma que o pipeline e as tarefas disparadas pela API, pela
+fila ou pelo agendador não enviam o mesmo dia da mesma filial ao mesmo tempo. Um erro em
+uma etapa é registrado no seu resultado e não interrompe as seguintes; um erro no cálculo de um dia é
+registrado nas etapas desse dia.
+"""
+
+ETAPAS = ["faturamento", "fechamento", "cancelamentos", "devolucoes"]
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def _executar_etapa(
+    etapa: str, filial: str, dia, funcao: Callable[[], int]
+) -> ResultadoEtapa:
+    data = dia.strftime("%d/%m/%Y")
+    inicio = time.perf_counter()
+    resultado = ResultadoEtapa(fecha=data, etapa=etapa, sucesso=True)
+    try:
+        with lock_tarefa(etapa, filial, [dia]):
+            resultado.quantidade = funcao()
+    except Exception as e:
+        logger.error(f"Erro na etapa {etapa} da filial {filial} em {data}: {e}")
+        print(f"Erro na etapa {etapa} da filial {filial} em {data}: {e}")
+        resultado.sucesso = False
+        resultado.erro = str(e)
+    resultado.duracao = round(time.perf_counter() - inicio, 3)
+    return resultado
+
+
+def _executar(db: Session, etapa: str, filial: str, dia, funcao: Callable[[], int]) -> ResultadoEtapa:
+    resultado = _executar_etapa(etapa, filial, dia, funcao)
+    if not resultado.sucesso:
+        db.rollback()
+    return resultado
+
+
+def executar_pipeline(
+    db: Session,
+    filial: str = None,
+    data_inicial: str = None,
+    data_final: str = None,
+    etapas: List[str] = ETAPAS,
+    delta: bool = envio_delta,
+) -> List[ResultadoEtapa]:
+    """
+    Executa as etapas noturnas de uma filial, dia a dia, com um único cálculo das notas por dia.
+
+    Parâmetros:
+    - db (Session): Sessão do banco de dados.
+    - filial (str): A filial.
+    - data_inicial (str, opcional): Data inicial no formato dd/mm/aaaa. Padrão: data atual.
+    - data_final (str, opcional): Data final no formato dd/mm/aaaa. Padrão: data atual.
+    - etapas (List[str]): As etapas executadas, na ordem de `ETAPAS`.
+    - delta (bool): Modo delta do envio do faturamento.
+
+    Retorna:
+    - List[ResultadoEtapa]: Um resultado por dia para o faturamento e o fechamento, e um único resultado
+      (na data atual) para os cancelamentos e as devoluções.
+    """
+    desconhecidas = set(etapas) - set(ETAPAS)
+    if desconhecidas:
+        raise ValueError(f"Etapas desconhecidas: {', '.join(sorted(desconhecidas))}")
+    hoje = datetime.now().date()
+    inicio_cancelamentos = hoje - timedelta(days=1) if hoje.day == 1 else hoje
+
+    resultados = []
+    todas_hoje = None
+    for dia in dias_periodo(data_inicial, data_final):
+        data = dia.strftime("%d/%m/%Y")
+        compartilhar_cancelamentos = "cancelamentos" in etapas and dia == hoje
+        inicio = inicio_cancelamentos if compartilhar_cancelamentos else dia
+        todas, validas, serializadas = [], [], None
+        inicio_calculo = time.perf_counter()
+        try:
+            preparadas = None
+            if preparacao_ativa and not compartilhar_cancelamentos:
+                # Sem os cancelamentos, as notas preparadas ao longo do dia bastam, se ainda estiverem atualizadas
+                preparadas = notas_preparadas(db, filial, data, data, agrupar_outros_flag)
+            if preparadas is not None:
+                validas, serializadas = preparadas
+            elif {"faturamento", "fechamento"} & set(etapas) or compartilhar_cancelamentos:
+                todas, validas = get_faturamento_com_canceladas(
+                    db,
+                    inicio.strftime("%d/%m/%Y"),
+                    data,
+                    agrupar_outros=agrupar_outros_flag,
+                    filial=filial,
+                )
+                if compartilhar_cancelamentos:
+                    todas_hoje = todas
+        except Exception as e:
+            # Sem o cálculo do dia, as etapas do dia falham; os cancelamentos fazem a sua própria consulta
+            logger.error(f"Erro ao calcular as notas da filial {filial} em {data}: {e}")
+            print(f"Erro ao calcular as notas da filial {filial} em {data}: {e}")
+            db.rollback()
+            duracao = round(time.perf_counter() - inicio_calculo, 3)
+            resultados.extend(
+                ResultadoEtapa(fecha=data, etapa=etapa, sucesso=False, erro=str(e), duracao=duracao)
+                for etapa in ("faturamento", "fechamento")
+                if etapa in etapas
+            )
+            continue
+        # O período compartilhado com os cancelamentos pode incluir o dia anterior
+        notas_dia = [nota for nota in validas if nota.fecha[:10] == dia.isoformat()]
+
+        def faturamento() -> int:
+            enviadas = enviar_faturamento_para_api_externa(
+                db,
+                data_inicial=data,
+                data_final=data,
+                filial=filial,
+                delta=delta,
+                faturamentos=notas_dia,
+                notas=serializadas,
+            )
+            if enviadas is None:
+                raise RuntimeError("Erro ao salvar o envio do faturamento")
+            return len(enviadas)
+
+        def fechamento() -> int:
+            return enviar_fechamento_diario(
+                db, data_inicial=data, data_final=data, filial=filial, faturamentos=notas_dia
+            ).cantidadMovimientos
+
+        for etapa, funcao in (("faturamento", faturamento), ("fechamento", fechamento)):
+            if etapa in etapas:
+                resultados.append(_executar(db, etapa, filial, dia, funcao))
+
+    # Cancelamentos e devoluções enviam sempre o fechamento da data atual: uma única vez, fora dos dias
+    def cancelamentos() -> int:
+        enviado = verificar_cancelamentos_enviar(db, filial=filial, notas_enviadas=todas_hoje)
+        if enviado is None:
+            raise RuntimeError("Erro ao salvar o envio dos cancelamentos")
+        return enviado.cantidadCancelaciones
+
+    def devolucoes() -> int:
+        enviado = verificar_devolucoes(db, filial=filial)
+        if enviado is None:
+            raise RuntimeError("Erro ao salvar o envio das devoluções")
+        return enviado.cantidadMovimientos
+
+    for etapa, funcao in (("cancelamentos", cancelamentos), ("devolucoes", devolucoes)):
+        if etapa in etapas:
+            resultados.append(_executar(db, etapa, filial, hoje, funcao))
+
+    logger.info(
+        "Pipeline da filial %s: %s de %s etapas concluídas.",
+        filial,
+        sum(r.sucesso for r in resultados),
+        len(resultados),
+    )
+    return resultados
@@ -0,0 +1,107 @@
+import logging
+from typing import Callable, List, Tuple
+from app.database import SessionLocal
+from app.log_config import setup_logger
+from app.eventos import publicar
+from app.locks import dias_periodo
+from app.configuracoes import planejamento_ativo
+from .crud import contar_notas_por_filial
+from .executor import executar_por_filial
+from .schemas import ResultadoFilial
+
+"""
+Módulo do Planejador
+
+Antes de disparar o envio do faturamento ou do fechamento, conta as notas de cada filial e dia do período
+com uma única consulta agrupada (`crud.contar_notas_por_filial`) e executa a tarefa apenas para as filiais
+com movimento. Sem notas, a tarefa consultaria, agregaria e exportaria o período só para descobrir que não
+há nada a enviar; as filiais puladas recebem um resultado com `sem_movimento` e são informadas no log.
+
+Se a contagem falhar, todas as filiais são executadas, como sem o planejamento.
+"""
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def planejar(
+    filiais: List[str], data_inicial: str = None, data_final: str = None
+) -> Tuple[List[str], List[str]]:
+    """
+    Separa as filiais com e sem notas no período.
+
+    Parâmetros:
+    - filiais (List[str]): As filiais.
+    - data_inicial (str, opcional): Data inicial no formato dd/mm/aaaa. Padrão: data atual.
+    - data_final (str, opcional): Data final no formato dd/mm/aaaa. Padrão: data atual.
+
+    Retorna:
+    - Tuple[List[str], List[str]]: As filiais com movimento e as filiais sem movimento, na ordem de `filiais`.
+    """
+    dias = dias_periodo(data_inicial, data_final)
+    db = SessionLocal()
+    try:
+        contagem = contar_notas_por_filial(db, dias[0], dias[-1], filiais)
+    finally:
+        db.close()
+    com_movimento = {filial for filial, _ in contagem}
+    return (
+        [filial for filial in filiais if filial in com_movimento],
+        [filial for filial in filiais if filial not in com_movimento],
+    )
+
+
+def executar_planejado(
+    tarefa: Callable,
+    filiais: List[str],
+    progresso: Callable[[ResultadoFilial], None] = None,
+    **kwargs,
+) -> List[ResultadoFilial]:
+    """
+    Executa a tarefa com `executar_por_filial` apenas para as filiais com notas no período.
+
+    Parâmetros:
+    - tarefa (Callable): A tarefa, como em `executar_por_filial`.
+    - filiais (List[str]): As filiais.
+    - progresso (Callable, opcional): Chamada com o resultado de cada filial, incluindo as puladas.
+    - **kwargs: Repassados para `executar_por_filial` (ex.: data_inicial, data_final, lock).
+
+    Retorna:
+    - List[ResultadoFilial]: Um resultado por filial, na mesma ordem de `filiais`.
+    """
+    if not planejamento_ativo:
+        return executar_por_filial(tarefa, filiais, progresso=progresso, **kwargs)
+    try:
+        com_movimento, sem_movimento = planejar(
+            filiais, kwargs.get("data_inicial"), kwargs.get("data_final")
+        )
+    except Exception as e:
+        logger.error(f"Erro ao planejar {tarefa.__name__}; executando todas as filiais: {e}")
+        return executar_por_filial(tarefa, filiais, progresso=progresso, **kwargs)
+
+    puladas = {}
+    for filial in sem_movimento:
+        puladas[filial] = ResultadoFilial(filial=filial, sucesso=True, sem_movimento=True)
+        publicar("pulado", tarefa=tarefa.__name__, filial=filial)
+        if progresso:
+            try:
+                progresso(puladas[filial])
+            except Exception as e:
+                logger.error(f"Erro ao registrar o progresso da filial {filial}: {e}")
+    if sem_movimento:
+        logger.info(
+            "%s: filiais sem movimento no período, puladas: %s",
+            tarefa.__name__,
+            ", ".join(sem_movimento),
+        )
+
+    executadas = {
+        resultado.filial: resultado
+        for resultado in executar_por_filial(
+            tarefa, com_movimento, progresso=progresso, **kwargs
+        )
+    }
+    return [executadas.get(filial) or puladas[filial] for filial in filiais]
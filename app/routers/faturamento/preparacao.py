@@ -0,0 +1,236 @@
+import hashlib
+import logging
+import threading
+import time
+from datetime import date, datetime
+from typing import List, Tuple
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.log_config import setup_logger
+from app.serializacao import de_json, para_json
+from app.configuracoes import agrupar_outros_flag, filiais, preparacao_intervalo
+from .crud import get_faturamento_per_date, impressao_faturamento
+from .executor import executar_por_filial
+from .models import PayloadPreparado
+from .schemas import ModelScannTech
+
+"""
+Módulo de Preparação dos Movimientos
+
+Calcula e serializa os movimientos de cada filial ao longo do dia, de forma que o envio noturno não
+concentra a consulta, a agregação e a serialização no horário de maior carga da sincronização.
+
+- `preparar`: a cada `preparacao_intervalo` (ver `PreparadorPayloads`), compara a impressão dos itens do
+  dia (`crud.impressao_faturamento`, uma única consulta agregada) com a da última preparação e, se mudou,
+  recalcula as notas e grava o conteúdo serializado e o hash de cada uma em `scanntech_payloads_preparados`.
+- `notas_preparadas`: no envio (`utils.enviar_faturamento_para_api_externa`), revalida a impressão e, se ela
+  não mudou, devolve as notas já serializadas; o envio usa esses bytes diretamente. Se mudou, ou se não há
+  preparação, o envio calcula as notas como antes.
+
+A impressão cobre inclusões, cancelamentos e alterações de valor dos itens; alterações em campos que não
+entram na impressão (ex.: cadastro do cliente) só são refletidas na próxima mudança dos itens.
+"""
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def serializar_notas(
+    faturamentos: List[ModelScannTech],
+) -> List[Tuple[str, date, str, bytes]]:
+    """
+    Serializa cada nota uma única vez e calcula o hash (sha256) do seu conteúdo.
+
+    Retorna:
+    - List[Tuple[str, date, str, bytes]]: (número, data, hash, conteúdo) de cada nota.
+    """
+    notas = []
+    for f in faturamentos:
+        conteudo = para_json(f)
+        data_nota = datetime.strptime(f.fecha[:10], "%Y-%m-%d").date()
+        notas.append((f.numero, data_nota, hashlib.sha256(conteudo).hexdigest(), conteudo))
+    return notas
+
+
+def _buscar(db: Session, filial: str, dia: date, agrupar_outros: bool) -> PayloadPreparado:
+    return (
+        db.query(PayloadPreparado)
+        .filter(
+            (PayloadPreparado.filial == filial)
+            & (PayloadPreparado.data == dia)
+            & (PayloadPreparado.agrupar_outros == agrupar_outros)
+        )
+        .first()
+    )
+
+
+def preparar(
+    db: Session,
+    filial: str = None,
+    data: str = None,
+    agrupar_outros: bool = agrupar_outros_flag,
+) -> bool:
+    """
+    Prepara os movimientos de uma filial em um dia, se os itens mudaram desde a última preparação.
+
+    Parâmetros:
+    - db (Session): Sessão do banco de dados.
+    - filial (str): A filial.
+    - data (str, opcional): O dia no formato dd/mm/aaaa. Padrão: data atual.
+    - agrupar_outros (bool): Flag para anonimizar os produtos que não são bridgestone.
+
+    Retorna:
+    - bool: Verdadeiro se as notas foram recalculadas; falso se a preparação já estava atualizada.
+    """
+    dia = datetime.strptime(data, "%d/%m/%Y").date() if data else datetime.now().date()
+    inicio = time.perf_counter()
+    # A impressão é lida antes das notas: se os itens mudarem no meio do cálculo, a preparação fica
+    # com uma impressão antiga e é refeita, nunca o contrário
+    impressao = impressao_faturamento(db, dia, dia, filial)
+    preparado = _buscar(db, filial, dia, agrupar_outros)
+    if preparado is not None and preparado.impressao == impressao:
+        return False
+
+    data = dia.strftime("%d/%m/%Y")
+    faturamentos = get_faturamento_per_date(
+        db, data, data, agrupar_outros=agrupar_outros, filial=filial
+    )
+    if faturamentos is None:
+        raise RuntimeError(f"Erro ao calcular o faturamento da filial {filial} em {data}")
+    notas = serializar_notas(faturamentos)
+    conteudo = para_json(
+        [[numero, data_nota.isoformat(), hash, nota.decode()] for numero, data_nota, hash, nota in notas]
+    ).decode()
+    valores = {
+        "impressao": impressao,
+        "notas": conteudo,
+        "quantidade": len(notas),
+        "bytes": sum(len(nota[3]) for nota in notas),
+        "duracao": round(time.perf_counter() - inicio, 3),
+        "preparado_em": datetime.now(),
+    }
+    db.execute(
+        insert(PayloadPreparado)
+        .values(filial=filial, data=dia, agrupar_outros=agrupar_outros, **valores)
+        .on_conflict_do_update(
+            index_elements=["filial", "data", "agrupar_outros"], set_=valores
+        )
+    )
+    db.commit()
+    logger.info(
+        "Movimientos da filial %s em %s preparados: %s notas em %ss.",
+        filial,
+        data,
+        len(notas),
+        valores["duracao"],
+    )
+    return True
+
+
+def notas_preparadas(
+    db: Session,
+    filial: str,
+    data_inicial: str,
+    data_final: str,
+    agrupar_outros: bool = agrupar_outros_flag,
+) -> Tuple[List[ModelScannTech], List[Tuple[str, date, str, bytes]]]:
+    """
+    Retorna os movimientos preparados de uma filial em um dia, se ainda estiverem atualizados.
+
+    Parâmetros:
+    - db (Session): Sessão do banco de dados.
+    - filial (str): A filial.
+    - data_inicial (str): Data inicial no formato dd/mm/aaaa.
+    - data_final (str): Data final no formato dd/mm/aaaa. Apenas períodos de um dia são preparados.
+    - agrupar_outros (bool): Flag para anonimizar os produtos que não são bridgestone.
+
+    Retorna:
+    - Tuple[List[ModelScannTech], List[Tuple[str, date, str, bytes]]]: As notas e o (número, data, hash,
+      conteúdo) de cada uma, ou None se não houver preparação atualizada.
+    """
+    if not filial or data_inicial != data_final:
+        return None
+    dia = datetime.strptime(data_inicial, "%d/%m/%Y").date()
+    preparado = _buscar(db, filial, dia, agrupar_outros)
+    if preparado is None:
+        return None
+    if preparado.impressao != impressao_faturamento(db, dia, dia, filial):
+        logger.info("Preparação da filial %s em %s desatualizada; recalculando.", filial, data_inicial)
+        return None
+    notas = [
+        (numero, date.fromisoformat(data_nota), hash, conteudo.encode())
+        for numero, data_nota, hash, conteudo in de_json(preparado.notas)
+    ]
+    # Valida todas as notas em uma única leitura do JSON
+    faturamentos = de_json(b"[" + b",".join(nota[3] for nota in notas) + b"]", List[ModelScannTech])
+    logger.info(
+        "Usando os movimientos preparados da filial %s em %s (%s notas).",
+        filial,
+        data_inicial,
+        len(notas),
+    )
+    return faturamentos, notas
+
+
+class PreparadorPayloads:
+    """
+    Thread de fundo que prepara os movimientos do dia de todas as filiais a cada `intervalo` segundos, ou
+    antes, das filiais alteradas, quando acordada por uma mudança (ver `app.mudancas`).
+    """
+
+    def __init__(self, intervalo: float = preparacao_intervalo, filiais: List[str] = filiais):
+        self.intervalo = intervalo
+        self.filiais = filiais
+        self._parar = threading.Event()
+        self._acordar = threading.Event()
+        self._lock = threading.Lock()
+        self._pendentes = set()
+        self._thread = None
+
+    def executar(self, filiais: List[str] = None):
+        """
+        Executa uma preparação das filiais informadas, ou de todas.
+        """
+        resultados = executar_por_filial(
+            preparar, filiais or self.filiais, lock="preparacao"
+        )
+        for resultado in resultados:
+            if not resultado.sucesso:
+                logger.error(
+                    f"Erro ao preparar os movimientos da filial {resultado.filial}: {resultado.erro}"
+                )
+        return resultados
+
+    def acordar(self, filiais: List[str] = None):
+        """
+        Antecipa a próxima preparação, apenas das filiais informadas (ou de todas).
+        """
+        with self._lock:
+            self._pendentes.update(filiais or self.filiais)
+        self._acordar.set()
+
+    def _loop(self):
+        while not self._parar.is_set():
+            with self._lock:
+                pendentes, self._pendentes = self._pendentes, set()
+            # Acordada por uma mudança, prepara apenas as filiais alteradas; no intervalo, todas
+            self.executar([f for f in self.filiais if f in pendentes] or None)
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name="preparacao", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._acordar.set()
+
+
+preparador_payloads = PreparadorPayloads()
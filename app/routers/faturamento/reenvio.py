@@ -0,0 +1,187 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from app.database import SessionLocal
+from app.log_config import setup_logger
+from app.locks import dias_periodo, lock_tarefa
+from app.cache_respostas import cache_respostas
+from app.configuracoes import filiais, reenvio_concorrentes
+from .schemas import ResultadoReenvio, Solicitacoes
+from .utils import (
+    enviar_faturamento_para_api_externa,
+    enviar_fechamento_diario,
+    get_solicitacoes_reenvio,
+)
+
+"""
+Módulo de Reenvio
+
+Processa automaticamente as solicitações de reenvio (`solicitudes`) da ScannTech:
+
+1. Busca as solicitações de todas as filiais e tipos em paralelo (`buscar_solicitacoes`).
+2. Agrupa as solicitações por (filial, fecha, tipo), de forma que pedidos repetidos geram um único reenvio
+   (`agrupar_solicitacoes`).
+3. Recalcula e reenvia apenas os dias solicitados, com paralelismo limitado por `reenvio_concorrentes`
+   (`processar_reenvios`). Os movimientos são reenviados completos (sem o modo delta), já que a ScannTech
+   pediu o dia inteiro; os envios passam pelo outbox e ficam registrados em `scanntech_envios`.
+"""
+
+TIPOS_REENVIO = ["movimientos", "cierresDiarios"]
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def buscar_solicitacoes(
+    filiais: List[str] = filiais,
+    tipos: List[str] = TIPOS_REENVIO,
+    max_workers: int = reenvio_concorrentes,
+) -> List[Tuple[str, str, Solicitacoes]]:
+    """
+    Busca em paralelo as solicitações de reenvio de cada filial e tipo.
+
+    Parâmetros:
+    - filiais (List[str]): As filiais consultadas.
+    - tipos (List[str]): Os tipos de solicitação ("movimientos" e/ou "cierresDiarios").
+    - max_workers (int): Número máximo de consultas simultâneas.
+
+    Retorna:
+    - List[Tuple[str, str, Solicitacoes]]: Triplas (filial, tipo, solicitação). Uma consulta com erro
+      retorna uma lista vazia (ver `get_solicitacoes_reenvio`) e não interrompe as demais.
+    """
+    consultas = [(filial, tipo) for filial in filiais for tipo in tipos]
+    if not consultas:
+        return []
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(consultas))),
+        thread_name_prefix="solicitudes",
+    ) as pool:
+        respostas = pool.map(
+            lambda consulta: get_solicitacoes_reenvio(filial=consulta[0], tipo=consulta[1]),
+            consultas,
+        )
+        return [
+            (filial, tipo, solicitacao)
+            for (filial, tipo), solicitacoes in zip(consultas, respostas)
+            for solicitacao in solicitacoes
+        ]
+
+
+def agrupar_solicitacoes(
+    solicitacoes: List[Tuple[str, str, Solicitacoes]],
+) -> Dict[Tuple[str, str, str], int]:
+    """
+    Agrupa as solicitações por (filial, fecha, tipo).
+
+    Retorna:
+    - Dict[Tuple[str, str, str], int]: Para cada (filial, data no formato dd/mm/aaaa, tipo), o número de
+      solicitações agrupadas. A ordem é cronológica dentro de cada filial.
+    """
+    agrupadas = {}
+    for filial, tipo, solicitacao in sorted(
+        solicitacoes, key=lambda item: (item[0], item[2].fecha, item[1])
+    ):
+        chave = (filial, solicitacao.fecha.strftime("%d/%m/%Y"), tipo)
+        agrupadas[chave] = agrupadas.get(chave, 0) + 1
+    return agrupadas
+
+
+def reenviar(filial: str, data: str, tipo: str) -> int:
+    """
+    Recalcula e reenvia os movimientos ou o fechamento de uma filial em um dia, com a sua própria sessão.
+
+    Retorna:
+    - int: O número de notas reenviadas (movimientos) ou de movimentos do fechamento (cierresDiarios).
+
+    Exceções:
+    - LockOcupado: Se o mesmo dia da filial já estiver sendo enviado em outro worker.
+    """
+    # Usa os mesmos locks das tarefas noturnas, para não reenviar um dia que está sendo enviado
+    tarefa = {"movimientos": "faturamento", "cierresDiarios": "fechamento"}.get(tipo)
+    if tarefa is None:
+        raise ValueError(f"Tipo de reenvio desconhecido: {tipo}")
+    with lock_tarefa(tarefa, filial, dias_periodo(data, data)):
+        return _reenviar(filial, data, tipo)
+
+
+def _reenviar(filial: str, data: str, tipo: str) -> int:
+    db = SessionLocal()
+    try:
+        if tipo == "movimientos":
+            faturamentos = enviar_faturamento_para_api_externa(
+                db, data_inicial=data, data_final=data, filial=filial, delta=False
+            )
+            if faturamentos is None:
+                raise RuntimeError("Erro ao salvar o envio do faturamento")
+            return len(faturamentos)
+        fechamento = enviar_fechamento_diario(
+            db, data_inicial=data, data_final=data, filial=filial
+        )
+        return fechamento.cantidadMovimientos
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def processar_reenvios(
+    centro: str = None, max_workers: int = reenvio_concorrentes
+) -> List[ResultadoReenvio]:
+    """
+    Busca, agrupa e processa todas as solicitações de reenvio pendentes.
+
+    Parâmetros:
+    - centro (str, opcional): Processa apenas esta filial. Se não for fornecido, processa todas as filiais.
+    - max_workers (int): Número máximo de reenvios simultâneos.
+
+    Retorna:
+    - List[ResultadoReenvio]: Um resultado por (filial, fecha, tipo) reenviado. Um erro em um reenvio é
+      registrado no seu resultado e não interrompe os demais.
+    """
+    agrupadas = agrupar_solicitacoes(
+        buscar_solicitacoes(filiais if not centro else [centro], max_workers=max_workers)
+    )
+    if not agrupadas:
+        logger.info("Não há solicitações de reenvio pendentes.")
+        print("Não há solicitações de reenvio pendentes.")
+        return []
+    logger.info(
+        "Processando %s reenvios (%s solicitações).",
+        len(agrupadas),
+        sum(agrupadas.values()),
+    )
+
+    def executar(item) -> ResultadoReenvio:
+        (filial, data, tipo), quantidade = item
+        inicio = time.perf_counter()
+        resultado = ResultadoReenvio(
+            filial=filial, fecha=data, tipo=tipo, solicitacoes=quantidade, sucesso=True
+        )
+        try:
+            resultado.quantidade = reenviar(filial, data, tipo)
+            logger.info("Reenvio de %s da filial %s em %s concluído.", tipo, filial, data)
+        except Exception as e:
+            logger.error(f"Erro ao reenviar {tipo} da filial {filial} em {data}: {e}")
+            print(f"Erro ao reenviar {tipo} da filial {filial} em {data}: {e}")
+            resultado.sucesso = False
+            resultado.erro = str(e)
+        resultado.duracao = round(time.perf_counter() - inicio, 3)
+        return resultado
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(agrupadas))),
+        thread_name_prefix="reenvio",
+    ) as pool:
+        resultados = list(pool.map(executar, agrupadas.items()))
+    # As solicitações atendidas deixam de ser pendentes na ScannTech
+    cache_respostas.invalidar("solicitacoes")
+
+    print(
+        f"Reenvios processados: {sum(r.sucesso for r in resultados)} de {len(resultados)} com sucesso."
+    )
+    return resultados
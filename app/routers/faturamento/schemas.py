@@ -1,5 +1,5 @@
 from datetime import date, datetime
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, ConfigDict, model_validator
 
 
@@ -175,6 +175,48 @@ class Solicitacoes(BaseModel):
     tipo: str
 
 
+class ResultadoFilial(BaseModel):
+    filial: str
+    sucesso: bool
+    resultado: Any = None
+    erro: Optional[str] = None
+    duracao: float = 0.0
+    sem_movimento: bool = False
+
+
+class ResultadoReenvio(BaseModel):
+    filial: str
+    fecha: str
+    tipo: str
+    solicitacoes: int
+    sucesso: bool
+    quantidade: int = 0
+    erro: Optional[str] = None
+    duracao: float = 0.0
+
+
+class ResultadoEtapa(BaseModel):
+    fecha: str
+    etapa: str
+    sucesso: bool
+    quantidade: int = 0
+    erro: Optional[str] = None
+    duracao: float = 0.0
+
+
+class Job(BaseModel):
+    id: str
+    tipo: str
+    status: str
+    parametros: Dict[str, Any] = {}
+    progresso: Dict[str, Any] = {}
+    resultado: Any = None
+    erro: Optional[str] = None
+    criado_em: Optional[datetime] = None
+    iniciado_em: Optional[datetime] = None
+    finalizado_em: Optional[datetime] = None
+
+
 class Envios(BaseModel):
     id: int
     enviado: bool
@@ -183,3 +225,9 @@ class Envios(BaseModel):
     data_envio: date
     lista_notas: str
     devolucao_cancelamento: bool
+    status: Optional[str] = None
+    tipo: Optional[str] = None
+    filial: Optional[str] = None
+    tentativas: int = 0
+    proxima_tentativa: Optional[datetime] = None
+    ultimo_erro: Optional[str] = None
@@ -1,166 +1,217 @@
 import asyncio
-import os
-import schedule
-import time
-from telegram import Bot
+from typing import Callable, List
 from ...configuracoes import (
     hora_envio_faturamento,
     hora_verificacao_reenvio,
     hora_verificacao_cancelamentos,
     hora_verificacao_devolucoes,
     filiais,
+    envio_delta,
 )
 
-from app.database import SessionLocal
-from app.routers.faturamento.faturamento import get_db
+from app.notificacoes import notificar
+from app.routers.faturamento.executor import executar_por_filial
+from app.routers.faturamento.pipeline import ETAPAS, executar_pipeline
+from app.routers.faturamento.planejador import executar_planejado
+from app.routers.faturamento.reenvio import buscar_solicitacoes, processar_reenvios
 from app.routers.faturamento.utils import (
     enviar_faturamento_para_api_externa,
-    get_solicitacoes_reenvio,
     verificar_cancelamentos_enviar,
     verificar_devolucoes,
     enviar_fechamento_diario,
 )
 
 
-bot = Bot(token=os.getenv("BOT_TOKEN_TELEGRAM"))
-
-
 def tarefa_periodica_envio_faturamento(
-    centro: str = None, data_inicial: str = None, data_final: str = None
+    centro: str = None,
+    data_inicial: str = None,
+    data_final: str = None,
+    delta: bool = envio_delta,
+    progresso: Callable = None,
 ):
     """
     Esta função é responsável por enviar periodicamente as informações de faturamento para uma API externa de uma determinada filial.
 
     Parâmetros:
     - filial (str): A filial para a qual as informações de faturamento devem ser enviadas. Se não for fornecida, a função enviará as informações de faturamento para todas as filiais.
+    - delta (bool): Se verdadeiro, envia apenas as notas novas ou alteradas desde o último envio.
+    - progresso (Callable): Opcional. Chamada com o resultado de cada filial assim que ela termina.
 
     Retorna:
-    - envios (list): Uma lista contendo os resultados do processo de envio das informações de faturamento para cada filial.
-
-    Lança:
-    - Exception: Se ocorrer um erro ao enviar as informações de faturamento.
+    - envios (List[ResultadoFilial]): O resultado ou o erro do envio de cada filial.
 
+    Observações:
+    - As filiais são processadas em paralelo, cada uma com a sua própria sessão do banco de dados (ver `executar_por_filial`).
+    - Uma filial que já está sendo processada para os mesmos dias em outro worker é pulada (ver `app.locks`).
+    - Uma filial sem notas no período é pulada e o seu resultado indica `sem_movimento` (ver `planejador`).
     """
-    db = SessionLocal()
-    try:
-        envios = []
-        # Para cada filial, envia as informações de faturamento separadamente
-        for filial in filiais if not centro else [centro]:
-            envio = enviar_faturamento_para_api_externa(
-                db, filial=filial, data_inicial=data_inicial, data_final=data_final
-            )
-            envios.append(envio)
-            print(f"Enviando faturamento da filial {filial}")
-        return envios
-    except Exception as e:
-        print(f"Erro ao enviar faturamento: {e}")
-        return []
-    finally:
-        db.close()
+    envios = executar_planejado(
+        enviar_faturamento_para_api_externa,
+        filiais if not centro else [centro],
+        data_inicial=data_inicial,
+        data_final=data_final,
+        delta=delta,
+        progresso=progresso,
+        lock="faturamento",
+    )
+    for envio in envios:
+        if envio.sem_movimento:
+            print(f"Filial {envio.filial} sem notas no período; envio do faturamento pulado")
+        elif envio.sucesso:
+            print(f"Faturamento da filial {envio.filial} enviado em {envio.duracao}s")
+        else:
+            print(f"Erro ao enviar faturamento da filial {envio.filial}: {envio.erro}")
+    return envios
 
 
 def tarefa_periodica_envio_fechamento(
-    centro: str = None, data_inicial: str = None, data_final: str = None
+    centro: str = None,
+    data_inicial: str = None,
+    data_final: str = None,
+    progresso: Callable = None,
 ):
     """
     Envia o fechamento diário para a filial especificada.
 
     Parâmetros:
     - filial (str): A filial para a qual o fechamento será enviado. Se não for especificada, será enviado para todas as filiais.
+    - progresso (Callable): Opcional. Chamada com o resultado de cada filial assim que ela termina.
 
     Retorna:
-    - envios (list): Uma lista dos fechamentos enviados.
+    - envios (List[ResultadoFilial]): O fechamento enviado ou o erro de cada filial.
 
-    Lança:
-    - Exception: Se ocorrer um erro ao enviar o fechamento.
+    Observações:
+    - As filiais são processadas em paralelo, cada uma com a sua própria sessão do banco de dados (ver `executar_por_filial`).
+    - Uma filial que já está sendo processada para os mesmos dias em outro worker é pulada (ver `app.locks`).
+    - Uma filial sem notas no período é pulada e o seu resultado indica `sem_movimento` (ver `planejador`).
     """
-    db = SessionLocal()
-    try:
-        envios = []
-        # Para cada filial, envia o fechamento diário
-        for filial in filiais if not centro else [centro]:
-            envio = enviar_fechamento_diario(
-                db, filial=filial, data_inicial=data_inicial, data_final=data_final
-            )
-            envios.append(envio)
-            if envio.cantidadMovimientos == 0:
-                print(f"Não há movimentos para enviar na filial {filial}")
-            else:
-                print(f"Enviando fechamento da filial {filial}")
-        return envios
-    except Exception as e:
-        print(f"Erro ao enviar fechamento: {e}")
-        return []
-
-
-def tarefa_periodica_verificacao_cancelamentos(centro: str = None):
+    envios = executar_planejado(
+        enviar_fechamento_diario,
+        filiais if not centro else [centro],
+        data_inicial=data_inicial,
+        data_final=data_final,
+        progresso=progresso,
+        lock="fechamento",
+    )
+    for envio in envios:
+        if not envio.sucesso:
+            print(f"Erro ao enviar fechamento da filial {envio.filial}: {envio.erro}")
+        elif envio.resultado is None or envio.resultado.cantidadMovimientos == 0:
+            print(f"Não há movimentos para enviar na filial {envio.filial}")
+        else:
+            print(f"Fechamento da filial {envio.filial} enviado em {envio.duracao}s")
+    return envios
+
+
+def tarefa_periodica_verificacao_cancelamentos(
+    centro: str = None, progresso: Callable = None
+):
     """
     Função responsável por realizar a verificação periódica de cancelamentos e enviar os dados para processamento.
 
     Parâmetros:
     - filial (str): Opcional. Filial específica a ser verificada. Caso não seja fornecida, serão verificadas todas as filiais.
+    - progresso (Callable): Opcional. Chamada com o resultado de cada filial assim que ela termina.
 
     Retorna:
-    - cancelamentos (list): Lista contendo os cancelamentos verificados para cada filial. Caso ocorra algum erro durante a verificação, uma lista vazia será retornada.
+    - cancelamentos (List[ResultadoFilial]): Os cancelamentos verificados ou o erro de cada filial.
 
     Comportamento:
-    - Inicializa uma conexão com o banco de dados.
-    - Inicializa uma lista vazia para armazenar os cancelamentos.
-    - Para cada filial fornecida ou todas as filiais, realiza a verificação de cancelamentos e adiciona o resultado à lista de cancelamentos.
-    - Retorna a lista de cancelamentos.
-    - Em caso de exceção, imprime o erro ocorrido e retorna uma lista vazia.
-    - Fecha a conexão com o banco de dados.
+    - Para cada filial fornecida ou todas as filiais, realiza a verificação de cancelamentos em paralelo, cada uma com a sua própria sessão do banco de dados.
+    - Um erro em uma filial é registrado no resultado dela e não interrompe as demais.
+    - Retorna a lista de resultados por filial.
 
     """
-    db = SessionLocal()
-    try:
-        cancelamentos = []
-        for filial in filiais if not centro else [centro]:
-            cancelamento = verificar_cancelamentos_enviar(db, filial=filial)
-            cancelamentos.append(cancelamento)
-        return cancelamentos
-    except Exception as e:
-        print(f"Erro ao verificar cancelamentos: {e}")
-        return []
-    finally:
-        db.close()
+    return executar_por_filial(
+        verificar_cancelamentos_enviar,
+        filiais if not centro else [centro],
+        progresso=progresso,
+        lock="cancelamentos",
+    )
 
 
-def tarefa_periodica_verificacao_devolucoes(centro: str = None):
+def tarefa_periodica_verificacao_devolucoes(
+    centro: str = None, progresso: Callable = None
+):
     """
     Função responsável por realizar a verificação periódica de devoluções em uma determinada filial.
 
     Parâmetros:
     - filial (str): Opcional. O código da filial a ser verificada. Se não for fornecido, serão verificadas todas as filiais.
+    - progresso (Callable): Opcional. Chamada com o resultado de cada filial assim que ela termina.
 
     Retorna:
-    - devolucoes (list): Uma lista contendo as devoluções encontradas em cada filial verificada.
+    - devolucoes (List[ResultadoFilial]): As devoluções encontradas ou o erro de cada filial verificada.
+
+    Observações:
+    - As filiais são verificadas em paralelo, cada uma com a sua própria sessão do banco de dados.
+    - Um erro em uma filial é registrado no resultado dela e não interrompe as demais.
+    """
+    return executar_por_filial(
+        verificar_devolucoes,
+        filiais if not centro else [centro],
+        progresso=progresso,
+        lock="devolucoes",
+    )
 
-    Exceções:
-    - Exception: Caso ocorra algum erro durante a verificação das devoluções.
+
+def tarefa_periodica_pipeline(
+    centro: str = None,
+    data_inicial: str = None,
+    data_final: str = None,
+    etapas: List[str] = ETAPAS,
+    delta: bool = envio_delta,
+    progresso: Callable = None,
+):
+    """
+    Executa as etapas noturnas (faturamento, fechamento, cancelamentos e devoluções) com um único cálculo das notas por filial e dia.
+
+    Parâmetros:
+    - centro (str): Opcional. Filial específica a ser processada. Caso não seja fornecida, serão processadas todas as filiais.
+    - etapas (List[str]): As etapas executadas. Padrão: todas.
+    - delta (bool): Se verdadeiro, envia apenas as notas novas ou alteradas desde o último envio.
+    - progresso (Callable): Opcional. Chamada com o resultado de cada filial assim que ela termina.
+
+    Retorna:
+    - envios (List[ResultadoFilial]): O resultado de cada etapa (ver `pipeline.executar_pipeline`) ou o erro de cada filial.
 
     Observações:
-    - A função utiliza uma conexão com o banco de dados local.
-    - Caso ocorra algum erro durante a verificação das devoluções, a função retorna uma lista vazia.
-    - A conexão com o banco de dados é fechada ao final da execução da função.
+    - As filiais são processadas em paralelo, cada uma com a sua própria sessão do banco de dados (ver `executar_por_filial`).
+    - Cada etapa obtém o lock da tarefa avulsa equivalente (ver `app.locks`).
     """
-    db = SessionLocal()
-    try:
-        devolucoes = []
-        for filial in filiais if not centro else [centro]:
-            devolucao = verificar_devolucoes(db, filial=filial)
-            devolucoes.append(devolucao)
-        return devolucoes
-    except Exception as e:
-        print(f"Erro ao verificar devoluções: {e}")
-        return []
-    finally:
-        db.close()
+    # Cancelamentos e devoluções não dependem das notas de venda do período; sem eles, o planejamento se aplica
+    executar = executar_planejado if set(etapas) <= {"faturamento", "fechamento"} else executar_por_filial
+    envios = executar(
+        executar_pipeline,
+        filiais if not centro else [centro],
+        data_inicial=data_inicial,
+        data_final=data_final,
+        etapas=etapas,
+        delta=delta,
+        progresso=progresso,
+    )
+    for envio in envios:
+        if not envio.sucesso:
+            print(f"Erro no pipeline da filial {envio.filial}: {envio.erro}")
+            continue
+        if envio.sem_movimento:
+            print(f"Filial {envio.filial} sem notas no período; pipeline pulado")
+            continue
+        for etapa in envio.resultado:
+            if not etapa.sucesso:
+                print(
+                    f"Erro na etapa {etapa.etapa} da filial {envio.filial} em {etapa.fecha}: {etapa.erro}"
+                )
+        print(f"Pipeline da filial {envio.filial} concluído em {envio.duracao}s")
+    return envios
 
 
 async def send_message(message):
     """
-    Envia uma mensagem para um chat específico.
+    Envia uma mensagem para o chat do Telegram configurado em `telegram_chat_id`.
+
+    A mensagem é apenas enfileirada (ver `app.notificacoes`); o envio é feito em segundo plano, em lote,
+    dividido no limite de tamanho do Telegram e com novas tentativas em caso de falha.
 
     Parâmetros:
     - message (str): A mensagem a ser enviada.
@@ -173,10 +224,10 @@ async def send_message(message):
     await send_message("Olá, mundo!")
     ```
     """
-    await bot.send_message(chat_id=-4209916479, text=message)
+    notificar(message)
 
 
-async def verificar_reenvio(centro: str = None):
+def verificar_reenvio(centro: str = None):
     """
     Verifica se há solicitações de reenvio pendentes para uma determinada filial.
 
@@ -190,89 +241,70 @@ async def verificar_reenvio(centro: str = None):
     - Exception: Se ocorrer algum erro durante a verificação de reenvio.
 
     Descrição:
-    Esta função verifica se há solicitações de reenvio pendentes para uma determinada filial ou para todas as filiais, se nenhum valor for fornecido. Ela obtém as solicitações de reenvio usando a função get_solicitacoes_reenvio e, se houver solicitações encontradas, envia uma mensagem contendo a quantidade de solicitações e os detalhes de cada uma delas. Em seguida, retorna uma lista contendo todas as solicitações de reenvio pendentes encontradas.
+    Esta função verifica se há solicitações de reenvio pendentes para uma determinada filial ou para todas as filiais, se nenhum valor for fornecido. Ela obtém as solicitações de reenvio de todas as filiais e tipos em paralelo (ver `reenvio.buscar_solicitacoes`) e, se houver solicitações encontradas, envia uma mensagem contendo a quantidade de solicitações e os detalhes de cada uma delas. Em seguida, retorna uma lista contendo todas as solicitações de reenvio pendentes encontradas.
 
     Se ocorrer algum erro durante a verificação de reenvio, a função captura a exceção e a imprime, retornando uma lista vazia como resultado.
 
     """
     resultado = []
-    tipos = ["movimientos", "cierresDiarios"]
     try:
-        for filial in filiais if not centro else [centro]:
-            for tipo in tipos:
-                solicitacoes = get_solicitacoes_reenvio(filial=filial, tipo=tipo)
-                if solicitacoes:
-                    qtd_solicitacoes = len(solicitacoes)
-                    await send_message(
-                        f"Existem {qtd_solicitacoes} solicitações de reenvio pendentes. filial: {filial}"
-                        + "\n\n".join(
-                            [f"{solicitacao}" for solicitacao in solicitacoes]
-                        )
-                    )
-                    resultado.extend(solicitacoes)
+        # As solicitações de todas as filiais e tipos são buscadas em paralelo
+        solicitacoes_por_filial = {}
+        for filial, _, solicitacao in buscar_solicitacoes(
+            filiais if not centro else [centro]
+        ):
+            solicitacoes_por_filial.setdefault(filial, []).append(solicitacao)
+        for filial, solicitacoes in solicitacoes_por_filial.items():
+            qtd_solicitacoes = len(solicitacoes)
+            notificar(
+                f"Existem {qtd_solicitacoes} solicitações de reenvio pendentes. filial: {filial}\n"
+                + "\n".join([f"{solicitacao}" for solicitacao in solicitacoes])
+            )
+            resultado.extend(solicitacoes)
         return resultado
     except Exception as e:
         print(f"Erro ao verificar reenvio: {e}")
         return resultado
 
 
-def start_verificacao_reenvio(
-    centro: str = None,
-):
+def tarefa_periodica_processar_reenvio(centro: str = None):
     """
-    Função responsável por iniciar a verificação de reenvio.
+    Processa automaticamente as solicitações de reenvio da ScannTech.
+
+    Parâmetros:
+    - centro (str): Opcional. Filial específica a ser processada. Caso não seja fornecida, serão processadas todas as filiais.
 
-    Essa função cria um novo loop de eventos assíncronos e define-o como o loop atual.
-    Em seguida, executa a função verificar_reenvio de forma assíncrona no loop criado.
-    O resultado da verificação de reenvio é retornado como resultado da função.
+    Retorna:
+    - reenvios (List[ResultadoReenvio]): O resultado de cada reenvio (filial, fecha, tipo).
 
-    Ela era necessário para chamar a funcao de verificacao de reenvio no evento de agendamento, mas não está sendo usada.
+    Observações:
+    - As solicitações são buscadas em paralelo, agrupadas por (filial, fecha, tipo) e reenviadas com paralelismo limitado (ver `reenvio.processar_reenvios`).
     """
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    reenvios = loop.run_until_complete(verificar_reenvio(centro=centro))
+    reenvios = processar_reenvios(centro=centro)
+    for reenvio in reenvios:
+        if reenvio.sucesso:
+            print(
+                f"Reenvio de {reenvio.tipo} da filial {reenvio.filial} em {reenvio.fecha} concluído em {reenvio.duracao}s"
+            )
+        else:
+            print(
+                f"Erro no reenvio de {reenvio.tipo} da filial {reenvio.filial} em {reenvio.fecha}: {reenvio.erro}"
+            )
     return reenvios
 
 
-# Função que seria usada para fazer os agendamentos, mas não está sendo usada
-# Agendamentos sendo feitos pelo N8N
 def iniciar_agendamento():
-    # print("Iniciando agendamento...")
-    # print(
-    #     f"Horário de envio de faturamento e verificação de cancelamentos: {hora_envio_faturamento}"
-    # )
-    # print(f"Horário de verificação de reenvio: {hora_verificacao_reenvio}")
-    # print(f"Horário de verificação de devoluções: {hora_verificacao_devolucoes}")
-
-    # schedule.every().day.at(hora_envio_faturamento).do(
-    #     tarefa_periodica_envio_faturamento
-    # )
-    # schedule.every().day.at(hora_verificacao_reenvio).do(
-    #     start_verificacao_reenvio
-    # )
-    # schedule.every().day.at(hora_verificacao_cancelamentos).do(
-    #     tarefa_periodica_verificacao_cancelamentos
-    # )
-    # schedule.every().day.at(hora_verificacao_devolucoes).do(
-    #     tarefa_periodica_verificacao_devolucoes
-    # )
-
-    # tarefa_periodica_envio_faturamento()
-    # time.sleep(30)
-    # tarefa_periodica_verificacao_cancelamentos()
-    # time.sleep(30)
-    # start_verificacao_reenvio()
-    # time.sleep(30)
-    # tarefa_periodica_verificacao_devolucoes()
-    # time.sleep(30)
-    # tarefa_periodica_envio_faturamento()
-    # time.sleep(60)
-    # tarefa_periodica_verificacao_cancelamentos()
-    # time.sleep(60)
-    # start_verificacao_reenvio()
-    # time.sleep(60)
-    # tarefa_periodica_verificacao_devolucoes()
-
-    while True:
-        schedule.run_pending()
-        time.sleep(5)
+    """
+    Executa o agendador interno (ver `app.agendador`) até o processo ser encerrado.
+
+    Na API, o agendador é iniciado pelo lifespan quando `agendador_ativo` é verdadeiro; esta função
+    serve para executá-lo em um processo separado. Os horários são os `hora_*` de `configuracoes`.
+    """
+    from app.agendador import agendador
+
+    print("Iniciando agendamento...")
+    print(f"Horário de envio de faturamento: {hora_envio_faturamento}")
+    print(f"Horário de verificação de reenvio: {hora_verificacao_reenvio}")
+    print(f"Horário de verificação de cancelamentos: {hora_verificacao_cancelamentos}")
+    print(f"Horário de verificação de devoluções: {hora_verificacao_devolucoes}")
+    asyncio.run(agendador.executar_para_sempre())
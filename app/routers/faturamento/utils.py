@@ -1,12 +1,17 @@
-from datetime import datetime, timedelta
-import json
+from datetime import date, datetime, timedelta
 import logging
+import time
 from logging.handlers import TimedRotatingFileHandler
-from typing import List
+from typing import List, Tuple
 import requests
 from sqlalchemy.orm import Session
 from app.log_config import setup_logger
-from .crud import get_faturamento_per_date, get_fechamento_per_date
+from app.scanntech import cliente_scanntech
+from app.eventos import publicar
+from app.cache_respostas import cache_respostas
+from app.serializacao import de_json, dividir_em_lotes, para_json
+from .crud import calcular_fechamento, get_faturamento_per_date, get_fechamento_per_date
+from . import outbox, preparacao
 from .models import Envios, ItemFaturamento
 from .schemas import ModelScannTech, Fechamento, Solicitacoes
 from app.configuracoes import (
@@ -14,8 +19,9 @@ from app.configuracoes import (
     idEmpresa,
     idLocal,
     idCaja,
-    headers,
     agrupar_outros_flag,
+    envio_delta,
+    preparacao_ativa,
 )
 
 
@@ -32,6 +38,9 @@ def enviar_faturamento_para_api_externa(
     data_final: str = None,
     agrupar_outros_flag: bool = agrupar_outros_flag,
     filial: str = None,
+    delta: bool = envio_delta,
+    faturamentos: List[ModelScannTech] = None,
+    notas: List[Tuple[str, date, str, bytes]] = None,
 ):
     """
     Envia dados de faturamento para uma API externa.
@@ -42,6 +51,11 @@ def enviar_faturamento_para_api_externa(
     - data_final (str, opcional): Data final para filtrar os faturamentos. Se não fornecida, usa a data atual.
     - agrupar_outros_flag (bool): Flag para determinar se outros itens devem ser agrupados.
     - filial (str, opcional): Código da filial para filtrar os faturamentos.
+    - delta (bool): Se verdadeiro, envia apenas as notas novas ou cujo conteúdo mudou desde o último envio.
+    - faturamentos (List[ModelScannTech], opcional): Notas já calculadas do período (ver `pipeline`). Se
+      fornecidas, a consulta ao banco é dispensada.
+    - notas (List[Tuple[str, date, str, bytes]], opcional): O (número, data, hash, conteúdo) já serializado de
+      cada nota de `faturamentos` (ver `preparacao`). Se fornecidas, a serialização é dispensada.
 
     Retorna:
     - List[ModelScannTech]: Lista de objetos de faturamento enviados.
@@ -53,17 +67,21 @@ def enviar_faturamento_para_api_externa(
 
     Passos:
     1. Recupera os dados de faturamento para as datas fornecidas ou para a data atual se as datas não forem especificadas.
-    2. Converte os dados de faturamento em formato JSON.
-    3. Tenta registrar o envio no banco de dados local. Se falhar, faz o rollback e termina a função.
-    4. Tenta enviar os dados de faturamento para a API externa.
-    5. Se o envio for bem-sucedido, atualiza o registro no banco de dados com informações adicionais como idLote e data de envio.
-    6. Caso ocorram erros HTTP ou de conexão, os erros são logados e impressos.
-    7. Retorna a lista de faturamentos enviados.
+    2. Serializa cada nota uma única vez e calcula o hash (sha256) do seu conteúdo. Com `preparacao_ativa`, usa
+       as notas já serializadas ao longo do dia, se os itens não mudaram desde então (ver `preparacao`).
+    3. No modo delta, descarta as notas cujo par (número, hash) já consta em um envio enviado ou pendente
+       da mesma filial e período (`outbox.get_notas_enviadas`, consulta indexada).
+    4. Divide as notas restantes em lotes (`dividir_em_lotes`), limitados por `lote_max_notas` e `lote_max_bytes`.
+    5. Grava um envio pendente por lote no outbox (`outbox.enfileirar`), já com o conteúdo e as notas do lote,
+       e registra o hash de cada nota (`outbox.registrar_notas`). Se falhar, faz o rollback e termina a função.
+    6. Envia os lotes em paralelo para a API externa (`outbox.processar`), até `lote_envios_concorrentes` por vez.
+    7. Para cada lote bem-sucedido, o seu registro é atualizado com o idLote e a data de envio.
+    8. Os lotes que falharam ficam pendentes no outbox e são reenviados pelo drenador, sem recalcular nem reenviar os que já foram aceitos.
+    9. Retorna a lista de faturamentos.
 
     Exceções tratadas:
-    - `requests.exceptions.HTTPError`: Erros relacionados a respostas HTTP.
-    - `requests.exceptions.RequestException`: Erros gerais de requisições HTTP.
     - `Exception`: Erros gerais ao salvar o envio no banco de dados.
+    - Os erros HTTP e de conexão de cada lote são registrados no próprio envio pelo outbox.
 
     Logs:
     - A função registra logs de sucesso e falhas, incluindo detalhes como status code e conteúdo JSON enviado.
@@ -72,66 +90,122 @@ def enviar_faturamento_para_api_externa(
 
     # Get the faturamentos for the current date
     # faturamentos = get_faturamento_per_date(db, current_date, current_date)
-    faturamentos: List[ModelScannTech] = get_faturamento_per_date(
-        db,
-        (data_inicial if data_inicial else current_date),
-        (data_final if data_final else current_date),
-        agrupar_outros=agrupar_outros_flag,
+    data_inicial = data_inicial if data_inicial else current_date
+    data_final = data_final if data_final else current_date
+    if faturamentos is None and preparacao_ativa:
+        # Movimientos preparados ao longo do dia: se os itens não mudaram, envia o conteúdo já serializado
+        preparadas = preparacao.notas_preparadas(
+            db, filial, data_inicial, data_final, agrupar_outros_flag
+        )
+        if preparadas is not None:
+            faturamentos, notas = preparadas
+    if faturamentos is None:
+        faturamentos = get_faturamento_per_date(
+            db,
+            data_inicial,
+            data_final,
+            agrupar_outros=agrupar_outros_flag,
+            filial=filial,
+        )
+    # Serializa cada nota uma única vez e calcula o hash do seu conteúdo
+    inicio = time.perf_counter()
+    if notas is None:
+        notas = preparacao.serializar_notas(faturamentos)
+
+    # Modo delta: descarta as notas já enviadas com o mesmo conteúdo
+    if delta and notas:
+        ja_enviadas = outbox.get_notas_enviadas(
+            db,
+            filial,
+            min(nota[1] for nota in notas),
+            max(nota[1] for nota in notas),
+        )
+        total_notas = len(notas)
+        notas = [nota for nota in notas if (nota[0], nota[2]) not in ja_enviadas]
+        logger.info(
+            "Modo delta na filial %s: %s de %s notas são novas ou alteradas.",
+            filial,
+            len(notas),
+            total_notas,
+        )
+        print(f"Modo delta na filial {filial}: {len(notas)} de {total_notas} notas são novas ou alteradas.")
+
+    # Divide em lotes por quantidade de notas e tamanho
+    lotes = dividir_em_lotes([(numero, conteudo) for numero, _, _, conteudo in notas])
+    publicar(
+        "serializado",
+        tarefa="faturamento",
         filial=filial,
+        quantidade=len(notas),
+        lotes=len(lotes),
+        bytes=sum(len(conteudo) for _, conteudo in lotes),
+        duracao=round(time.perf_counter() - inicio, 3),
     )
-    faturamento_numeros = [f.numero for f in faturamentos]
-    faturamentos_json = [json.loads(f.model_dump_json()) for f in faturamentos]
-    faturamentos_json = json.dumps(faturamentos_json)
+    if not lotes:
+        logger.info("Não há notas para enviar na filial %s.", filial)
+        print(f"Não há notas para enviar na filial {filial}.")
+        return faturamentos
+    notas_por_numero = {numero: (numero, data, hash) for numero, data, hash, _ in notas}
 
+    url_api_externa = f"{url_base}/v2/minoristas/{idEmpresa}/locales/{filial}/cajas/{idCaja}/movimientos/lotes"
+
+    # Grava cada lote no outbox antes de enviar, com o seu conteúdo, as suas notas e o hash de cada nota
+    inicio = time.perf_counter()
     try:
-        envio = Envios()
-        db.add(envio)
+        envios = [
+            outbox.enfileirar(
+                db,
+                tipo="movimientos",
+                filial=filial,
+                url=url_api_externa,
+                conteudo=conteudo,
+                lista_notas=numeros,
+            )
+            for numeros, conteudo in lotes
+        ]
+        db.flush()
+        for envio, (numeros, _) in zip(envios, lotes):
+            outbox.registrar_notas(
+                db, envio, filial, [notas_por_numero[numero] for numero in numeros]
+            )
         db.commit()
-        db.refresh(envio)
-        # idBd = envio.id
     except Exception as e:
         logger.error(f"Erro ao salvar envio: {e}")
         print(f"Erro ao salvar envio: {e}")
         db.rollback()
         return
+    publicar(
+        "gravado",
+        tarefa="faturamento",
+        filial=filial,
+        quantidade=len(envios),
+        duracao=round(time.perf_counter() - inicio, 3),
+    )
 
-    url_api_externa = f"{url_base}/v2/minoristas/{idEmpresa}/locales/{filial}/cajas/{idCaja}/movimientos/lotes"
-    try:
-        resposta = requests.post(
-            url_api_externa, data=faturamentos_json, headers=headers
-        )
-        resposta.raise_for_status()
-        # preenche o idLote no envio
-        envio.id_lote = resposta.json()["idLote"]
-        envio.conteudo = faturamentos_json
-        envio.data_envio = datetime.now()
-        envio.enviado = True
-        envio.lista_notas = faturamento_numeros
-        db.commit()
-        logger.info(
-            "Faturamento enviado com sucesso. %s notas enviadas do centro %s. Status code: %s",
-            len(faturamentos),
-            resposta.status_code,
-            filial,
-        )
-        logger.info(resposta.text)
-        logger.info(faturamentos_json)
-        print(f"Faturamento enviado com sucesso. {len(faturamentos)} notas enviadas.")
-        print(faturamentos_json)
-    except requests.exceptions.HTTPError as err:
-        logger.error(
-            "Falha ao enviar faturamento. Status code: %s", err.response.status_code
-        )
-        logger.error("Detalhes do erro: %s", err.response.text)
-        logger.error(faturamentos_json)
-        print("Falha ao enviar faturamento. Status code:", err.response.status_code)
-        print("Detalhes do erro:", err.response.text)
-        print(faturamentos_json)
-    except requests.exceptions.RequestException as err:
-        logger.error("Erro de conexão ao enviar faturamento: %s", err)
-        logger.error(faturamentos_json)
-        print("Erro de conexão ao enviar faturamento:", err)
-        print(faturamentos_json)
+    # Envia os lotes em paralelo; os que falharem ficam pendentes e são reenviados pelo drenador do outbox
+    inicio = time.perf_counter()
+    outbox.processar(db, envios)
+    enviados = [envio for envio in envios if envio.status == outbox.ENVIADO]
+    publicar(
+        "enviado",
+        tarefa="faturamento",
+        filial=filial,
+        quantidade=len(enviados),
+        falhas=len(envios) - len(enviados),
+        duracao=round(time.perf_counter() - inicio, 3),
+    )
+    # As consultas da filial em cache passam a refletir o que acabou de ser enviado
+    cache_respostas.invalidar(centro=filial)
+    logger.info(
+        "Faturamento da filial %s: %s de %s lotes enviados (%s notas).",
+        filial,
+        len(enviados),
+        len(envios),
+        len(faturamentos),
+    )
+    print(
+        f"Faturamento da filial {filial}: {len(enviados)} de {len(envios)} lotes enviados ({len(faturamentos)} notas)."
+    )
 
     return faturamentos
 
@@ -142,6 +216,7 @@ def enviar_fechamento_diario(
     data_final: str = None,
     agrupar_outros_flag: bool = agrupar_outros_flag,
     filial: str = None,
+    faturamentos: List[ModelScannTech] = None,
 ):
     """
     Envia os dados de fechamento diário para uma API externa.
@@ -152,6 +227,8 @@ def enviar_fechamento_diario(
     - data_final (str, opcional): Data final para filtrar o fechamento. Se não fornecida, usa a data atual.
     - agrupar_outros_flag (bool): Flag para determinar se outros itens devem ser agrupados.
     - filial (str, opcional): Código da filial para filtrar o fechamento.
+    - faturamentos (List[ModelScannTech], opcional): Notas já calculadas do período, sem as canceladas (ver
+      `pipeline`). Se fornecidas, o fechamento é calculado a partir delas, sem consultar o banco.
 
     Retorna:
     - Fechamento: Objeto de fechamento diário enviado.
@@ -164,54 +241,71 @@ def enviar_fechamento_diario(
     Passos:
     1. Recupera os dados de fechamento diário para as datas fornecidas ou para a data atual se as datas não forem especificadas.
     2. Monta a URL da API externa utilizando informações de filial e caixa.
-    3. Tenta enviar os dados de fechamento para a API externa.
-    4. Se o envio for bem-sucedido, loga as informações de sucesso, incluindo o status code e o conteúdo do fechamento.
-    5. Caso ocorram erros HTTP ou de conexão, os erros são logados e impressos.
+    3. Grava o fechamento serializado no outbox e tenta enviá-lo para a API externa.
+    4. Se o envio for bem-sucedido, loga as informações de sucesso e o conteúdo do fechamento.
+    5. Em caso de falha, o erro é logado e o envio fica pendente no outbox para o drenador.
     6. Retorna o objeto de fechamento enviado.
 
     Exceções tratadas:
-    - `requests.exceptions.HTTPError`: Erros relacionados a respostas HTTP.
-    - `requests.exceptions.RequestException`: Erros gerais de requisições HTTP.
+    - `Exception`: Erros gerais ao salvar o envio no banco de dados.
 
     Logs:
     - A função registra logs de sucesso e falhas, incluindo detalhes como status code e o conteúdo do fechamento.
     """
     current_date = datetime.now().strftime("%d/%m/%Y")
 
-    fechamento = get_fechamento_per_date(
-        db=db,
-        data_inicial=(data_inicial if data_inicial else current_date),
-        data_final=(data_final if data_final else current_date),
-        agrupar_outros=agrupar_outros_flag,
-        filial=filial,
-    )
+    if faturamentos is not None:
+        fechamento = calcular_fechamento(faturamentos)
+    else:
+        fechamento = get_fechamento_per_date(
+            db=db,
+            data_inicial=(data_inicial if data_inicial else current_date),
+            data_final=(data_final if data_final else current_date),
+            agrupar_outros=agrupar_outros_flag,
+            filial=filial,
+        )
 
     url_api_externa = f"{url_base}/v2/minoristas/{idEmpresa}/locales/{filial}/cajas/{idCaja}/cierresDiarios"
     if fechamento.cantidadMovimientos == 0:
         logger.info("Não há movimentos para enviar.")
         print("Não há movimentos para enviar.")
         return fechamento
+
+    fechamento_json = para_json(fechamento)
     try:
-        fechamento_json = json.dumps(json.loads(fechamento.model_dump_json()))
-        resposta = requests.post(url_api_externa, data=fechamento_json, headers=headers)
-        resposta.raise_for_status()
-        logger.info(
-            "Fechamento enviado com sucesso. Status code: %s", resposta.status_code
+        envio = outbox.enfileirar(
+            db,
+            tipo="cierresDiarios",
+            filial=filial,
+            url=url_api_externa,
+            conteudo=fechamento_json,
         )
-        logger.info(resposta.text)
-        logger.info(fechamento_json)
-        print("Fechamento enviado com sucesso. Status code:", resposta.status_code)
-        print(resposta.text)
+        db.commit()
+    except Exception as e:
+        logger.error(f"Erro ao salvar envio: {e}")
+        print(f"Erro ao salvar envio: {e}")
+        db.rollback()
+        return fechamento
+
+    inicio = time.perf_counter()
+    outbox.processar(db, [envio])
+    publicar(
+        "enviado",
+        tarefa="fechamento",
+        filial=filial,
+        quantidade=fechamento.cantidadMovimientos,
+        sucesso=envio.status == outbox.ENVIADO,
+        duracao=round(time.perf_counter() - inicio, 3),
+    )
+    cache_respostas.invalidar(centro=filial)
+    if envio.status == outbox.ENVIADO:
+        logger.info("Fechamento enviado com sucesso. %s", fechamento_json)
+        print("Fechamento enviado com sucesso.")
         print(fechamento_json)
-    except requests.exceptions.HTTPError as err:
-        logger.error(
-            "Falha ao enviar fechamento. Status code: %s", err.response.status_code
-        )
-        logger.error("Detalhes do erro: %s", err.response.text)
-    except requests.exceptions.RequestException as err:
-        logger.error(f"Erro de conexão ao enviar fechamento: {err}")
+    else:
+        logger.error("Falha ao enviar fechamento: %s", envio.ultimo_erro)
         logger.error(fechamento_json)
-        print("Erro de conexão ao enviar fechamento:", err)
+        print("Falha ao enviar fechamento:", envio.ultimo_erro)
         print(fechamento_json)
 
     return fechamento
@@ -220,12 +314,15 @@ def enviar_fechamento_diario(
 def get_solicitacoes_reenvio(
     filial: str = None,
     tipo: str = None,
+    levantar_erros: bool = False,
 ):
     """
     Obtém solicitações de reenvio de uma API externa.
 
     Parâmetros:
     - filial (str, opcional): Código da filial para filtrar as solicitações de reenvio.
+    - levantar_erros (bool): Se verdadeiro, os erros da requisição são relançados em vez de resultarem em uma
+      lista vazia (ex.: para que o cache de respostas não guarde uma falha como "sem solicitações").
 
     Retorna:
     - List[Solicitacoes]: Lista de objetos de solicitações de reenvio obtidos da API externa.
@@ -245,6 +342,7 @@ def get_solicitacoes_reenvio(
 
     Exceções tratadas:
     - `requests.exceptions.HTTPError`: Erros relacionados a respostas HTTP, incluindo status code e detalhes do erro.
+    - `requests.exceptions.RequestException`: Erros de conexão ou timeout após esgotar as tentativas do cliente.
 
     Logs:
     - A função registra logs do sucesso na obtenção das solicitações, incluindo o número de solicitações obtidas.
@@ -265,11 +363,9 @@ def get_solicitacoes_reenvio(
         url_api_externa = (
             f"{url_base}/v2/minoristas/{idEmpresa}/locales/{filial}/solicitudes/{tipo}"
         )
-        resposta = requests.get(url_api_externa, headers=headers)
+        resposta = cliente_scanntech.get(url_api_externa)
         resposta.raise_for_status()
-        lista_solicitacoes = [
-            Solicitacoes.model_validate(s) for s in json.loads(resposta.text)
-        ]
+        lista_solicitacoes = de_json(resposta.content, List[Solicitacoes])
 
         logger.info(
             f"Solicitações de reenvio obtidas com sucesso. {len(lista_solicitacoes)} solicitações obtidas.",
@@ -289,13 +385,82 @@ def get_solicitacoes_reenvio(
             err.response.status_code,
         )
         print("Detalhes do erro:", err.response.text)
+        if levantar_erros:
+            raise
+    except requests.exceptions.RequestException as err:
+        logger.error(f"Erro de conexão ao obter solicitações de reenvio: {err}")
+        print("Erro de conexão ao obter solicitações de reenvio:", err)
+        if levantar_erros:
+            raise
 
     return lista_solicitacoes
 
 
+def _enviar_fechamento_caixa_999(
+    db: Session,
+    tipo: str,
+    filial: str,
+    devolucao: Fechamento,
+    lista_notas: List[str],
+):
+    """
+    Grava no outbox e envia o fechamento de cancelamentos ou de devoluções (caixa 999) de uma filial.
+
+    Parâmetros:
+    - db (Session): Sessão do banco de dados.
+    - tipo (str): "cancelamentos" ou "devolucoes".
+    - filial (str): Código da filial.
+    - devolucao (Fechamento): O fechamento a enviar.
+    - lista_notas (List[str]): As notas incluídas no fechamento.
+
+    Retorna:
+    - Fechamento: O fechamento, ou None se não for possível gravar o envio.
+    """
+    url_api_externa = f"{url_base}/v2/minoristas/{idEmpresa}/locales/{filial}/cajas/999/cierresDiarios"
+    try:
+        envio = outbox.enfileirar(
+            db,
+            tipo=tipo,
+            filial=filial,
+            url=url_api_externa,
+            conteudo=para_json(devolucao),
+            lista_notas=lista_notas,
+            devolucao_cancelamento=True,
+        )
+        db.commit()
+    except Exception as e:
+        logger.error(f"Erro ao salvar envio: {e}")
+        print(f"Erro ao salvar envio: {e}")
+        db.rollback()
+        return
+
+    inicio = time.perf_counter()
+    outbox.processar(db, [envio])
+    publicar(
+        "enviado",
+        tarefa=tipo,
+        filial=filial,
+        quantidade=len(lista_notas or []),
+        sucesso=envio.status == outbox.ENVIADO,
+        duracao=round(time.perf_counter() - inicio, 3),
+    )
+    if envio.status == outbox.ENVIADO:
+        logger.info("Fechamento de %s enviado com sucesso.", tipo)
+        logger.info(devolucao)
+        print(f"Fechamento de {tipo} enviado com sucesso.")
+        print(devolucao)
+    else:
+        logger.error("Falha ao enviar fechamento de %s: %s", tipo, envio.ultimo_erro)
+        logger.error(devolucao)
+        print(f"Falha ao enviar fechamento de {tipo}:", envio.ultimo_erro)
+        print(devolucao)
+    return devolucao
+
+
 def verificar_cancelamentos_enviar(
     db: Session,
     filial: str = None,
+    notas_enviadas: List[ModelScannTech] = None,
 ):
     """
     Verifica cancelamentos de notas fiscais e envia um fechamento diário para uma API externa.
@@ -303,6 +468,8 @@ def verificar_cancelamentos_enviar(
     Parâmetros:
     - db (Session): Sessão do banco de dados utilizada para realizar consultas e operações.
     - filial (str, opcional): Código da filial para filtrar os envios e cancelamentos.
+    - notas_enviadas (List[ModelScannTech], opcional): Todas as notas do período, incluindo as canceladas,
+      já calculadas (ver `pipeline`). Se não forem fornecidas, são consultadas no banco.
 
     Retorna:
     - Fechamento: Objeto de fechamento de cancelamentos enviado.
@@ -318,16 +485,13 @@ def verificar_cancelamentos_enviar(
        de devolução/cancelamento.
     3. Filtra e agrupa as notas fiscais enviadas, separando aquelas que foram canceladas.
     4. Cria um objeto de fechamento (`Fechamento`) com as informações agregadas de cancelamentos.
-    5. Tenta salvar um novo registro de envio no banco de dados, identificando-o como uma devolução/cancelamento.
+    5. Grava o fechamento no outbox, com as notas canceladas, identificando-o como uma devolução/cancelamento.
     6. Envia o fechamento de cancelamentos para a API externa.
-    7. Se o envio for bem-sucedido, atualiza o registro no banco de dados com informações como conteúdo do envio,
-       data de envio e notas fiscais associadas.
-    8. Em caso de erro HTTP ou de conexão, os erros são logados e impressos.
+    7. Se o envio for bem-sucedido, o registro é marcado como enviado com a data de envio.
+    8. Em caso de erro HTTP ou de conexão, os erros são logados e o envio fica pendente no outbox.
     9. Retorna o objeto de fechamento enviado.
 
     Exceções tratadas:
-    - `requests.exceptions.HTTPError`: Erros relacionados a respostas HTTP, incluindo status code e detalhes do erro.
-    - `requests.exceptions.RequestException`: Erros gerais de conexão e requisições HTTP.
     - `Exception`: Erros gerais durante a consulta e manipulação dos dados no banco de dados.
 
     Logs:
@@ -348,7 +512,7 @@ def verificar_cancelamentos_enviar(
     data_final = datetime.now().date()
     try:
         envios = db.query(Envios).filter(
-            Envios.enviado.isnot(None)
+            Envios.enviado.is_(True)
             & Envios.devolucao_cancelamento.is_(None)
             & Envios.data_envio.between(data_inicial, data_final)
         )
@@ -383,13 +547,14 @@ def verificar_cancelamentos_enviar(
         notas = filter(lambda nota: nota not in notas_devolvidas, notas)
         notas_devolvidas = list(filter(None, notas_devolvidas))
 
-        notas_enviadas = get_faturamento_per_date(
-            db,
-            data_inicial.strftime("%d/%m/%Y"),
-            data_final.strftime("%d/%m/%Y"),
-            filtrar_canceladas=False,
-            filial=filial,
-        )
+        if notas_enviadas is None:
+            notas_enviadas = get_faturamento_per_date(
+                db,
+                data_inicial.strftime("%d/%m/%Y"),
+                data_final.strftime("%d/%m/%Y"),
+                filtrar_canceladas=False,
+                filial=filial,
+            )
         notas_canceladas = []
         numeros_notas_canceladas = []
         devolucao = Fechamento(
@@ -411,68 +576,14 @@ def verificar_cancelamentos_enviar(
     except Exception as e:
         print(e)
 
-    try:
-        envio = Envios(
-            devolucao_cancelamento=True,
-        )
-        db.add(envio)
-        db.commit()
-        db.refresh(envio)
-        # idBd = envio.id
-    except Exception as e:
-        logger.error(f"Erro ao salvar envio: {e}")
-        print(f"Erro ao salvar envio: {e}")
-        db.rollback()
-        return
-
     # enviar fechamento de cancelamentos para a API externa
-    url_api_externa = f"{url_base}/v2/minoristas/{idEmpresa}/locales/{filial}/cajas/999/cierresDiarios"
     if devolucao.cantidadMovimientos == 0:
         logger.info("Não há cancelamentos para enviar.")
         print("Não há cancelamentos para enviar.")
         return devolucao
-    try:
-        devolucao_json = json.loads(devolucao.model_dump_json())
-        devolucao_json = json.dumps(devolucao_json)
-        resposta = requests.post(url_api_externa, data=devolucao_json, headers=headers)
-        resposta.raise_for_status()
-        envio.conteudo = devolucao_json
-        envio.data_envio = datetime.now()
-        envio.enviado = True
-        envio.lista_notas = numeros_notas_canceladas
-        db.commit()
-        logger.info(
-            "Fechamento de cancelamentos enviado com sucesso. Status code: %s",
-            resposta.status_code,
-        )
-        logger.info(resposta.text)
-        logger.info(devolucao)
-        print(
-            "Fechamento de cancelamentos enviado com sucesso. Status code:",
-            resposta.status_code,
-        )
-        print(resposta.text)
-        print(devolucao)
-    except requests.exceptions.HTTPError as err:
-        logger.error(
-            "Falha ao enviar fechamento de cancelamentos. Status code: %s",
-            err.response.status_code,
-        )
-        logger.error("Detalhes do erro: %s", err.response.text)
-        logger.error(devolucao)
-        print(
-            "Falha ao enviar fechamento de cancelamentos. Status code:",
-            err.response.status_code,
-        )
-        print("Detalhes do erro:", err.response.text)
-        print(devolucao)
-    except requests.exceptions.RequestException as err:
-        logger.error("Erro de conexão ao enviar fechamento de cancelamentos: %s", err)
-        logger.error(devolucao)
-        print("Erro de conexão ao enviar fechamento de cancelamentos:", err)
-        print(devolucao)
-
-    return devolucao
+    return _enviar_fechamento_caixa_999(
+        db, "cancelamentos", filial, devolucao, numeros_notas_canceladas
+    )
 
 
 def verificar_devolucoes(
@@ -497,15 +608,13 @@ def verificar_devolucoes(
     1. Define o período de data para a verificação de devoluções.
     2. Consulta no banco de dados todas as devoluções (`ItemFaturamento`) que ocorreram no período definido e que não foram canceladas.
     3. Cria um objeto de fechamento (`Fechamento`) e agrega as informações das devoluções, como valores e quantidade de devoluções.
-    4. Tenta salvar um novo registro de envio no banco de dados, identificando-o como uma devolução/cancelamento.
+    4. Grava o fechamento no outbox, com as notas devolvidas, identificando-o como uma devolução/cancelamento.
     5. Envia o fechamento de devoluções para a API externa.
-    6. Se o envio for bem-sucedido, atualiza o registro no banco de dados com informações como o conteúdo do envio, data de envio e notas fiscais associadas.
-    7. Em caso de erro HTTP ou de conexão, os erros são logados e impressos.
+    6. Se o envio for bem-sucedido, o registro é marcado como enviado com a data de envio.
+    7. Em caso de erro HTTP ou de conexão, os erros são logados e o envio fica pendente no outbox.
     8. Retorna o objeto de fechamento enviado.
 
     Exceções tratadas:
-    - `requests.exceptions.HTTPError`: Erros relacionados a respostas HTTP, incluindo status code e detalhes do erro.
-    - `requests.exceptions.RequestException`: Erros gerais de conexão e requisições HTTP.
     - `Exception`: Erros gerais durante a consulta e manipulação dos dados no banco de dados.
 
     Logs:
@@ -553,61 +662,6 @@ def verificar_devolucoes(
         devolucao.cantidadCancelaciones += 1
         lista_notas.append(dev.NUMERO_NOTA)
 
-    try:
-        envio = Envios(
-            devolucao_cancelamento=True,
-        )
-        db.add(envio)
-        db.commit()
-        db.refresh(envio)
-        # idBd = envio.id
-    except Exception as e:
-        logger.error(f"Erro ao salvar envio: {e}")
-        print(f"Erro ao salvar envio: {e}")
-        db.rollback()
-        return
-
-    url_api_externa = f"{url_base}/v2/minoristas/{idEmpresa}/locales/{filial}/cajas/999/cierresDiarios"
-
-    try:
-        devolucao_json = json.loads(devolucao.model_dump_json())
-        devolucao_json = json.dumps(devolucao_json)
-        resposta = requests.post(url_api_externa, data=devolucao_json, headers=headers)
-        resposta.raise_for_status()
-        envio.conteudo = devolucao_json
-        envio.data_envio = datetime.now()
-        envio.enviado = True
-        envio.lista_notas = lista_notas
-        db.commit()
-        logger.info(
-            "Fechamento de devoluções enviado com sucesso. Status code: %s",
-            resposta.status_code,
-        )
-        logger.info(resposta.text)
-        logger.info(devolucao)
-        print(
-            "Fechamento de devoluções enviado com sucesso. Status code: %s",
-            resposta.status_code,
-        )
-        print(resposta.text)
-        print(devolucao)
-    except requests.exceptions.HTTPError as err:
-        logger.error(
-            "Falha ao enviar fechamento de devoluções. Status code: %s",
-            err.response.status_code,
-        )
-        logger.error("Detalhes do erro: %s", err.response.text)
-        logger.error(devolucao)
-        print(
-            "Falha ao enviar fechamento de devoluções. Status code: %s",
-            err.response.status_code,
-        )
-        print("Detalhes do erro:", err.response.text)
-        print(devolucao)
-    except requests.exceptions.RequestException as err:
-        logger.error("Erro de conexão ao enviar fechamento de devoluções: %s", err)
-        logger.error(devolucao)
-        print("Erro de conexão ao enviar fechamento de devoluções:", err)
-        print(devolucao)
-
-    return devolucao
+    return _enviar_fechamento_caixa_999(
+        db, "devolucoes", filial, devolucao, lista_notas
+    )
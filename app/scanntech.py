@@ -0,0 +1,419 @@
+import logging
+import random
+import threading
+import time
+from collections import defaultdict, deque
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from app.log_config import setup_logger
+from app.configuracoes import (
+    headers,
+    scanntech_timeout_conexao,
+    scanntech_timeout_leitura,
+    scanntech_tentativas,
+    scanntech_backoff_base,
+    scanntech_backoff_maximo,
+    scanntech_tamanho_pool,
+    scanntech_limite_falhas,
+    scanntech_tempo_abertura,
+    scanntech_taxa_requisicoes,
+    scanntech_rajada,
+)
+
+"""
+Módulo do Cliente ScannTech
+
+Este módulo concentra todas as chamadas HTTP feitas para a API de minoristas da ScannTech.
+
+- As conexões são reaproveitadas (keep-alive) por um pool compartilhado entre as threads.
+- Toda chamada tem timeout de conexão e de leitura.
+- Erros de conexão, timeouts e respostas 5xx são repetidos com backoff exponencial e jitter. Nos métodos
+  não idempotentes (POST dos lotes e fechamentos), apenas as falhas em que a requisição certamente não
+  chegou ao servidor (timeout ou recusa da conexão) são repetidas; timeouts de leitura e respostas 5xx ficam
+  para a nova tentativa agendada pelo outbox, com a mesma `Idempotency-Key`.
+- A latência de cada chamada é registrada por família de endpoint (lotes, cierresDiarios, solicitudes).
+- Cada família tem um disjuntor (circuit breaker) e um limitador de taxa (token bucket) próprios: quando a
+  API está fora do ar, as chamadas falham imediatamente com `CircuitoAberto` em vez de esperar os timeouts.
+
+Variáveis:
+- cliente_scanntech: A instância compartilhada do cliente, usada por todo o código de envio.
+"""
+
+METODOS_IDEMPOTENTES = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+def requisicao_nao_enviada(err: requests.exceptions.RequestException) -> bool:
+    """
+    Indica se o erro ocorreu antes de a conexão ser estabelecida, ou seja, sem que o servidor pudesse ter
+    recebido a requisição.
+    """
+    if isinstance(err, requests.exceptions.ConnectTimeout):
+        return True
+    motivo = err.args[0] if err.args else None
+    # O requests embrulha o erro do urllib3 em um MaxRetryError, com a causa em `reason`
+    motivo = getattr(motivo, "reason", motivo)
+    return isinstance(motivo, NewConnectionError)
+
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def familia_da_url(url: str) -> str:
+    """
+    Identifica a família do endpoint a partir da URL.
+
+    Args:
+        url (str): A URL chamada.
+
+    Returns:
+        str: "solicitudes", "lotes", "cierresDiarios" ou o último segmento da URL.
+    """
+    if "/solicitudes/" in url:
+        return "solicitudes"
+    return url.rstrip("/").rsplit("/", 1)[-1]
+
+
+def percentil(valores, p: float) -> float:
+    """
+    Calcula o percentil `p` (0-100) de uma lista de valores pelo método do vizinho mais próximo.
+    """
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+class CircuitoAberto(requests.exceptions.RequestException):
+    """
+    Lançada quando o disjuntor da família de endpoint está aberto e a chamada não é feita.
+    """
+
+
+class Disjuntor:
+    """
+    Disjuntor (circuit breaker) de uma família de endpoint.
+
+    - fechado: as chamadas passam normalmente; `limite_falhas` falhas seguidas abrem o circuito.
+    - aberto: as chamadas são recusadas até passar `tempo_abertura` segundos.
+    - semi-aberto: uma única chamada de teste passa; sucesso fecha o circuito, falha o abre novamente.
+
+    Args:
+        limite_falhas (int): Número de falhas seguidas para abrir o circuito.
+        tempo_abertura (float): Tempo, em segundos, que o circuito fica aberto antes do teste.
+    """
+
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    SEMI_ABERTO = "semi-aberto"
+
+    def __init__(
+        self,
+        limite_falhas: int = scanntech_limite_falhas,
+        tempo_abertura: float = scanntech_tempo_abertura,
+    ):
+        self.limite_falhas = limite_falhas
+        self.tempo_abertura = tempo_abertura
+        self.estado = self.FECHADO
+        self.falhas = 0
+        self.aberto_em = None
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self.estado == self.FECHADO:
+                return True
+            if (
+                self.estado == self.ABERTO
+                and time.monotonic() - self.aberto_em >= self.tempo_abertura
+            ):
+                self.estado = self.SEMI_ABERTO
+                self._teste_em_andamento = False
+            if self.estado == self.SEMI_ABERTO and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return True
+            return False
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self.estado = self.FECHADO
+            self.falhas = 0
+            self._teste_em_andamento = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self.falhas += 1
+            if self.estado == self.SEMI_ABERTO or self.falhas >= self.limite_falhas:
+                if self.estado != self.ABERTO:
+                    logger.warning(f"Circuito aberto após {self.falhas} falhas")
+                self.estado = self.ABERTO
+                self.aberto_em = time.monotonic()
+                self._teste_em_andamento = False
+
+    def segundos_para_teste(self) -> float:
+        with self._lock:
+            if self.estado != self.ABERTO:
+                return 0.0
+            return max(0.0, self.tempo_abertura - (time.monotonic() - self.aberto_em))
+
+    def resumo(self) -> dict:
+        return {
+            "estado": self.estado,
+            "falhas": self.falhas,
+            "segundos_para_teste": round(self.segundos_para_teste(), 1),
+        }
+
+
+class LimitadorTaxa:
+    """
+    Limitador de taxa do tipo token bucket.
+
+    Args:
+        taxa (float): Tokens repostos por segundo (requisições por segundo em regime).
+        capacidade (int): Tamanho máximo do balde (rajada permitida).
+    """
+
+    def __init__(
+        self, taxa: float = scanntech_taxa_requisicoes, capacidade: int = scanntech_rajada
+    ):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = float(capacidade)
+        self.atualizado_em = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _repor(self):
+        agora = time.monotonic()
+        self.tokens = min(
+            self.capacidade, self.tokens + (agora - self.atualizado_em) * self.taxa
+        )
+        self.atualizado_em = agora
+
+    def adquirir(self):
+        """
+        Consome um token, esperando a reposição se o balde estiver vazio.
+        """
+        while True:
+            with self._lock:
+                self._repor()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                espera = (1 - self.tokens) / self.taxa
+            time.sleep(espera)
+
+    def resumo(self) -> dict:
+        with self._lock:
+            self._repor()
+            return {
+                "tokens": round(self.tokens, 2),
+                "taxa": self.taxa,
+                "capacidade": self.capacidade,
+            }
+
+
+class ClienteScannTech:
+    """
+    Cliente HTTP com pool de conexões, timeouts e novas tentativas para a API da ScannTech.
+
+    Args:
+        timeout_conexao (float): Timeout para estabelecer a conexão, em segundos.
+        timeout_leitura (float): Timeout para ler a resposta, em segundos.
+        tentativas (int): Número total de tentativas por chamada.
+        backoff_base (float): Espera base entre tentativas, dobrada a cada nova tentativa.
+        backoff_maximo (float): Espera máxima entre tentativas.
+        tamanho_pool (int): Número de conexões mantidas abertas por host.
+    """
+
+    def __init__(
+        self,
+        timeout_conexao: float = scanntech_timeout_conexao,
+        timeout_leitura: float = scanntech_timeout_leitura,
+        tentativas: int = scanntech_tentativas,
+        backoff_base: float = scanntech_backoff_base,
+        backoff_maximo: float = scanntech_backoff_maximo,
+        tamanho_pool: int = scanntech_tamanho_pool,
+    ):
+        self.timeout = (timeout_conexao, timeout_leitura)
+        self.tentativas = max(1, tentativas)
+        self.backoff_base = backoff_base
+        self.backoff_maximo = backoff_maximo
+
+        self.sessao = requests.Session()
+        self.sessao.headers.update(headers)
+        adaptador = HTTPAdapter(
+            pool_connections=tamanho_pool, pool_maxsize=tamanho_pool, max_retries=0
+        )
+        self.sessao.mount("http://", adaptador)
+        self.sessao.mount("https://", adaptador)
+
+        self._lock = threading.Lock()
+        self._metricas = defaultdict(
+            lambda: {
+                "chamadas": 0,
+                "erros": 0,
+                "bytes": 0,
+                "latencias": deque(maxlen=1000),
+                "tamanhos": deque(maxlen=1000),
+            }
+        )
+        self._disjuntores = defaultdict(Disjuntor)
+        self._limitadores = defaultdict(LimitadorTaxa)
+
+    def _protecoes(self, familia: str):
+        with self._lock:
+            return self._disjuntores[familia], self._limitadores[familia]
+
+    def _espera(self, tentativa: int) -> float:
+        # Backoff exponencial com "full jitter"
+        teto = min(self.backoff_maximo, self.backoff_base * (2**tentativa))
+        return random.uniform(0, teto)
+
+    def _registrar(self, familia: str, duracao: float, erro: bool, tamanho: int = 0):
+        with self._lock:
+            metrica = self._metricas[familia]
+            metrica["chamadas"] += 1
+            metrica["latencias"].append(duracao)
+            metrica["bytes"] += tamanho
+            metrica["tamanhos"].append(tamanho)
+            if erro:
+                metrica["erros"] += 1
+
+    def requisitar(self, metodo: str, url: str, **kwargs) -> requests.Response:
+        """
+        Executa uma requisição, repetindo em caso de erro de conexão, timeout ou resposta 5xx. Métodos não
+        idempotentes são repetidos apenas quando a requisição não chegou ao servidor
+        (`requisicao_nao_enviada`).
+
+        Args:
+            metodo (str): O método HTTP.
+            url (str): A URL completa.
+            **kwargs: Argumentos repassados para `requests.Session.request`.
+
+        Returns:
+            requests.Response: A última resposta obtida. Cabe ao chamador chamar `raise_for_status`.
+
+        Raises:
+            CircuitoAberto: Se o disjuntor da família estiver aberto.
+            requests.exceptions.RequestException: Se todas as tentativas falharem sem resposta.
+        """
+        familia = familia_da_url(url)
+        tamanho = len(kwargs.get("data") or b"")
+        disjuntor, limitador = self._protecoes(familia)
+        kwargs.setdefault("timeout", self.timeout)
+        idempotente = metodo.upper() in METODOS_IDEMPOTENTES
+        for tentativa in range(self.tentativas):
+            ultima = tentativa == self.tentativas - 1
+            if not disjuntor.permitir():
+                raise CircuitoAberto(
+                    f"Circuito de {familia} aberto; nova tentativa em "
+                    f"{disjuntor.segundos_para_teste():.0f}s"
+                )
+            limitador.adquirir()
+            inicio = time.perf_counter()
+            try:
+                resposta = self.sessao.request(metodo, url, **kwargs)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as err:
+                duracao = time.perf_counter() - inicio
+                self._registrar(familia, duracao, erro=True, tamanho=tamanho)
+                disjuntor.registrar_falha()
+                logger.warning(
+                    f"{metodo} {familia} falhou em {duracao:.3f}s "
+                    f"(tentativa {tentativa + 1}/{self.tentativas}): {err}"
+                )
+                # Um POST pode ter sido processado mesmo sem resposta: só é repetido se não chegou a ser enviado
+                if ultima or not (idempotente or requisicao_nao_enviada(err)):
+                    raise
+                time.sleep(self._espera(tentativa))
+                continue
+            except Exception:
+                disjuntor.registrar_falha()
+                raise
+
+            duracao = time.perf_counter() - inicio
+            erro_servidor = resposta.status_code >= 500
+            self._registrar(
+                familia, duracao, erro=resposta.status_code >= 400, tamanho=tamanho
+            )
+            if erro_servidor:
+                disjuntor.registrar_falha()
+            else:
+                disjuntor.registrar_sucesso()
+            logger.debug(
+                f"{metodo} {familia} -> {resposta.status_code} em {duracao:.3f}s"
+            )
+            if erro_servidor and idempotente and not ultima:
+                logger.warning(
+                    f"{metodo} {familia} retornou {resposta.status_code} "
+                    f"(tentativa {tentativa + 1}/{self.tentativas})"
+                )
+                time.sleep(self._espera(tentativa))
+                continue
+            return resposta
+
+    def post(self, url: str, data=None, **kwargs) -> requests.Response:
+        return self.requisitar("POST", url, data=data, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.requisitar("GET", url, **kwargs)
+
+    def metricas(self) -> dict:
+        """
+        Retorna o resumo das chamadas por família de endpoint.
+
+        Returns:
+            dict: Para cada família, o total de chamadas, de erros, as latências p50/p99 em segundos,
+            o total de bytes enviados e os tamanhos p50/p99 dos corpos enviados.
+        """
+        with self._lock:
+            return {
+                familia: {
+                    "chamadas": metrica["chamadas"],
+                    "erros": metrica["erros"],
+                    "p50": round(percentil(metrica["latencias"], 50), 4),
+                    "p99": round(percentil(metrica["latencias"], 99), 4),
+                    "bytes": metrica["bytes"],
+                    "tamanho_p50": percentil(metrica["tamanhos"], 50),
+                    "tamanho_p99": percentil(metrica["tamanhos"], 99),
+                }
+                for familia, metrica in self._metricas.items()
+            }
+
+    def zerar_metricas(self):
+        """
+        Descarta as métricas registradas até o momento.
+        """
+        with self._lock:
+            self._metricas.clear()
+
+    def estado(self) -> dict:
+        """
+        Retorna o estado do disjuntor, do limitador de taxa e as métricas de cada família de endpoint.
+        """
+        metricas = self.metricas()
+        with self._lock:
+            familias = set(self._disjuntores) | set(metricas)
+            protecoes = {
+                familia: (self._disjuntores[familia], self._limitadores[familia])
+                for familia in familias
+            }
+        return {
+            familia: {
+                "circuito": disjuntor.resumo(),
+                "limitador": limitador.resumo(),
+                "metricas": metricas.get(familia, {}),
+            }
+            for familia, (disjuntor, limitador) in sorted(protecoes.items())
+        }
+
+
+cliente_scanntech = ClienteScannTech()
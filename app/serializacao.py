@@ -0,0 +1,114 @@
+import functools
+from typing import Any, Callable, List, Tuple
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, TypeAdapter
+from app.configuracoes import lote_max_bytes, lote_max_notas
+
+"""
+Módulo de Serialização
+
+Camada única de JSON da aplicação, usada tanto nas respostas da API quanto nos corpos enviados à ScannTech,
+para que cada conteúdo seja serializado uma única vez, direto para bytes:
+
+- Modelos pydantic (e listas de modelos) são serializados pelo serializador do pydantic-core
+  (`TypeAdapter.dump_json`), com o mesmo resultado de `model_dump_json` e sem passar por dicts
+  intermediários. Os hashes do modo delta continuam os mesmos.
+- Os demais valores (dicts, listas, eventos) são serializados com orjson.
+- `RespostaJSON` é a resposta padrão da API: conteúdo já serializado (bytes) é devolvido como está e o
+  restante é serializado com `para_json`.
+- `dividir_em_lotes` monta os corpos dos lotes de movimientos a partir das notas já serializadas.
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def adaptador(tipo) -> TypeAdapter:
+    """
+    Retorna o TypeAdapter de um tipo, criado uma única vez.
+    """
+    return TypeAdapter(tipo)
+
+
+def para_json(valor: Any, tipo=None) -> bytes:
+    """
+    Serializa um valor em JSON.
+
+    Args:
+        valor (Any): O valor.
+        tipo (opcional): O tipo do valor (ex.: `List[ModelScannTech]`). Se não for informado, modelos pydantic
+            usam o seu próprio tipo e os demais valores são serializados com orjson.
+
+    Returns:
+        bytes: O JSON.
+    """
+    if tipo is None and isinstance(valor, BaseModel):
+        tipo = type(valor)
+    if tipo is not None:
+        return adaptador(tipo).dump_json(valor)
+    return orjson.dumps(valor, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+def de_json(conteudo, tipo=None) -> Any:
+    """
+    Lê um JSON e, se `tipo` for informado, valida o conteúdo diretamente no tipo, sem dicts intermediários.
+    """
+    if tipo is not None:
+        return adaptador(tipo).validate_json(conteudo)
+    return orjson.loads(conteudo)
+
+
+def serializada(funcao: Callable, tipo=None) -> Callable:
+    """
+    Envolve uma função para que ela devolva o seu resultado já serializado (ou None), de forma que o cache
+    de respostas guarde os bytes prontos para envio.
+    """
+
+    @functools.wraps(funcao)
+    def executar(*args, **kwargs):
+        resultado = funcao(*args, **kwargs)
+        return None if resultado is None else para_json(resultado, tipo)
+
+    return executar
+
+
+def dividir_em_lotes(
+    notas: List[Tuple[str, bytes]],
+    max_notas: int = lote_max_notas,
+    max_bytes: int = lote_max_bytes,
+) -> List[Tuple[List[str], bytes]]:
+    """
+    Divide as notas serializadas em lotes limitados por quantidade de notas e por tamanho.
+
+    Parâmetros:
+    - notas (List[Tuple[str, bytes]]): Pares (número da nota, JSON da nota).
+    - max_notas (int): Número máximo de notas por lote.
+    - max_bytes (int): Tamanho máximo, em bytes, do corpo de cada lote. Uma nota maior que o limite vai sozinha em um lote.
+
+    Retorna:
+    - List[Tuple[List[str], bytes]]: Para cada lote, os números das notas e o corpo JSON (um array) pronto para envio.
+    """
+    lotes = []
+    numeros, partes, tamanho = [], [], 2  # 2 bytes dos colchetes do array
+    for numero, conteudo in notas:
+        acrescimo = len(conteudo) + (1 if partes else 0)  # vírgula separadora
+        if partes and (len(partes) >= max_notas or tamanho + acrescimo > max_bytes):
+            lotes.append((numeros, b"[" + b",".join(partes) + b"]"))
+            numeros, partes, tamanho = [], [], 2
+            acrescimo = len(conteudo)
+        numeros.append(numero)
+        partes.append(conteudo)
+        tamanho += acrescimo
+    if partes:
+        lotes.append((numeros, b"[" + b",".join(partes) + b"]"))
+    return lotes
+
+
+class RespostaJSON(ORJSONResponse):
+    """
+    Resposta JSON com orjson que aceita conteúdo já serializado.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return para_json(content)
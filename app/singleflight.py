@@ -0,0 +1,119 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Hashable, Tuple
+from app.log_config import setup_logger
+
+"""
+Módulo Single-flight
+
+Agrupa chamadas idênticas e simultâneas: enquanto uma chamada com a mesma chave está em andamento, as
+demais esperam por ela e recebem o mesmo resultado (ou a mesma exceção), em vez de repetir a consulta,
+a agregação, a exportação ou, no caso dos envios, de enviar tudo novamente.
+
+Apenas chamadas simultâneas são agrupadas; uma chamada feita depois que a anterior terminou é executada
+normalmente. As rotas que usam este módulo são síncronas (`def`) e rodam no threadpool do FastAPI.
+"""
+
+# Verifica se o logger já foi configurado
+if not logging.getLogger().hasHandlers():
+    logger = setup_logger()
+else:
+    logger = logging.getLogger(__name__)
+
+
+def _normalizar(valor):
+    if isinstance(valor, str):
+        valor = valor.strip()
+        # As datas chegam em dd/mm/aaaa, com ou sem zeros à esquerda
+        try:
+            return datetime.strptime(valor, "%d/%m/%Y").date().isoformat()
+        except ValueError:
+            return valor or None
+    return valor
+
+
+def chave_chamada(endpoint: str, **parametros) -> Tuple:
+    """
+    Monta a chave de uma chamada a partir do endpoint e dos parâmetros normalizados.
+
+    Args:
+        endpoint (str): Identifica a operação (ex.: "faturamento").
+        **parametros: Os parâmetros da chamada. Textos são aparados, datas dd/mm/aaaa são convertidas
+            para ISO e textos vazios equivalem a None.
+
+    Returns:
+        Tuple: A chave, independente da ordem dos parâmetros.
+    """
+    return (endpoint,) + tuple(
+        sorted((nome, _normalizar(valor)) for nome, valor in parametros.items())
+    )
+
+
+class _Chamada:
+    def __init__(self):
+        self.concluida = threading.Event()
+        self.resultado = None
+        self.erro = None
+        self.compartilhada = 0
+
+
+class SingleFlight:
+    """
+    Executa no máximo uma chamada por chave ao mesmo tempo e compartilha o seu resultado.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chamadas = {}
+
+    def executar(self, chave: Hashable, funcao: Callable, *args, **kwargs):
+        """
+        Executa `funcao(*args, **kwargs)`, ou espera pela chamada em andamento com a mesma chave.
+
+        Args:
+            chave (Hashable): A chave da chamada (ver `chave_chamada`).
+            funcao (Callable): A função executada pela primeira chamada.
+
+        Returns:
+            O resultado da função, compartilhado entre as chamadas simultâneas.
+
+        Raises:
+            Exception: A exceção lançada pela função, repassada a todas as chamadas que esperavam por ela.
+        """
+        with self._lock:
+            chamada = self._chamadas.get(chave)
+            primeira = chamada is None
+            if primeira:
+                chamada = self._chamadas[chave] = _Chamada()
+            else:
+                chamada.compartilhada += 1
+
+        if not primeira:
+            logger.info(f"Chamada {chave} já em andamento; aguardando o resultado.")
+            chamada.concluida.wait()
+            if chamada.erro is not None:
+                raise chamada.erro
+            return chamada.resultado
+
+        try:
+            chamada.resultado = funcao(*args, **kwargs)
+            return chamada.resultado
+        except Exception as e:
+            chamada.erro = e
+            raise
+        finally:
+            with self._lock:
+                del self._chamadas[chave]
+            chamada.concluida.set()
+            if chamada.compartilhada:
+                logger.info(
+                    f"Resultado de {chave} compartilhado com {chamada.compartilhada} chamadas."
+                )
+
+    def em_andamento(self, chave: Hashable) -> bool:
+        with self._lock:
+            return chave in self._chamadas
+
+
+singleflight = SingleFlight()
@@ -0,0 +1,72 @@
+import argparse
+import signal
+import threading
+from app.configuracoes import filiais, fila_threads
+from app.database import SessionLocal
+from app.migracoes import aplicar_migracoes
+from app.routers.faturamento.fila import TAREFAS, enfileirar_tarefas, worker_fila
+from app.routers.faturamento.outbox import drenador_outbox
+
+"""
+Worker da fila de tarefas
+
+Consome a fila `scanntech_fila_tarefas` (ver `app.routers.faturamento.fila`). Vários workers, em um ou mais
+containers, podem rodar ao mesmo tempo: cada tarefa (tarefa, filial, dia) é executada por apenas um deles.
+
+Uso:
+    # Consome a fila até receber SIGINT/SIGTERM
+    python -m app.worker --threads 4
+
+    # Enfileira um backfill e sai (os workers em execução o processam)
+    python -m app.worker --enfileirar faturamento,fechamento --inicio 01/08/2024 --fim 31/08/2024 --sair
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker da fila de tarefas")
+    parser.add_argument("--threads", type=int, default=fila_threads)
+    parser.add_argument(
+        "--enfileirar",
+        default=None,
+        help=f"tarefas a enfileirar antes de consumir ({', '.join(TAREFAS)})",
+    )
+    parser.add_argument("--inicio", default=None, help="data inicial (dd/mm/aaaa)")
+    parser.add_argument("--fim", default=None, help="data final (dd/mm/aaaa)")
+    parser.add_argument("--filiais", default=None, help="filiais separadas por vírgula")
+    parser.add_argument("--sair", action="store_true", help="apenas enfileira, sem consumir")
+    args = parser.parse_args()
+
+    aplicar_migracoes()
+
+    if args.enfileirar:
+        db = SessionLocal()
+        try:
+            quantidade = enfileirar_tarefas(
+                db,
+                args.enfileirar.split(","),
+                args.filiais.split(",") if args.filiais else filiais,
+                args.inicio,
+                args.fim,
+            )
+            print(f"{quantidade} tarefas enfileiradas.")
+        finally:
+            db.close()
+    if args.sair:
+        return
+
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    signal.signal(signal.SIGINT, lambda *_: parar.set())
+
+    worker_fila.threads = args.threads
+    worker_fila.iniciar()
+    # Os envios que falharem ficam no outbox; o worker também o drena
+    drenador_outbox.iniciar()
+    parar.wait()
+    print("Encerrando o worker após as tarefas em andamento...")
+    drenador_outbox.parar()
+    worker_fila.parar()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import argparse
+import json
+import time
+from datetime import date, datetime
+
+"""
+Benchmark do caminho de envio para a ScannTech
+
+Executa as tarefas noturnas de `scriptSend` (ou um envio sintético, sem banco de dados) contra o mock em
+`bench/mock_scanntech.py` e reporta o tempo total, a vazão, as latências p50/p99 por família de endpoint e
+o tamanho dos corpos enviados.
+
+Uso:
+    uvicorn bench.mock_scanntech:app --port 8900
+    SCANNTECH_URL_BASE=http://localhost:8900/api-minoristas/api python -m bench.benchmark_envio \\
+        --tarefas faturamento,fechamento --inicio 01/08/2024 --fim 01/08/2024
+
+    # Sem banco de dados: gera N notas sintéticas e as envia em lotes pelo cliente
+    SCANNTECH_URL_BASE=http://localhost:8900/api-minoristas/api python -m bench.benchmark_envio --sintetico 5000
+
+Atenção: as tarefas gravam envios no banco configurado em SQLALCHEMY_DATABASE_URL. Por padrão, os envios
+criados durante o benchmark são removidos ao final (use --manter-envios para mantê-los). O benchmark se
+recusa a rodar com `url_base` apontando para a ScannTech de produção.
+"""
+
+
+def _executar_tarefa(tarefa: str, args):
+    from app.routers.faturamento import scriptSend
+
+    if tarefa == "faturamento":
+        return scriptSend.tarefa_periodica_envio_faturamento(
+            centro=args.centro,
+            data_inicial=args.inicio,
+            data_final=args.fim,
+            delta=args.delta,
+        )
+    if tarefa == "fechamento":
+        return scriptSend.tarefa_periodica_envio_fechamento(
+            centro=args.centro, data_inicial=args.inicio, data_final=args.fim
+        )
+    if tarefa == "cancelamentos":
+        return scriptSend.tarefa_periodica_verificacao_cancelamentos(centro=args.centro)
+    if tarefa == "devolucoes":
+        return scriptSend.tarefa_periodica_verificacao_devolucoes(centro=args.centro)
+    raise ValueError(f"Tarefa desconhecida: {tarefa}")
+
+
+def _nota_sintetica(numero: int) -> bytes:
+    from app.routers.faturamento.schemas import Detalles, ModelScannTech, Pagos
+
+    detalles = [
+        Detalles(
+            importe=512.35,
+            recargo=0.0,
+            cantidad=2,
+            descuento=10.0,
+            codigoBarras="7891234567890",
+            codigoArticulo=f"{100000 + i}",
+            importeUnitario=261.17,
+            descripcionArticulo="PNEU 205/55R16 SINTETICO",
+        )
+        for i in range(3)
+    ]
+    return ModelScannTech(
+        fecha=f"{date.today().isoformat()}T10:00:00.000-0300",
+        pagos=[Pagos(importe=1537.05, codigoTipoPago=9, documentoCliente=None)],
+        total=1537.05,
+        numero=str(numero),
+        detalles=detalles,
+        idCliente="61999912345678",
+        cancelacion=False,
+        recargoTotal=0,
+        descuentoTotal=30.0,
+        codigoCanalVenta=1,
+        documentoCliente=None,
+        descripcionCanalVenta="VENDA NA LOJA",
+    ).model_dump_json().encode()
+
+
+def _executar_sintetico(quantidade: int, filial: str):
+    from concurrent.futures import ThreadPoolExecutor
+    from app.configuracoes import url_base, idEmpresa, idCaja, lote_envios_concorrentes
+    from app.serializacao import dividir_em_lotes
+    from app.scanntech import cliente_scanntech
+
+    lotes = dividir_em_lotes(
+        [(str(numero), _nota_sintetica(numero)) for numero in range(quantidade)]
+    )
+    url = f"{url_base}/v2/minoristas/{idEmpresa}/locales/{filial}/cajas/{idCaja}/movimientos/lotes"
+    with ThreadPoolExecutor(max_workers=lote_envios_concorrentes) as pool:
+        respostas = list(
+            pool.map(lambda lote: cliente_scanntech.post(url, data=lote[1]), lotes)
+        )
+    return [resposta.status_code for resposta in respostas]
+
+
+def _limpar_envios(id_inicial: int):
+    from app.database import SessionLocal
+    from app.routers.faturamento.models import Envios, NotaEnviada
+
+    db = SessionLocal()
+    try:
+        db.query(NotaEnviada).filter(NotaEnviada.envio_id > id_inicial).delete()
+        db.query(Envios).filter(Envios.id > id_inicial).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+def _ultimo_envio() -> int:
+    from sqlalchemy import func
+    from app.database import SessionLocal
+    from app.routers.faturamento.models import Envios
+
+    db = SessionLocal()
+    try:
+        return db.query(func.max(Envios.id)).scalar() or 0
+    finally:
+        db.close()
+
+
+def _estatisticas_mock():
+    from app.configuracoes import url_base
+    from app.scanntech import cliente_scanntech
+
+    raiz = url_base.split("/api-minoristas")[0]
+    try:
+        return cliente_scanntech.sessao.get(f"{raiz}/mock/estatisticas", timeout=5).json()
+    except Exception:
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do caminho de envio para a ScannTech")
+    parser.add_argument("--tarefas", default="faturamento,fechamento")
+    parser.add_argument("--inicio", default=datetime.now().strftime("%d/%m/%Y"))
+    parser.add_argument("--fim", default=datetime.now().strftime("%d/%m/%Y"))
+    parser.add_argument("--centro", default=None)
+    parser.add_argument("--repeticoes", type=int, default=1)
+    parser.add_argument("--delta", action="store_true", help="envia em modo delta")
+    parser.add_argument("--sintetico", type=int, default=0, help="número de notas sintéticas")
+    parser.add_argument("--manter-envios", action="store_true")
+    parser.add_argument("--json", action="store_true", help="imprime o relatório em JSON")
+    args = parser.parse_args()
+
+    from app.configuracoes import url_base
+    from app.scanntech import cliente_scanntech
+
+    if "parceiro.scanntech.com" in url_base:
+        raise SystemExit(
+            "url_base aponta para a ScannTech; defina SCANNTECH_URL_BASE para o mock."
+        )
+
+    relatorio = {"url_base": url_base, "execucoes": []}
+    id_inicial = None if args.sintetico else _ultimo_envio()
+    try:
+        for repeticao in range(args.repeticoes):
+            tarefas = ["sintetico"] if args.sintetico else args.tarefas.split(",")
+            for tarefa in tarefas:
+                cliente_scanntech.zerar_metricas()
+                cliente_scanntech.sessao.post(
+                    f"{url_base.split('/api-minoristas')[0]}/mock/zerar", timeout=5
+                )
+                inicio = time.perf_counter()
+                if tarefa == "sintetico":
+                    _executar_sintetico(args.sintetico, args.centro or "0101")
+                else:
+                    _executar_tarefa(tarefa, args)
+                duracao = time.perf_counter() - inicio
+                recebido = _estatisticas_mock()
+                notas = sum(familia.get("notas", 0) for familia in recebido.values())
+                relatorio["execucoes"].append(
+                    {
+                        "tarefa": tarefa,
+                        "repeticao": repeticao + 1,
+                        "duracao_s": round(duracao, 3),
+                        "notas": notas,
+                        "notas_por_s": round(notas / duracao, 1) if duracao else 0,
+                        "cliente": cliente_scanntech.metricas(),
+                        "mock": recebido,
+                    }
+                )
+    finally:
+        if id_inicial is not None and not args.manter_envios:
+            _limpar_envios(id_inicial)
+
+    if args.json:
+        print(json.dumps(relatorio, indent=2))
+        return
+
+    print(f"url_base: {url_base}")
+    for execucao in relatorio["execucoes"]:
+        print(
+            f"\n{execucao['tarefa']} #{execucao['repeticao']}: {execucao['duracao_s']}s, "
+            f"{execucao['notas']} notas ({execucao['notas_por_s']} notas/s)"
+        )
+        for familia, metrica in execucao["cliente"].items():
+            print(
+                f"  {familia:<15} chamadas={metrica['chamadas']:<5} erros={metrica['erros']:<4} "
+                f"p50={metrica['p50'] * 1000:.0f}ms p99={metrica['p99'] * 1000:.0f}ms "
+                f"bytes={metrica['bytes']} corpo_p50={metrica['tamanho_p50']} "
+                f"corpo_p99={metrica['tamanho_p99']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
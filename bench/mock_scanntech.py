@@ -0,0 +1,151 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+"""
+Mock da API de minoristas da ScannTech
+
+Substituto local para `url_base`, cobrindo os endpoints usados pela API:
+
+- POST .../locales/{filial}/cajas/{caja}/movimientos/lotes -> {"idLote": "..."}
+- POST .../locales/{filial}/cajas/{caja}/cierresDiarios
+- GET  .../locales/{filial}/solicitudes/{tipo}
+
+Uso:
+    uvicorn bench.mock_scanntech:app --port 8900
+    SCANNTECH_URL_BASE=http://localhost:8900/api-minoristas/api uvicorn app.main:app
+
+Configuração (variáveis de ambiente ou POST /mock/configuracao):
+- MOCK_LATENCIA_MS: latência média de cada resposta, em milissegundos.
+- MOCK_JITTER_MS: variação máxima, para mais ou para menos, da latência.
+- MOCK_TAXA_ERRO: fração (0 a 1) das requisições respondidas com 503.
+- MOCK_SOLICITUDES: número de solicitações de reenvio retornadas por filial e tipo.
+- MOCK_PREFIXO_LOTE: prefixo dos idLote gerados.
+
+GET /mock/estatisticas retorna o que foi recebido (requisições, notas e bytes por família) e
+POST /mock/zerar descarta as estatísticas.
+"""
+
+
+class Configuracao(BaseModel):
+    latencia_ms: float = float(os.getenv("MOCK_LATENCIA_MS", "150"))
+    jitter_ms: float = float(os.getenv("MOCK_JITTER_MS", "50"))
+    taxa_erro: float = float(os.getenv("MOCK_TAXA_ERRO", "0"))
+    solicitudes: int = int(os.getenv("MOCK_SOLICITUDES", "0"))
+    prefixo_lote: str = os.getenv("MOCK_PREFIXO_LOTE", "mock")
+
+
+configuracao = Configuracao()
+_lock = threading.Lock()
+_estatisticas = {}
+
+
+def _registrar(familia: str, bytes_recebidos: int, notas: int, erro: bool):
+    with _lock:
+        estatistica = _estatisticas.setdefault(
+            familia,
+            {"requisicoes": 0, "erros": 0, "notas": 0, "bytes": 0, "tamanhos": []},
+        )
+        estatistica["requisicoes"] += 1
+        estatistica["bytes"] += bytes_recebidos
+        estatistica["tamanhos"].append(bytes_recebidos)
+        estatistica["notas"] += notas
+        if erro:
+            estatistica["erros"] += 1
+
+
+async def _simular(familia: str, corpo: bytes = b"", notas: int = 0):
+    """
+    Aplica a latência configurada e decide se a requisição falha.
+
+    Returns:
+        JSONResponse | None: Uma resposta 503 simulada, ou None se a requisição deve ser atendida.
+    """
+    latencia = configuracao.latencia_ms + random.uniform(
+        -configuracao.jitter_ms, configuracao.jitter_ms
+    )
+    await asyncio.sleep(max(0.0, latencia) / 1000)
+    erro = random.random() < configuracao.taxa_erro
+    _registrar(familia, len(corpo), 0 if erro else notas, erro)
+    if erro:
+        return JSONResponse(status_code=503, content={"mensaje": "mock: erro simulado"})
+    return None
+
+
+router = APIRouter(prefix="/api-minoristas/api/v2/minoristas/{empresa}/locales/{filial}")
+
+
+@router.post("/cajas/{caja}/movimientos/lotes")
+async def lotes(empresa: int, filial: str, caja: int, request: Request):
+    corpo = await request.body()
+    # Conta as notas sem desserializar o lote: cada nota tem exatamente um campo "fecha"
+    notas = corpo.count(b'"fecha"')
+    erro = await _simular("lotes", corpo, notas)
+    if erro:
+        return erro
+    return {"idLote": f"{configuracao.prefixo_lote}-{uuid.uuid4().hex[:12]}"}
+
+
+@router.post("/cajas/{caja}/cierresDiarios")
+async def cierres_diarios(empresa: int, filial: str, caja: int, request: Request):
+    corpo = await request.body()
+    erro = await _simular("cierresDiarios", corpo)
+    if erro:
+        return erro
+    return {}
+
+
+@router.get("/solicitudes/{tipo}")
+async def solicitudes(empresa: int, filial: str, tipo: str):
+    erro = await _simular("solicitudes")
+    if erro:
+        return erro
+    hoje = date.today()
+    return [
+        {"fecha": (hoje - timedelta(days=i + 1)).isoformat(), "codigoCaja": 1, "tipo": tipo}
+        for i in range(configuracao.solicitudes)
+    ]
+
+
+app = FastAPI(title="Mock ScannTech")
+app.include_router(router)
+
+
+@app.get("/mock/estatisticas")
+async def estatisticas():
+    with _lock:
+        return {
+            familia: {
+                chave: valor for chave, valor in estatistica.items() if chave != "tamanhos"
+            }
+            | {
+                "tamanho_maximo": max(estatistica["tamanhos"], default=0),
+            }
+            for familia, estatistica in _estatisticas.items()
+        }
+
+
+@app.post("/mock/zerar")
+async def zerar():
+    with _lock:
+        _estatisticas.clear()
+    return {"zerado_em": time.time()}
+
+
+@app.get("/mock/configuracao")
+async def ler_configuracao():
+    return configuracao
+
+
+@app.post("/mock/configuracao")
+async def alterar_configuracao(nova: Configuracao):
+    global configuracao
+    configuracao = nova
+    return configuracao